@@ -97,6 +97,19 @@ global_typelogged_profiler : bool
     Default: False
     Read-only flag. Use enable_global_typelogged_profiler to change it.
 
+profiler_include_modules : Optional[List[str]]
+    Names of modules or packages the typechecking and typelogging profilers
+    shall consider exclusively (including submodules).
+    Default: None
+    None means that all modules are considered.
+    Can be overridden per TypeChecker or TypeLogger via include_modules.
+
+profiler_exclude_modules : Optional[List[str]]
+    Names of modules or packages the typechecking and typelogging profilers
+    shall ignore (including submodules).
+    Default: None
+    Can be overridden per TypeChecker or TypeLogger via exclude_modules.
+
 warning_mode : bool
     Flag indicating that typecheck errors shall be raised as warnings.
     Default: False
@@ -114,6 +127,11 @@ check_override_at_runtime : bool
 check_override_at_class_definition_time : bool
     Flag indicating override consistency is checked at class definition time.
     Default: True
+    In Python 3 override installs a hook into class creation (requires
+    import_hook_enabled), which removes itself once no class is being built via it.
+    For classes built via the hook, pytypes performs these checks right after the
+    class was built, based on its actual mro. Otherwise it resolves base classes
+    from the class statement in the source.
 
 always_check_parent_types : bool
     Lets typechecked decorator also apply check like done in auto_override.
@@ -230,6 +248,42 @@ deep_type_samplesize : int
     -1 lets pytypes always evaluate the whole list, set or dict, while other
     positive values let it only check a somewhat random sample of that size.
 
+deep_type_sample_seed : Optional[int]
+    Seed for drawing the samples of deep_type_samplesize.
+    Default: None
+    Set this to make the types inferred from samples, e.g. by the typelogger,
+    reproducible across runs. The random number generator is seeded anew
+    whenever this value changes.
+
+check_sample : Optional[Union[SamplePolicy, int]]
+    Lets the typechecker only check a sample of the elements of large lists,
+    dicts and sets.
+    Default: None
+    By default all elements are checked. This can be infeasible for huge
+    containers, e.g. in production. An int is shorthand for SamplePolicy(check_sample),
+    which checks that number of elements per container. See SamplePolicy for other
+    ways of drawing samples. typechecked(sample=...) overrides this per function or class.
+
+check_budget : Optional[Budget]
+    Limits how deep and how many elements of nested containers are checked.
+    Default: None
+    By default values are checked completely, down to default_typecheck_depth.
+    For large nested values, e.g. JSON documents, this can cost far more than the
+    checked function. A Budget defines max_depth, max_elements and whether values
+    exceeding these limits pass, pass with a warning or fail.
+    typechecked(budget=...) overrides this per function or class.
+
+typelogging_sample : Optional[Union[LogSamplePolicy, float, int]]
+    Lets the typelogger only log a fraction of the calls per function.
+    Default: None
+    By default every call is logged, which involves inferring the types of all
+    arguments and the return value. This can be too costly for continuous
+    typelogging, e.g. in production. A float is shorthand for
+    LogSamplePolicy('probability', typelogging_sample), an int for
+    LogSamplePolicy('every', typelogging_sample). See LogSamplePolicy for
+    adaptive sampling. Applies to typelogged and TypeLogger, which can override
+    this via their sample argument.
+
 canonical_type_str : bool
     Forces type_util.type_str to sort parameters of Unions.
     Default: True
@@ -242,6 +296,22 @@ canonical_type_str : bool
     Note that this flag not only affects string representations of Unions, but of
     every type that contains a Union directly or indirectly as a parameter.
 
+subtype_cache_size : int
+    Maximal number of is_subtype results pytypes keeps in its LRU cache.
+    Default: 1024
+    Results are cached per pair of types and the flags they depend on, e.g.
+    apply_numeric_tower, so changing such flags does not require to clear the cache.
+    Checks involving TypeVar bindings, bound_Generic or forward reference
+    recursion are not cached. 0 disables the cache, -1 lets it grow unbounded.
+    See subtype_cache_info and clear_subtype_cache.
+
+check_plan_cache_size : int
+    Maximal number of types pytypes keeps compiled check plans for, per cache.
+    Default: 1024
+    is_of_type and the typechecker compile plans for checking values against
+    a type and cache them in LRU caches. 0 disables the caches, -1 lets them
+    grow unbounded. See clear_check_plan_cache.
+
 dump_typelog_at_exit : bool
     Lets typelogger dump typelog at exit.
     Default: True
@@ -261,7 +331,9 @@ clean_traceback : bool
 import_hook_enabled : bool
     Required for some edgy situations with stubfiles and forward declarations.
     Default: True
-    This lets pytypes hook into import.
+    This lets pytypes hook into import and, for definition time override checks,
+    into class creation (builtins.__build_class__), see
+    check_override_at_class_definition_time.
     In case this is not desired, use this flag to disable it.
     Setting this flag only has effect right after first import of pytypes.
     Note that with this flag disabled, global decorator mode won't work.
@@ -287,6 +359,16 @@ stub_gen_dir : Optional[str]
     When pytypes uses stub_2_convert, the output files will land in this folder.
     If None, tempfile.gettempdir() is used.
 
+stub_resolution_cache : bool
+    Persist stubfile lookup results in stub_gen_dir.
+    Default: False
+    If True and stub_gen_dir is not None, pytypes records which stubfiles were
+    found for a module (or that none was found) in stub_gen_dir/stub_resolution.json
+    and reuses that on later runs, saving the file system probes along stub_path.
+    An entry is discarded if the module file's mtime or stub_path changed.
+    Note that adding a stubfile for a module that had none is only noticed
+    after one of these changes or after deleting the cache file.
+
 default_indent : str
     Indentation used by typelogger when generating stubfiles.
     Default: '\t'
@@ -331,6 +413,8 @@ global_typelogged_decorator = False
 
 global_typechecked_profiler = False
 global_typelogged_profiler = False
+profiler_include_modules = None
+profiler_exclude_modules = None
 
 _global_type_agent = None
 
@@ -368,9 +452,20 @@ tp_comment_parser_import_typing = True
 default_typecheck_depth = 10
 # -1 lets pytypes always evaluate the whole list, set or dict
 deep_type_samplesize = -1
+deep_type_sample_seed = None
+
+# None lets pytypes check all elements of lists, dicts and sets
+check_sample = None
+# None lets pytypes check values completely
+check_budget = None
+# None lets pytypes log every call
+typelogging_sample = None
 
 canonical_type_str = True
 
+subtype_cache_size = 1024
+check_plan_cache_size = 1024
+
 dump_typelog_at_exit = True
 dump_typelog_at_exit_python2 = False
 
@@ -544,6 +639,9 @@ stub_path = []
 # Directory to collect generated stubs. If None, tempfile.gettempdir() is used.
 stub_gen_dir = None
 
+# Persist stubfile lookup results in stub_gen_dir.
+stub_resolution_cache = False
+
 # Used if get_indentation doesn't yield a result.
 default_indent = '\t'
 default_typelogger_path = 'typelogger_output'
@@ -587,9 +685,11 @@ from .type_util import deep_type, is_builtin_type, has_type_hints, resolve_fw_de
     get_generator_yield_type, is_Union, get_Union_params, get_Tuple_params, is_Tuple_ellipsis, \
     get_Callable_args_res, get_Generic_itemtype, get_Mapping_key_value, get_Generic_parameters,\
     get_arg_for_TypeVar, _issubclass as is_subtype, _isinstance as is_of_type, annotations, \
+    _isinstance_many as is_of_type_many, \
     get_member_types, Empty, _catch_up_global_annotations_decorator, TypeAgent, restore_profiler, \
     is_Tuple, is_Generic, is_Callable, _extra_dict as abc2typing_dict, _bases as type_bases, \
-    get_Generic_type, get_orig_class
+    get_Generic_type, get_orig_class, invalidate_signature_cache, subtype_cache_info, \
+    clear_subtype_cache, clear_check_plan_cache, SamplePolicy, Budget
 from .util import getargspecs, get_staticmethod_qualname, get_class_qualname, mro, \
     get_class_that_defined_method, is_method, is_classmethod, _pytypes_excepthook, \
     _install_excepthook
@@ -599,7 +699,8 @@ from .typechecker import typechecked, typechecked_module, no_type_check, \
     _catch_up_global_auto_override_decorator, _catch_up_global_typechecked_decorator, \
     TypeChecker, _checkfunctype, _checkfuncresult
 from .typelogger import dump_cache, log_type, typelogged, typelogged_module, \
-    _catch_up_global_typelogged_decorator, _register_logged_func, TypeLogger
+    _catch_up_global_typelogged_decorator, _register_logged_func, TypeLogger, \
+    LogSamplePolicy
 
 enable_clean_traceback()
 
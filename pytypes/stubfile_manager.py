@@ -17,6 +17,8 @@
 import atexit
 import imp
 import inspect
+import json
+import marshal
 import os
 import subprocess
 import sys
@@ -24,6 +26,12 @@ import tempfile
 import warnings
 from inspect import isclass, ismodule, ismethod
 from typing import Union, Tuple, Callable
+try:
+    from importlib.util import spec_from_file_location, module_from_spec
+    from importlib.machinery import SourceFileLoader
+except ImportError:
+    # Python 2
+    spec_from_file_location = None
 
 import pytypes
 from pytypes import util
@@ -40,6 +48,21 @@ if os.name == 'java':
 else:
     module_filename_delim = '.'
 
+# see pytypes.stub_resolution_cache
+_stub_resolution_cache_name = 'stub_resolution.json'
+# (cache file, {module file: [module name, mtime, cwd, stub_path, pyi files, pyi2 files]})
+_stub_resolution_cache = (None, None)
+# cache files to be written at exit
+_stub_resolution_cache_pending = set()
+_replace_file = getattr(os, 'replace', os.rename)
+
+# Class matches stored in compiled stubs, see compile_stub.
+# {stub module name: ((original path, stub path), ...)}
+_compiled_stub_matches = {}
+# Compiled stubs to store class matches in at exit.
+# {compiled file: (stub file, compiled record, stub module, original module)}
+_compiled_stub_matches_pending = {}
+
 
 def _create_Python_2_stub(module_filepath, out_file = None):
     if out_file is None:
@@ -52,9 +75,13 @@ def _create_Python_2_stub(module_filepath, out_file = None):
             '-s', '-o', out_file, module_filepath], env = {})
 
 
-def _match_classes(stub_module_or_class, original_module_or_class, original_module_name):
-    classes = [cl[1] for cl in inspect.getmembers(original_module_or_class, isclass)]
-    for cl in classes:
+def _match_classes(stub_module_or_class, original_module_or_class, original_module_name,
+            matches = None, path = ((), ())):
+    """If matches is a list, the attribute paths of matched classes in the
+    original and in the stub module are appended to it, see _match_classes_by_path.
+    """
+    classes = inspect.getmembers(original_module_or_class, isclass)
+    for name, cl in classes:
         if cl.__module__ == original_module_name and hasattr(stub_module_or_class, cl.__name__):
             # Todo: What if stub_file uses slots? (unlikely (?))
             stub_class = getattr(stub_module_or_class, cl.__name__)
@@ -62,11 +89,34 @@ def _match_classes(stub_module_or_class, original_module_or_class, original_modu
             # However that might prevent some import tricks and modularity management in
             # a smarter stubfile hierarchy. So we leave it like this for now.
             stub_class._match_type = cl
-            _match_classes(stub_class, cl, original_module_name)
+            cl_path = (path[0]+(name,), path[1]+(cl.__name__,))
+            if not matches is None:
+                matches.append(cl_path)
+            _match_classes(stub_class, cl, original_module_name, matches, cl_path)
+
+
+def _match_classes_by_path(stub_module, original_module, matches):
+    # Applies the matches recorded by _match_classes without walking the modules.
+    for original_path, stub_path in matches:
+        cl = original_module
+        stub_class = stub_module
+        try:
+            for name in original_path:
+                cl = getattr(cl, name)
+            for name in stub_path:
+                stub_class = getattr(stub_class, name)
+        except AttributeError:
+            # E.g. original module is not completely loaded yet.
+            continue
+        stub_class._match_type = cl
 
 
 def _match_module(stub_module, original_module):
-    return _match_classes(stub_module, original_module, original_module.__name__)
+    try:
+        matches = _compiled_stub_matches[stub_module.__name__]
+    except KeyError:
+        return _match_classes(stub_module, original_module, original_module.__name__)
+    _match_classes_by_path(stub_module, original_module, matches)
 
 
 def _re_match_module(module_name, final = False):
@@ -81,22 +131,187 @@ def _re_match_module(module_name, final = False):
         if m_key in _stub_modules_loading:
             stub_m = _stub_modules_loading[m_key]
             _match_module(stub_m, module)
+            pytypes.type_util.invalidate_signature_cache()
             if final:
                 stub_modules[m_key] = stub_m
                 del _stub_modules_loading[m_key]
 
 
+# Not just a 'c' suffix, which is what Python 2's own bytecode files of
+# '.pyi2' stubs are named, e.g. if imported via imp.load_module.
+compiled_stub_suffix = '.pytypesc'
+
+
+def _compiled_stub_filename(stub_file):
+    return stub_file+compiled_stub_suffix
+
+
+def _compile_stub_source(stub_file):
+    # Read as bytes, so compile honours a coding declaration in the stub
+    with open(stub_file, 'rb') as f:
+        return compile(f.read(), stub_file, 'exec', 0, True)
+
+
+def compile_stub(stub_file, out_file = None):
+    """Compiles a stubfile to bytecode, so processes loading it later on can skip
+    parsing and compiling. By default the result is written next to the stubfile,
+    with compiled_stub_suffix appended to the file name (e.g. '.pyi.pytypesc').
+    The compiled file is only used as long as the stubfile's mtime and size
+    match and it was created by the running Python version.
+    The first process that loads a compiled stub matches the stub's classes
+    against those of the original module (see _match_module) and stores the
+    result in the compiled file at exit. Later processes apply the stored
+    matches instead of walking both modules, as long as the original module's
+    file keeps its mtime and size.
+    Returns the name of the compiled file.
+    """
+    if out_file is None:
+        out_file = _compiled_stub_filename(stub_file)
+    code = _compile_stub_source(stub_file)
+    st = os.stat(stub_file)
+    _write_compiled_stub(out_file, (st.st_mtime, st.st_size, code, None))
+    return out_file
+
+
+def _write_compiled_stub(out_file, record):
+    # record is (stub mtime, stub size, code, class matches or None), where class
+    # matches are (original file, original mtime, original size, matches).
+    tmp_file = out_file+'.'+str(os.getpid())
+    with open(tmp_file, 'wb') as f:
+        marshal.dump((imp.get_magic(),)+record, f)
+    _replace_file(tmp_file, out_file)
+
+
+def _load_compiled_stub(stub_file):
+    """Returns the record written by _write_compiled_stub or None if there is no
+    valid compiled file for stub_file.
+    """
+    try:
+        with open(_compiled_stub_filename(stub_file), 'rb') as f:
+            record = marshal.load(f)
+        magic, mtime, size, code, matches = record
+        st = os.stat(stub_file)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    if magic != imp.get_magic() or mtime != st.st_mtime or size != st.st_size:
+        return None
+    return record[1:]
+
+
+def _module_file_stat(module):
+    try:
+        module_file = module.__file__
+        st = os.stat(module_file)
+    except (AttributeError, TypeError, OSError):
+        return None
+    return (module_file, st.st_mtime, st.st_size)
+
+
+def _use_compiled_stub_matches(stub_module, original_module, stub_file, record):
+    """Lets _match_module use the class matches stored in record if they are
+    still valid. Otherwise they will be stored at exit.
+    """
+    original_stat = _module_file_stat(original_module)
+    if original_stat is None:
+        return
+    matches = record[3]
+    if not matches is None and tuple(matches[:3]) == original_stat:
+        _compiled_stub_matches[stub_module.__name__] = matches[3]
+    else:
+        _compiled_stub_matches.pop(stub_module.__name__, None)
+        if len(_compiled_stub_matches_pending) == 0:
+            atexit.register(_save_compiled_stub_matches)
+        _compiled_stub_matches_pending[_compiled_stub_filename(stub_file)] = \
+                (stub_file, record, stub_module, original_module)
+
+
+def _save_compiled_stub_matches():
+    for compiled_file in _compiled_stub_matches_pending:
+        stub_file, record, stub_module, original_module = \
+                _compiled_stub_matches_pending[compiled_file]
+        original_stat = _module_file_stat(original_module)
+        try:
+            st = os.stat(stub_file)
+        except OSError:
+            continue
+        if original_stat is None or (st.st_mtime, st.st_size) != record[:2]:
+            continue
+        # By now the original module is completely loaded.
+        matches = []
+        _match_classes(stub_module, original_module, original_module.__name__, matches)
+        try:
+            _write_compiled_stub(compiled_file,
+                    record[:3]+(original_stat+(tuple(matches),),))
+        except (IOError, OSError):
+            pass
+    _compiled_stub_matches_pending.clear()
+
+
+def _stub_package(original_module):
+    # Relative imports in a stub refer to the package of the original module.
+    # The stub module's name ends with '.pyi', so it cannot tell the package.
+    pck = getattr(original_module, '__package__', None)
+    if pck is None:
+        if hasattr(original_module, '__path__'):
+            pck = original_module.__name__
+        else:
+            pck = original_module.__name__.rpartition('.')[0]
+    return pck
+
+
+def _exec_stub(name, stub_file, code, original_module, compiled_file = None):
+    # Mimics imp.load_module, i.e. re-uses a module of the same name if present,
+    # but with the package of original_module.
+    stub_module = sys.modules.get(name)
+    new_module = stub_module is None
+    if spec_from_file_location is None:
+        if new_module:
+            stub_module = imp.new_module(name)
+        stub_module.__file__ = stub_file
+    else:
+        spec = spec_from_file_location(name, stub_file,
+                loader = SourceFileLoader(name, stub_file))
+        spec.cached = compiled_file
+        if new_module:
+            stub_module = module_from_spec(spec)
+        else:
+            stub_module.__spec__ = spec
+            stub_module.__loader__ = spec.loader
+            stub_module.__file__ = stub_file
+            stub_module.__cached__ = compiled_file
+    stub_module.__package__ = _stub_package(original_module)
+    if new_module:
+        sys.modules[name] = stub_module
+    try:
+        exec(code, stub_module.__dict__)
+    except:
+        if new_module:
+            sys.modules.pop(name, None)
+        raise
+    return stub_module
+
+
 def _get_stub_module(module_filepath, original_module):
     module_name = os.path.basename(module_filepath)
     pck = original_module.__name__.rsplit('.', 1)[0]
+    record = _load_compiled_stub(module_filepath)
     try:
-        with open(module_filepath) as module_file:
-            with warnings.catch_warnings():
-                warnings.simplefilter('ignore')
-                stub_module = imp.load_module(pck+'.'+module_name, module_file, module_filepath, stub_descr)
-                if sys.version_info.major >= 3:
-                    _match_module(stub_module, original_module)
-                return stub_module
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            if record is None:
+                stub_module = _exec_stub(pck+'.'+module_name, module_filepath,
+                        _compile_stub_source(module_filepath), original_module)
+            else:
+                stub_module = _exec_stub(pck+'.'+module_name, module_filepath,
+                        record[2], original_module, _compiled_stub_filename(module_filepath))
+            if sys.version_info.major >= 3:
+                if record is None:
+                    _compiled_stub_matches.pop(stub_module.__name__, None)
+                else:
+                    _use_compiled_stub_matches(stub_module, original_module,
+                            module_filepath, record)
+                _match_module(stub_module, original_module)
+            return stub_module
     except SyntaxError:
         return None
 
@@ -109,6 +324,75 @@ def _find_stub_files(module_name):
             file_name2, pytypes.stub_path)
 
 
+def _get_stub_resolution_cache():
+    global _stub_resolution_cache
+    if not pytypes.stub_resolution_cache or pytypes.stub_gen_dir is None:
+        return None
+    cache_file = os.path.join(os.path.abspath(pytypes.stub_gen_dir),
+            _stub_resolution_cache_name)
+    if _stub_resolution_cache[0] != cache_file:
+        _stub_resolution_cache = (cache_file, _load_stub_resolution_cache(cache_file))
+    return _stub_resolution_cache[1]
+
+
+def _load_stub_resolution_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            return entries
+    except (IOError, OSError, ValueError):
+        pass
+    return {}
+
+
+def _save_stub_resolution_cache(cache_file, entries):
+    # Merge with entries other processes might have written meanwhile.
+    res = _load_stub_resolution_cache(cache_file)
+    res.update(entries)
+    tmp_file = cache_file+'.'+str(os.getpid())
+    try:
+        dirname = os.path.dirname(cache_file)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(tmp_file, 'w') as f:
+            json.dump(res, f)
+        _replace_file(tmp_file, cache_file)
+    except (IOError, OSError):
+        pass
+
+
+def _find_stub_files_cached(module_name, module_file, module_filepath, module_filepath2):
+    """Like _find_stub_files, but also considers the stubs next to module_file and
+    consults the persistent cache described at pytypes.stub_resolution_cache.
+    """
+    cache = _get_stub_resolution_cache()
+    if not cache is None:
+        try:
+            key = [module_name, os.stat(module_file).st_mtime, os.getcwd(),
+                    list(pytypes.stub_path)]
+        except OSError:
+            cache = None
+    if not cache is None:
+        entry = cache.get(module_file)
+        if not entry is None and entry[:4] == key:
+            # Only found stubs need to be verified, a no-stub entry is used as is.
+            if all(os.path.isfile(stub_file) for stub_file in entry[4]+entry[5]):
+                return list(entry[4]), list(entry[5])
+    stub_files = _find_stub_files(module_name)
+    if os.path.isfile(module_filepath):
+        stub_files[0].append(module_filepath)
+    if os.path.isfile(module_filepath2):
+        stub_files[1].append(module_filepath2)
+    if not cache is None:
+        cache[module_file] = key+[list(stub_files[0]), list(stub_files[1])]
+        cache_file = _stub_resolution_cache[0]
+        if not cache_file in _stub_resolution_cache_pending:
+            _stub_resolution_cache_pending.add(cache_file)
+            atexit.register(_save_stub_resolution_cache, cache_file, cache)
+    return stub_files
+
+
 def _plain_stub2_filename(stub_file):
     return stub_file.rpartition(module_filename_delim)[0]+'.pyi2'
 
@@ -175,11 +459,12 @@ def get_stub_module(func):
     mdfile = mdfile.replace('__pyclasspath__', os.path.realpath(''))
     module_filepath = mdfile.rpartition(module_filename_delim)[0]+'.pyi'
     module_filepath2 = _plain_stub2_filename(mdfile)
-    stub_files = _find_stub_files(m_name)
-    if os.path.isfile(module_filepath):
-        stub_files[0].append(module_filepath)
-    if os.path.isfile(module_filepath2):
-        stub_files[1].append(module_filepath2)
+    stub_files = _find_stub_files_cached(m_name, mdfile, module_filepath, module_filepath2)
+    if not (stub_files[0] or stub_files[1]):
+        # No stub-file available (generated Python 2-style stubs are only
+        # used along with the stub they were converted from)
+        stub_modules[m_key] = None
+        return None
     module_filepath2_gen = _gen_stub2_filename(module_filepath, module)
     if not (sys.version_info.major >= 3 and sys.version_info.minor >= 5):
         # Python version < 3.5, so try to use a Python 2-style stub.
@@ -219,7 +504,7 @@ def get_stub_module(func):
     # Finally try to convert a Python3 stub to Python2-style:
     if not (sys.version_info.major >= 3 and sys.version_info.minor >= 5):
         # Most likely the module-stub could not be loaded due to Python 3.5-syntax
-        if util._check_python3_5_version():
+        if stub_files[0] and util._check_python3_5_version():
             for module_filepath in stub_files[0]:
                 # We try to use a local Python 3 version to generate a Python 2-style stub:
                 _create_Python_2_stub(module_filepath, module_filepath2_gen)
@@ -227,7 +512,6 @@ def get_stub_module(func):
                     stub_module = _get_stub_module(module_filepath2_gen, module)
                     if pytypes.stub_gen_dir is None:
                         atexit.register(os.remove, module_filepath2_gen)
-                        atexit.register(os.remove, module_filepath2_gen+'c')
                         # Todo: Clean up other potential by-products
                     if not stub_module is None:
                         _stub_modules_loading[m_key] = stub_module
@@ -347,3 +631,58 @@ def as_stub_func_if_any(func0, decorated_func = None, func_class = None, nesting
                 except AttributeError:
                     pass
     return func0
+
+
+def _find_stub_files_in(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if filename.endswith('.pyi') or filename.endswith('.pyi2'):
+                        yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+
+def err_no_in_file():
+    print("Error: No stubfile or directory given! Use -h for help.")
+    sys.exit(os.EX_USAGE)
+
+
+def print_usage():
+    print("stubfile_manager usage:")
+    print("python -m pytypes.stubfile_manager compile [options/flags] [files/dirs]")
+    print("Compiles the given stubfiles and all stubfiles found in the given")
+    print("directories to bytecode, see compile_stub. Class matches of a compiled")
+    print("stub are added by the first process that loads it.")
+    print("Supported options/flags:")
+    print(" -s            : silent mode")
+    print(" -h            : usage")
+
+
+def main():
+    if '-h' in sys.argv:
+        print_usage()
+        sys.exit(0)
+    if len(sys.argv) < 2 or sys.argv[1] != 'compile':
+        print_usage()
+        sys.exit(os.EX_USAGE)
+    silent = '-s' in sys.argv
+    paths = [arg for arg in sys.argv[2:] if not arg.startswith('-')]
+    if len(paths) == 0:
+        err_no_in_file()
+    failed = False
+    for stub_file in _find_stub_files_in(paths):
+        try:
+            out_file = compile_stub(stub_file)
+            if not silent:
+                print(out_file)
+        except (IOError, OSError, SyntaxError) as e:
+            failed = True
+            print('Error: Could not compile %s: %s' % (stub_file, e))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,8 @@
 # Created on 13.12.2016
 
 import random
+import itertools
+import array
 import sys
 import types
 import threading
@@ -67,9 +69,45 @@ from . import util
 _annotated_modules = {}
 _extra_dict = {}
 _saved_profilers = {}
+try:
+    # changes whenever an ABC gets a virtual subclass registered
+    from abc import get_cache_token as _abc_cache_token
+except ImportError:
+    # Python 2.7
+    def _abc_cache_token():
+        return None
+
+# resolve_fw_decl results for pure string forward refs, keyed by
+# (string, module name) and per defining function respectively
 _fw_resolve_cache = {}
+_fw_resolve_func_cache = weakref.WeakKeyDictionary()
+_funcsig_cache_generation = 0
+# LRU caches for check plans, see pytypes.check_plan_cache_size
+_check_plan_cache = collections.OrderedDict()
+_type_check_cache = collections.OrderedDict()
+_plain_type_cache = collections.OrderedDict()
+# LRU cache for _issubclass, see pytypes.subtype_cache_size
+_subtype_cache = collections.OrderedDict()
+_subtype_cache_hits = 0
+_subtype_cache_misses = 0
+# pytypes.check_sample and its conversion to SamplePolicy
+_global_sample_policy = (None, None)
+_deep_type_random = (None, random.Random())
+# Types constructed by deep_type, see _deep_type_term
+_deep_type_terms = collections.OrderedDict()
+_deep_type_terms_size = 4096
+_SubtypeCacheInfo = collections.namedtuple('SubtypeCacheInfo',
+        ['hits', 'misses', 'maxsize', 'currsize'])
 _checked_generator_types = weakref.WeakKeyDictionary()
 
+try:
+    # Marks an entry of an LRU OrderedDict as used, for caches on hot paths.
+    _lru_touch = collections.OrderedDict.move_to_end
+except AttributeError:
+    # Python 2
+    def _lru_touch(od, key):
+        od[key] = od.pop(key)
+
 for tp in typing.__all__:
     tpa = getattr(typing, tp)
     try:
@@ -602,11 +640,128 @@ def deep_type(obj, depth = None, max_sample = None, get_type = None):
     Optionally, a custom get_type function can be provided to further
     customize how types are resolved. By default it uses type function.
     """
-    return _deep_type(obj, [], 0, depth, max_sample, get_type)
+    return _deep_type(obj, _Checked(), 0, depth, max_sample, get_type)
+
+
+class _Checked(object):
+    """Helper for _deep_type. Holds the objects visited so far in visiting order.
+    Like a list, but tells in constant time whether an object is contained
+    in a prefix or suffix of it, by looking up the first and last position of
+    its id. Holding the objects keeps their ids unique during the traversal.
+    """
+
+    def __init__(self):
+        self.objs = []
+        self.first = {}
+        self.last = {}
+
+    def __len__(self):
+        return len(self.objs)
+
+    def append(self, obj):
+        key = id(obj)
+        if not key in self.first:
+            self.first[key] = len(self.objs)
+        self.last[key] = len(self.objs)
+        self.objs.append(obj)
+
+    def in_prefix(self, obj, length):
+        """Like util._is_in(obj, checked[:length]).
+        """
+        pos = self.first.get(id(obj))
+        return not pos is None and pos < length
+
+    def in_suffix(self, obj, start):
+        """Like util._is_in(obj, checked[start:]).
+        """
+        pos = self.last.get(id(obj))
+        return not pos is None and pos >= start
+
+
+def _unique_by_id(tps):
+    """Helper for _deep_type_term. Removes repeated objects from tps, keeping the
+    order of first occurrence.
+    """
+    seen = set()
+    res = []
+    for tp in tps:
+        if not id(tp) in seen:
+            seen.add(id(tp))
+            res.append(tp)
+    return tuple(res)
+
+
+def _deep_type_term(origin, *params):
+    """Helper for _deep_type. Constructs Tuple[params[0]] if origin is Tuple, otherwise
+    origin[Union[params[0]], ...], e.g. List[Union[int, str]].
+    Constructed types are interned by the identity of their parameters. So for repeated
+    results deep_type yields identical objects, which can be compared and hashed cheaply,
+    and the subscription machinery of typing is not involved. Since deep_type is
+    interned itself, parameters are typically identical if they are equal.
+    """
+    if not origin is Tuple:
+        params = tuple(_unique_by_id(prms) for prms in params)
+    key = (origin,)+tuple(tuple(id(tp) for tp in prms) for prms in params)
+    try:
+        # Holding params keeps the ids in key valid
+        res = _deep_type_terms.pop(key)[1]
+    except KeyError:
+        if origin is Tuple:
+            res = Tuple[params[0]]
+        elif len(params) == 1:
+            res = origin[Union[params[0]]]
+        else:
+            res = origin[Union[params[0]], Union[params[1]]]
+    _deep_type_terms[key] = (params, res)
+    try:
+        while len(_deep_type_terms) > _deep_type_terms_size:
+            _deep_type_terms.popitem(False)
+    except KeyError:
+        # concurrently emptied
+        pass
+    return res
+
+
+def _get_deep_type_random():
+    """Returns the random number generator deep_type uses to draw samples.
+    It is seeded with pytypes.deep_type_sample_seed.
+    """
+    global _deep_type_random
+    if not _deep_type_random[0] is pytypes.deep_type_sample_seed:
+        _deep_type_random = (pytypes.deep_type_sample_seed,
+                random.Random(pytypes.deep_type_sample_seed))
+    return _deep_type_random[1]
+
+
+def _sample_positions(length, size):
+    """Helper for _deep_type. Draws size distinct positions from range(length)
+    in O(size) and returns them sorted.
+    """
+    try:
+        res = _get_deep_type_random().sample(xrange(length), size)
+    except NameError:
+        res = _get_deep_type_random().sample(range(length), size)
+    res.sort()
+    return res
+
+
+def _sample_iter(itr, positions):
+    """Returns the elements of itr at the given sorted positions.
+    This walks itr up to the largest position, i.e. it takes O(len) time
+    even for small samples. Dicts and sets offer no access by position.
+    """
+    res = []
+    pos = 0
+    for i in positions:
+        # islice skips the elements in between without inspecting them,
+        # but it still has to step over each of them.
+        res.append(next(itertools.islice(itr, i-pos, None)))
+        pos = i+1
+    return res
 
 
 def _deep_type(obj, checked, checked_len, depth = None, max_sample = None, get_type = None):
-    """checked_len allows to operate with a fake length for checked.
+    """checked is a _Checked. checked_len allows to operate with a fake length for checked.
     This is necessary to ensure that each depth level operates based
     on the same checked list subset. Otherwise our recursion detection
     mechanism can fall into false-positives.
@@ -624,9 +779,9 @@ def _deep_type(obj, checked, checked_len, depth = None, max_sample = None, get_t
             res = get_orig_class(obj, True)
         except AttributeError:
             res = type(obj)
-    if depth == 0 or util._is_in(obj, checked[:checked_len]):
+    if depth == 0 or checked.in_prefix(obj, checked_len):
         return res
-    elif not util._is_in(obj, checked[checked_len:]):
+    elif not checked.in_suffix(obj, checked_len):
         checked.append(obj)
     # We must operate with a consistent checked list for one certain depth level
     # to avoid issues with a list, tuple, dict, etc containing the same element
@@ -635,7 +790,8 @@ def _deep_type(obj, checked, checked_len, depth = None, max_sample = None, get_t
     # a common fake length of checked list:
     checked_len2 = len(checked)
     if res == tuple:
-        res = Tuple[tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) for t in obj)]
+        res = _deep_type_term(Tuple, tuple(_deep_type(t, checked, checked_len2, depth-1, None,
+                get_type) for t in obj))
     elif res == list:
         if len(obj) == 0:
             return Empty[List]
@@ -646,54 +802,30 @@ def _deep_type(obj, checked, checked_len, depth = None, max_sample = None, get_t
             # first and last element are part of the sample
             sample = [0, len(obj)-1]
             try:
-                rsmp = random.sample(xrange(1, len(obj)-1), max_sample-2)
+                rsmp = _get_deep_type_random().sample(xrange(1, len(obj)-1), max_sample-2)
             except NameError:
-                rsmp = random.sample(range(1, len(obj)-1), max_sample-2)
+                rsmp = _get_deep_type_random().sample(range(1, len(obj)-1), max_sample-2)
             sample.extend(rsmp)
             tpl = tuple(_deep_type(obj[t], checked, checked_len2, depth-1, None, get_type) for t in sample)
-        res = List[Union[tpl]]
+        res = _deep_type_term(List, tpl)
     elif res == dict:
         if len(obj) == 0:
             return Empty[Dict]
         if max_sample == -1 or max_sample >= len(obj)-1 or len(obj) <= 2:
             try:
                 # We prefer a view (avoid copy)
-                tpl1 = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) \
-                        for t in obj.viewkeys())
-                tpl2 = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) \
-                        for t in obj.viewvalues())
+                keys = obj.viewkeys()
+                vals = obj.viewvalues()
             except AttributeError:
                 # Python 3 gives views like this:
-                tpl1 = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) for t in obj.keys())
-                tpl2 = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) for t in obj.values())
+                keys = obj.keys()
+                vals = obj.values()
         else:
-            try:
-                kitr = iter(obj.viewkeys())
-                vitr = iter(obj.viewvalues())
-            except AttributeError:
-                kitr = iter(obj.keys())
-                vitr = iter(obj.values())
-            ksmpl = []
-            vsmpl = []
-            block = (len(obj) // max_sample)-1
-            # I know this method has some bias towards beginning of iteration
-            # sequence, but it's still more random than just taking the
-            # initial sample and better than O(n) random.sample.
-            while len(ksmpl) < max_sample:
-                if block > 0:
-                    j = random.randint(0, block)
-                    k = random.randint(0, block)
-                    while j > 0:
-                        next(vitr) # discard
-                        j -= 1
-                    while k > 0:
-                        next(kitr) # discard
-                        k -= 1
-                ksmpl.append(next(kitr))
-                vsmpl.append(next(vitr))
-            tpl1 = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) for t in ksmpl)
-            tpl2 = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) for t in vsmpl)
-        res = Dict[Union[tpl1], Union[tpl2]]
+            keys = _sample_iter(iter(obj), _sample_positions(len(obj), max_sample))
+            vals = [obj[key] for key in keys]
+        tpl1 = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) for t in keys)
+        tpl2 = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) for t in vals)
+        res = _deep_type_term(Dict, tpl1, tpl2)
     elif res == set or res == frozenset:
         if res == set:
             typ = Set
@@ -702,23 +834,11 @@ def _deep_type(obj, checked, checked_len, depth = None, max_sample = None, get_t
         if len(obj) == 0:
             return Empty[typ]
         if max_sample == -1 or max_sample >= len(obj)-1 or len(obj) <= 2:
-            tpl = tuple(_deep_type(t, checked, depth-1, None, None, get_type) for t in obj)
+            smpl = obj
         else:
-            itr = iter(obj)
-            smpl = []
-            block = (len(obj) // max_sample)-1
-            # I know this method has some bias towards beginning of iteration
-            # sequence, but it's still more random than just taking the
-            # initial sample and better than O(n) random.sample.
-            while len(smpl) < max_sample:
-                if block > 0:
-                    j = random.randint(0, block)
-                    while j > 0:
-                        next(itr) # discard
-                        j -= 1
-                smpl.append(next(itr))
-            tpl = tuple(_deep_type(t, checked, depth-1, None, None, get_type) for t in smpl)
-        res = typ[Union[tpl]]
+            smpl = _sample_iter(iter(obj), _sample_positions(len(obj), max_sample))
+        tpl = tuple(_deep_type(t, checked, checked_len2, depth-1, None, get_type) for t in smpl)
+        res = _deep_type_term(typ, tpl)
     elif res == types.GeneratorType:
         res = get_generator_type(obj)
     elif sys.version_info.major == 2 and isinstance(obj, types.InstanceType):
@@ -731,6 +851,258 @@ def _deep_type(obj, checked, checked_len, depth = None, max_sample = None, get_t
     return res
 
 
+class SamplePolicy(object):
+    """Lets the typechecker only check a sample of the elements of large lists,
+    dicts and sets (including nested ones) rather than all of them.
+    Apply it via typechecked(sample=...) or globally via pytypes.check_sample.
+
+    size : int
+    The number of elements to check per container. Containers with at most this
+    number of elements are checked completely.
+
+    mode : str
+    How elements are selected. Default: 'random'
+    'random' checks first and last element plus size-2 randomly drawn ones.
+    'strided' checks size elements evenly spread over the container.
+    'first' checks the first size elements.
+
+    seed : Optional[int]
+    Seed for the random number generator used by mode 'random'.
+    Default: None
+
+    Positions are drawn in O(size). Lists are accessed at these positions directly.
+    For dicts and sets, the iterator has to step over all elements up to the
+    largest position, so drawing a sample from them still takes O(len) time.
+    Only the sampled elements are type-checked though.
+    """
+
+    modes = ('random', 'strided', 'first')
+
+    def __init__(self, size, mode = 'random', seed = None):
+        if not mode in SamplePolicy.modes:
+            raise ValueError('Unknown sample mode: %s. Use one of %s'
+                    % (mode, str(SamplePolicy.modes)))
+        if size < 1:
+            raise ValueError('Sample size must be positive, not %d' % size)
+        self.size = size
+        self.mode = mode
+        self._random = random.Random(seed)
+
+    def __repr__(self):
+        return 'SamplePolicy(%d, %r)' % (self.size, self.mode)
+
+    def indices(self, length):
+        """Returns the sorted positions to check in a container of the given length.
+        Returns None if the whole container is to be checked.
+        """
+        if length <= self.size:
+            return None
+        if self.mode == 'first':
+            return range(self.size)
+        if self.mode == 'strided' or self.size < 3:
+            if self.size == 1:
+                return [0]
+            step = (length-1) / float(self.size-1)
+            return [int(round(i*step)) for i in range(self.size)]
+        try:
+            res = self._random.sample(xrange(1, length-1), self.size-2)
+        except NameError:
+            res = self._random.sample(range(1, length-1), self.size-2)
+        res.sort()
+        res.insert(0, 0)
+        res.append(length-1)
+        return res
+
+    def sample(self, obj, depth = None):
+        """Returns a version of obj that contains only a sample of large lists,
+        dicts and sets within obj, down to the given depth (uses
+        pytypes.default_typecheck_depth if no value is given).
+        Returns obj itself if nothing was left out.
+        """
+        if depth is None:
+            depth = pytypes.default_typecheck_depth
+        return self._sample(obj, depth)
+
+    def _sample(self, obj, depth):
+        tp = type(obj)
+        if depth == 0 or not tp in (list, tuple, dict, set, frozenset):
+            return obj
+        positions = None if tp is tuple else self.indices(len(obj))
+        if tp is dict:
+            if positions is None:
+                keys = list(obj)
+            else:
+                keys = _sample_iter(iter(obj), positions)
+            res = {}
+            changed = not positions is None
+            for key in keys:
+                val = obj[key]
+                key2 = self._sample(key, depth-1)
+                val2 = self._sample(val, depth-1)
+                changed = changed or not key2 is key or not val2 is val
+                res[key2] = val2
+            return res if changed else obj
+        if positions is None:
+            elems = obj
+        elif tp is list:
+            elems = [obj[i] for i in positions]
+        else:
+            elems = _sample_iter(iter(obj), positions)
+        res = [self._sample(elem, depth-1) for elem in elems]
+        if positions is None and all(elem2 is elem for elem2, elem in zip(res, obj)):
+            return obj
+        return res if tp is list else tp(res)
+
+
+class Budget(object):
+    """Limits how much of nested lists, tuples, dicts and sets the typechecker explores.
+    Apply it via typechecked(budget=...) or globally via pytypes.check_budget.
+
+    max_depth : Optional[int]
+    The number of nested container levels to check.
+    Default: None (no limit, pytypes.default_typecheck_depth applies)
+
+    max_elements : Optional[int]
+    The number of container elements to check per checked value, i.e. for the
+    arguments of a call resp. for its return value. A dict item counts as one element.
+    Default: None (no limit)
+
+    Tuples are always checked completely, because their length is part of their
+    type. So they neither count as a level nor do their elements count.
+
+    exceeded : str
+    What happens if a value exceeds the budget. Default: 'pass'
+    'pass' checks the value as far as the budget allows and accepts the rest.
+    'warn' does the same, but also issues a TypeWarning.
+    'fail' fails the check like a type mismatch.
+
+    Containers beyond the budget are checked as if they were empty, so e.g. a
+    List[Dict[str, int]] with max_depth=1 is checked to be a list of dicts.
+    Whether a value exceeds the budget is decided by exploring at most max_elements
+    elements resp. max_depth levels of it.
+    """
+
+    outcomes = ('pass', 'warn', 'fail')
+
+    def __init__(self, max_depth = None, max_elements = None, exceeded = 'pass'):
+        if not exceeded in Budget.outcomes:
+            raise ValueError('Unknown budget outcome: %s. Use one of %s'
+                    % (exceeded, str(Budget.outcomes)))
+        if not max_depth is None and max_depth < 0:
+            raise ValueError('max_depth must not be negative, not %d' % max_depth)
+        if not max_elements is None and max_elements < 0:
+            raise ValueError('max_elements must not be negative, not %d' % max_elements)
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.exceeded = exceeded
+
+    def __repr__(self):
+        return 'Budget(max_depth=%r, max_elements=%r, exceeded=%r)' % (
+                self.max_depth, self.max_elements, self.exceeded)
+
+    def exceeded_by(self, obj):
+        """Tells whether checking obj completely would exceed this budget.
+        """
+        if self.max_depth is None and self.max_elements is None:
+            return False
+        return self._exceeds(obj, 0, [self.max_elements])
+
+    def _exceeds(self, obj, level, remaining):
+        tp = type(obj)
+        if not tp in _budget_container_types or len(obj) == 0:
+            return False
+        if not tp is tuple:
+            if not self.max_depth is None and level >= self.max_depth:
+                return True
+            level += 1
+            if not remaining[0] is None:
+                remaining[0] -= len(obj)
+                if remaining[0] < 0:
+                    return True
+        elems = itertools.chain(obj.keys(), obj.values()) if tp is dict else obj
+        for elem in elems:
+            if type(elem) in _budget_container_types and \
+                    self._exceeds(elem, level, remaining):
+                return True
+        return False
+
+    def _reduce(self, obj, level, remaining):
+        """Returns a version of obj that only contains what this budget allows to check.
+        Containers beyond the budget are cut or replaced by empty ones.
+        Returns obj itself if nothing was left out.
+        remaining is a one-element list holding the number of elements still allowed.
+        """
+        tp = type(obj)
+        if not tp in _budget_container_types or len(obj) == 0:
+            return obj
+        if tp is tuple:
+            res = tuple([self._reduce(elem, level, remaining) for elem in obj])
+            return obj if all(elem2 is elem for elem2, elem in zip(res, obj)) else res
+        if not self.max_depth is None and level >= self.max_depth:
+            return tp()
+        size = len(obj)
+        if not remaining[0] is None:
+            size = max(0, min(size, remaining[0]))
+            remaining[0] -= size
+        if size == 0:
+            return tp()
+        if tp is dict:
+            res = {}
+            changed = size < len(obj)
+            for key, val in itertools.islice(obj.items(), size):
+                key2 = self._reduce(key, level+1, remaining)
+                val2 = self._reduce(val, level+1, remaining)
+                changed = changed or not key2 is key or not val2 is val
+                res[key2] = val2
+            return res if changed else obj
+        elems = obj if size == len(obj) else itertools.islice(obj, size)
+        res = [self._reduce(elem, level+1, remaining) for elem in elems]
+        if size == len(obj) and all(elem2 is elem for elem2, elem in zip(res, obj)):
+            return obj
+        return res if tp is list else tp(res)
+
+
+_budget_container_types = (list, tuple, dict, set, frozenset)
+
+
+class _BudgetSample(object):
+    """Helper for the typechecker. Acts like a SamplePolicy that lets only the part
+    of a value within budget be checked, of which sample, if given, draws a sample.
+    Use one instance per checked value: if the value is a tuple (e.g. the arguments
+    of a call) and its elements are sampled one by one, they share max_elements
+    like in budget.exceeded_by(value).
+    """
+
+    def __init__(self, budget, sample):
+        self.budget = budget
+        self._sample = sample
+        self._remaining = [budget.max_elements]
+
+    def sample(self, obj, depth = None):
+        if not (self.budget.max_depth is None and self.budget.max_elements is None):
+            obj = self.budget._reduce(obj, 0, self._remaining)
+        return obj if self._sample is None else self._sample.sample(obj, depth)
+
+
+def _get_sample_policy(sample):
+    """Helper for typechecked. Turns the sample argument into a SamplePolicy.
+    An int is shorthand for SamplePolicy(sample). None means no sampling.
+    """
+    if sample is None or isinstance(sample, SamplePolicy):
+        return sample
+    return SamplePolicy(sample)
+
+
+def _get_global_sample_policy():
+    """Returns pytypes.check_sample as a SamplePolicy.
+    """
+    global _global_sample_policy
+    if not _global_sample_policy[0] is pytypes.check_sample:
+        _global_sample_policy = (pytypes.check_sample,
+                _get_sample_policy(pytypes.check_sample))
+    return _global_sample_policy[1]
+
+
 def is_builtin_type(tp):
     """Checks if the given type is a builtin one.
     """
@@ -1112,8 +1484,15 @@ def _handle_defaults(sig_types, arg_specs, unspecified_indices=None, slf=False):
     return sig_types
 
 
+def _eval_fw(expr, globs):
+    # globs is either a dict or a util._ScopeView
+    if isinstance(globs, dict):
+        return eval(expr, globs)
+    return eval(expr, globs.globals, globs)
+
+
 def resolve_fw_decl(in_type, module_name=None, globs=None, level=0,
-        search_stack_depth=2):
+        search_stack_depth=2, func=None):
     '''Resolves forward references in ``in_type``, see
     https://www.python.org/dev/peps/pep-0484/#forward-references.
 
@@ -1131,23 +1510,46 @@ def resolve_fw_decl(in_type, module_name=None, globs=None, level=0,
     Ideally provide a proper ``globs`` for best efficiency.
     See ``util.get_function_perspective_globals`` for obtaining a ``globs`` that can be
     cached. ``util.get_function_perspective_globals`` works like described above.
+    ``util.get_function_perspective_view`` provides a lazy variant that avoids
+    copying the module dict. ``resolve_fw_decl`` uses the latter, so if a name is
+    defined in the module and in a stack frame, the module's definition is used.
+
+    If ``func`` is given, the closure of ``func`` is searched as well and results
+    for pure string forward refs are cached per ``func``. Otherwise they are
+    cached per ``module_name``, unless they were resolved via stack frames.
     '''
     # Also see discussion at https://github.com/Stewori/pytypes/pull/43
-    if in_type in _fw_resolve_cache:
-        return _fw_resolve_cache[in_type], True
+    str_cache = None
+    if isinstance(in_type, _basestring):
+        if not func is None:
+            try:
+                str_cache = _fw_resolve_func_cache.setdefault(func, {})
+            except TypeError:
+                # func not weak-referenceable
+                pass
+        elif not module_name is None:
+            str_cache = _fw_resolve_cache
+        if not str_cache is None:
+            try:
+                return str_cache[(in_type, module_name)], True
+            except KeyError:
+                pass
     if globs is None:
-        #if not module_name is None:
-        globs = util.get_function_perspective_globals(module_name, level+1,
+        globs = util.get_function_perspective_view(module_name, func, level+1,
                 level+1+search_stack_depth)
     if isinstance(in_type, _basestring):
         # For the case that a pure forward ref is given as string
-        out_type = eval(in_type, globs)
-        _fw_resolve_cache[in_type] = out_type
+        out_type = _eval_fw(in_type, globs)
+        # Without func, the cache is per module, so it must not keep results
+        # that depend on the caller's frames.
+        if not str_cache is None and (not func is None or
+                not getattr(globs, 'used_frame_locals', False)):
+            str_cache[(in_type, module_name)] = out_type
         return out_type, True
     elif isinstance(in_type, ForwardRef):
         # Todo: Maybe somehow get globs from in_type.__forward_code__
         if not in_type.__forward_evaluated__:
-            in_type.__forward_value__ = eval(in_type.__forward_arg__, globs)
+            in_type.__forward_value__ = _eval_fw(in_type.__forward_arg__, globs)
             in_type.__forward_evaluated__ = True
             return in_type, True
     elif is_Tuple(in_type):
@@ -1168,6 +1570,21 @@ def resolve_fw_decl(in_type, module_name=None, globs=None, level=0,
     return in_type, False
 
 
+def invalidate_signature_cache():
+    """Discards the signatures typechecked functions have cached so far.
+    Typechecked functions resolve their argument and return types on first
+    call and reuse them afterwards. Call this if type information of a
+    function changed later on by other means than re-assigning __annotations__,
+    e.g. by manually editing a stubfile or its matched types.
+    pytypes calls this automatically when a stubfile is (re-)matched.
+    Also lets pytypes search again for functions it failed to find in their
+    module before, e.g. call this after attaching a function to an existing
+    class via setattr.
+    """
+    global _funcsig_cache_generation
+    _funcsig_cache_generation += 1
+
+
 def _funcsigtypes(func0, slf, func_class=None, globs=None, prop_getter=False,
         unspecified_type=Any, infer_defaults=None):
     if infer_defaults is None:
@@ -1184,8 +1601,11 @@ def _funcsigtypes(func0, slf, func_class=None, globs=None, prop_getter=False,
             tpHints = typing.get_type_hints(func)
         except NameError:
             if globs is None:
-                globs = util.get_function_perspective_globals(func.__module__, 3)
-            tpHints = typing.get_type_hints(func, globs)
+                globs = util.get_function_perspective_view(func.__module__, func, 3)
+            if isinstance(globs, dict):
+                tpHints = typing.get_type_hints(func, globs)
+            else:
+                tpHints = typing.get_type_hints(func, globs.globals, globs)
     except AttributeError:
         tpHints = None
     tpStr = _get_typestrings(func, slf)
@@ -1237,8 +1657,8 @@ def _funcsigtypes(func0, slf, func_class=None, globs=None, prop_getter=False,
                     # might be needed again later. Usually resolve_fw_decl can create
                     # globals internally.
                     if globs is None:
-                        globs = util.get_function_perspective_globals(func.__module__, 3)
-                    val = resolve_fw_decl(val, func.__module__, globs, 3)[0]
+                        globs = util.get_function_perspective_view(func.__module__, func, 3)
+                    val = resolve_fw_decl(val, func.__module__, globs, 3, func=func)[0]
                 tpHints[key] = val
         # We're running Python 3 or have custom __annotations__ in Python 2.7
         retTp = tpHints['return'] if 'return' in tpHints else Any
@@ -1257,7 +1677,7 @@ def _funcsigtypes(func0, slf, func_class=None, globs=None, prop_getter=False,
                         % (func.__module__, func.__name__))
             else:
                 if globs is None:
-                    globs = util.get_function_perspective_globals(func.__module__, 3)
+                    globs = util.get_function_perspective_view(func.__module__, func, 3)
                 resType2 = _funcsigtypesfromstring(*tpStr, argspec=argSpecs, glbls=globs,
                         argCount=len(argNames), unspecified_type=unspecified_type,
                         defaults=argSpecs.defaults if infer_defaults else None,
@@ -1279,7 +1699,7 @@ def _funcsigtypes(func0, slf, func_class=None, globs=None, prop_getter=False,
                     util._fully_qualified_func_name(func, slf, func_class), resType[1]))
         return resType
     if globs is None:
-        globs = util.get_function_perspective_globals(func.__module__, 3)
+        globs = util.get_function_perspective_view(func.__module__, func, 3)
     res = _funcsigtypesfromstring(*tpStr, glbls=globs, argspec=argSpecs,
             argCount=len(argNames),
             defaults=argSpecs.defaults if infer_defaults else None,
@@ -1856,6 +2276,68 @@ def _issubclass(subclass, superclass, bound_Generic=None, bound_typevars=None,
     a ``_ForwardRef`` is encountered, pytypes automatically creates this dictionary and
     continues in recursion-proof manner.
     """
+    if bound_typevars is None:
+        bound_typevars = {}
+    if not bound_Generic is None or len(bound_typevars) > 0 or \
+            not _recursion_check is None or pytypes.subtype_cache_size == 0:
+        return _issubclass_uncached(subclass, superclass, bound_Generic, bound_typevars,
+                bound_typevars_readonly, follow_fwd_refs, _recursion_check)
+    global _subtype_cache_hits, _subtype_cache_misses
+    key = (subclass, superclass, bound_typevars_readonly, follow_fwd_refs,
+            pytypes.apply_numeric_tower, pytypes.covariant_Mapping,
+            pytypes.check_unbound_types, pytypes.strict_unknown_check,
+            _abc_cache_token())
+    try:
+        res = _subtype_cache.pop(key)
+    except KeyError:
+        pass
+    except TypeError:
+        # unhashable
+        return _issubclass_uncached(subclass, superclass, bound_Generic, bound_typevars,
+                bound_typevars_readonly, follow_fwd_refs, _recursion_check)
+    else:
+        # re-insert as most recently used
+        _subtype_cache[key] = res
+        _subtype_cache_hits += 1
+        return res
+    _subtype_cache_misses += 1
+    res = _issubclass_uncached(subclass, superclass, bound_Generic, bound_typevars,
+            bound_typevars_readonly, follow_fwd_refs, _recursion_check)
+    # If TypeVars were bound, the result is only valid along with these bindings.
+    if len(bound_typevars) == 0:
+        _subtype_cache[key] = res
+        try:
+            while len(_subtype_cache) > pytypes.subtype_cache_size > 0:
+                _subtype_cache.popitem(False)
+        except KeyError:
+            # concurrently emptied
+            pass
+    return res
+
+
+def subtype_cache_info():
+    """Reports statistics of pytypes' cache for is_subtype results.
+    Returns a named tuple with fields hits, misses, maxsize and currsize
+    in the style of functools.lru_cache. See pytypes.subtype_cache_size.
+    """
+    return _SubtypeCacheInfo(_subtype_cache_hits, _subtype_cache_misses,
+            pytypes.subtype_cache_size, len(_subtype_cache))
+
+
+def clear_subtype_cache():
+    """Clears pytypes' cache for is_subtype results and its statistics.
+    """
+    global _subtype_cache_hits, _subtype_cache_misses
+    _subtype_cache.clear()
+    _subtype_cache_hits = 0
+    _subtype_cache_misses = 0
+
+
+def _issubclass_uncached(subclass, superclass, bound_Generic, bound_typevars,
+            bound_typevars_readonly, follow_fwd_refs, _recursion_check):
+    """Helper for _issubclass, a.k.a pytypes.is_subtype.
+    Performs the actual check, bypassing the cache.
+    """
     if bound_typevars is None:
         bound_typevars = {}
     if superclass is Any:
@@ -2091,6 +2573,481 @@ def _isinstance_Callable(obj, cls, bound_Generic, bound_typevars,
     return not check_callables
 
 
+if sys.version_info.major >= 3:
+    _non_plain_types = (types.GeneratorType,)
+else:
+    _non_plain_types = (types.GeneratorType, types.InstanceType)
+
+# deep_type represents empty instances of these as Empty[...]
+_Empty_container_types = (list, dict, set, frozenset)
+
+# Maps container types from typing to the builtin types check plans can explore
+# directly and to the variance of their parameters.
+_container_plan_kinds = {
+    List: ((list,), False),
+    typing.MutableSequence: ((list,), False),
+    Sequence: ((list,), True),
+    Set: ((set,), False),
+    typing.MutableSet: ((set,), False),
+    FrozenSet: ((frozenset,), True),
+    typing.AbstractSet: ((set, frozenset), True),
+    Dict: ((dict,), True),
+    typing.MutableMapping: ((dict,), True),
+    Mapping: ((dict,), True)
+}
+
+
+def _is_plain_type(tp):
+    """Helper for check plans.
+    Detects ordinary classes, i.e. classes that deep_type returns unchanged for
+    their instances and that _issubclass handles via plain issubclass.
+    """
+    try:
+        res = _plain_type_cache[tp]
+    except KeyError:
+        return _check_plan_cache_put(_plain_type_cache, tp, _is_plain_type_uncached(tp))
+    except TypeError:
+        # unhashable
+        return _is_plain_type_uncached(tp)
+    _lru_touch(_plain_type_cache, tp)
+    return res
+
+
+def _is_plain_type_uncached(tp):
+    res = isclass(tp) and not is_Generic(tp) and not _is_extra(tp) and \
+            not hasattr(tp, '__origin__') and not hasattr(tp, '__orig_class__') and \
+            not tp in _non_plain_types and not _has_base(tp, Container)
+    if res:
+        # deep_type uses __class__, which can be overridden, e.g. by proxy types
+        for bs in getattr(tp, '__mro__', ()):
+            if not bs is object and '__class__' in bs.__dict__:
+                res = False
+                break
+    return res
+
+
+def _plain_issubclass(subclass, superclass):
+    """Helper for check plans.
+    Decides _issubclass(subclass, superclass) for an ordinary class superclass
+    (see _is_plain_type). Returns None if subclass is not an ordinary class.
+    """
+    if subclass is superclass:
+        return True
+    if not _is_plain_type(subclass):
+        return None
+    if pytypes.apply_numeric_tower:
+        if superclass is float and subclass is int:
+            return True
+        elif superclass is complex and \
+                (subclass is int or subclass is float):
+            return True
+    try:
+        return issubclass(subclass, superclass)
+    except TypeError:
+        return None
+
+
+def _is_sampled_by_deep_type(length):
+    """Helper for check plans.
+    Tells if deep_type would only probe a sample of a container of the given length.
+    """
+    max_sample = pytypes.deep_type_samplesize
+    if max_sample == -1:
+        return False
+    if max_sample < 2:
+        max_sample = 2
+    return not (max_sample >= length-1 or length <= 2)
+
+
+def _type_check_Any(tp):
+    return True
+
+
+def _compile_type_check(cls):
+    """Helper for _compile_check_plan.
+    Creates a function check(tp) that decides _issubclass(tp, cls) for ordinary
+    classes tp. Like check plans, it returns None for cases it cannot decide.
+    Returns None if cls is not decidable based on the type of a value alone.
+    """
+    if cls is Any:
+        return _type_check_Any
+    if is_Union(cls):
+        checks = [_compile_type_check(tp) for tp in get_Union_params(cls)]
+        if any(chk is None for chk in checks):
+            return None
+        def check(tp):
+            res = False
+            for chk in checks:
+                res_chk = chk(tp)
+                if res_chk:
+                    return True
+                elif res_chk is None:
+                    res = None
+            return res
+        return check
+    if _is_plain_type(cls):
+        return lambda tp: _plain_issubclass(tp, cls)
+    return None
+
+
+def _check_plan_Any(obj, depth, seen):
+    if not _is_plain_type(type(obj)):
+        # deep_type would explore obj, so we cannot keep track of its content.
+        # See _compile_container_check for why we care.
+        seen.add(None)
+    return True
+
+
+def _compile_plain_check(cls):
+    """Helper for _compile_check_plan. Creates a check for an ordinary class.
+    """
+    def check(obj, depth, seen):
+        return _plain_issubclass(type(obj), cls)
+    return check
+
+
+def _compile_Union_check(cls):
+    """Helper for _compile_check_plan. Creates a check for a Union.
+    """
+    checks = [_compile_check_plan(tp) for tp in get_Union_params(cls)]
+    if all(chk is None for chk in checks):
+        return None
+    # Members without plan can only be decided by the full check
+    decisive = not any(chk is None for chk in checks)
+    # _issubclass treats Empty[...] in a Union specially, so containers
+    # would not be decided per member.
+    guard_Empty = _compile_type_check(cls) is None
+    checks = tuple(chk for chk in checks if not chk is None)
+    def check(obj, depth, seen):
+        if guard_Empty and type(obj) in _Empty_container_types and len(obj) == 0:
+            return None
+        res = False
+        for chk in checks:
+            res_chk = chk(obj, depth, seen)
+            if res_chk:
+                return True
+            elif res_chk is None:
+                res = None
+        return res if decisive else None
+    return check
+
+
+def _merge_subclasses(tps):
+    """Helper for container checks.
+    Removes subclasses of other elements from tps like Union does before Python 3.7.
+    """
+    if len(tps) < 2:
+        return tps
+    return set(tp for tp in tps if not any(not tp is tp2 and issubclass(tp, tp2)
+            for tp2 in tps))
+
+
+def _check_types(tps, type_check, invariant_members):
+    """Helper for container checks.
+    Decides if the Union of types tps fits the element type belonging to type_check.
+    If invariant_members is not None, the element type consists of these ordinary
+    classes and is invariant, i.e. also needs to be a subtype of the Union of tps.
+    """
+    res = True
+    for tp in tps:
+        res_tp = type_check(tp)
+        if res_tp is None:
+            return None
+        elif not res_tp:
+            res = False
+    if res and not invariant_members is None:
+        for member in invariant_members:
+            for tp in tps:
+                if _plain_issubclass(member, tp):
+                    break
+            else:
+                return False
+    return res
+
+
+def _compile_container_check(cls):
+    """Helper for _compile_check_plan. Creates a check for lists, sets and dicts.
+    The check explores the value's elements directly and stops at the first mismatch.
+    In contrast to the Union constructed by deep_type it cannot tell whether the
+    same container is contained multiple times. deep_type treats this case like a
+    recursion, so the check gives up if it encounters a container a second time.
+    For this purpose seen holds ids of containers fully explored so far, or
+    None if some content is unknown.
+    """
+    origin = _extra_inv(_origin(cls))
+    try:
+        obj_types, covariant = _container_plan_kinds[origin]
+    except (KeyError, TypeError):
+        return None
+    args = getattr(cls, '__args__', None)
+    is_mapping = obj_types[0] is dict
+    if args is None or len(args) != (2 if is_mapping else 1):
+        return None
+    elem_checks = []
+    for arg in args:
+        type_check = _compile_type_check(arg)
+        members = get_Union_params(arg) if is_Union(arg) else (arg,)
+        if not covariant:
+            if type_check is None or not all(_is_plain_type(tp) for tp in members):
+                return None
+            elem_checks.append((type_check, None, members, False))
+        elif not type_check is None:
+            elem_checks.append((type_check, None, None, Any in members))
+        else:
+            chk = _compile_check_plan(arg)
+            if chk is None:
+                return None
+            elem_checks.append((None, chk, None, False))
+    def check(obj, depth, seen):
+        if not type(obj) in obj_types:
+            return None
+        if is_mapping and not pytypes.covariant_Mapping:
+            return None
+        if depth == 0 or id(obj) in seen or None in seen:
+            return None
+        if len(obj) == 0:
+            res = _isinstance_deep_type(obj, cls)
+        elif _is_sampled_by_deep_type(len(obj)):
+            return None
+        else:
+            res = True
+            parts = (obj.keys(), obj.values()) if is_mapping else (obj,)
+            for (type_check, chk, members, has_Any), elems in zip(elem_checks, parts):
+                if not type_check is None:
+                    tps = set(map(type, elems))
+                    if not _typing_3_7:
+                        tps = _merge_subclasses(tps)
+                    res = _check_types(tps, type_check, members)
+                    if res and has_Any and not all(_is_plain_type(tp) for tp in tps):
+                        seen.add(None)
+                else:
+                    res = _check_elements(elems, chk, depth-1, seen)
+                    if res is False and not _typing_3_7:
+                        # Before Python 3.7 Union merges subclasses, e.g. Union[bool, int]
+                        # is int. This can make deep_type's Union fit although a single
+                        # element does not.
+                        return None
+                if not res:
+                    break
+        if res:
+            seen.add(id(obj))
+        return res
+    return check
+
+
+def _check_elements(elems, chk, depth, seen):
+    """Helper for container checks. Applies chk to each of elems.
+    """
+    Empty_types = set()
+    for elem in elems:
+        res = chk(elem, depth, seen)
+        if not res:
+            return res
+        if not Empty_types is None:
+            if type(elem) in _Empty_container_types and len(elem) == 0:
+                Empty_types.add(type(elem))
+            else:
+                Empty_types = None
+    if not Empty_types is None and len(Empty_types) > 1:
+        # A Union of Empty-types receives special treatment in _issubclass
+        return None
+    return True
+
+
+def _compile_Tuple_check(cls):
+    """Helper for _compile_check_plan. Creates a check for a Tuple.
+    Regarding seen, see _compile_container_check.
+    """
+    prms = get_Tuple_params(cls)
+    if prms is None or len(prms) == 0:
+        return None
+    checks = tuple(_compile_check_plan(tp) for tp in prms)
+    if any(chk is None for chk in checks):
+        return None
+    elps = is_Tuple_ellipsis(cls)
+    if elps:
+        # The repeated element type can be checked on the set of element types
+        tail_check = _compile_type_check(prms[-1])
+        tail_has_Any = Any in (get_Union_params(prms[-1]) if is_Union(prms[-1]) else prms[-1:])
+    def check(obj, depth, seen):
+        if not type(obj) is tuple:
+            return None
+        if depth == 0 or id(obj) in seen or None in seen or len(obj) == 0:
+            return None
+        if elps:
+            # Behaves exactly like _issubclass_Tuple, which leaves
+            # the element at position len(checks)-1 unchecked.
+            if len(checks)-1 > len(obj):
+                return False
+            for i in range(min(len(obj), len(checks))):
+                if i < len(checks)-1:
+                    res = checks[i](obj[i], depth-1, seen)
+                else:
+                    res = _check_plan_Any(obj[i], depth-1, seen)
+                if not res:
+                    return res
+            if len(obj) > len(checks):
+                if not tail_check is None:
+                    tps = set(map(type, obj[len(checks):]))
+                    res = _check_types(tps, tail_check, None)
+                    if res and tail_has_Any and not all(_is_plain_type(tp) for tp in tps):
+                        seen.add(None)
+                    if not res:
+                        return res
+                else:
+                    for i in range(len(checks), len(obj)):
+                        res = checks[-1](obj[i], depth-1, seen)
+                        if not res:
+                            return res
+        else:
+            if len(obj) != len(checks):
+                return False
+            for i in range(len(obj)):
+                res = checks[i](obj[i], depth-1, seen)
+                if not res:
+                    return res
+        seen.add(id(obj))
+        return True
+    return check
+
+
+def _compile_check_plan(cls):
+    """Helper for _get_check_plan.
+    A check plan is a function check(obj, depth, seen) that decides
+    _isinstance(obj, cls) directly by exploring obj, i.e. without constructing
+    deep_type(obj). depth is the remaining depth like deep_type would use it.
+    A check returns None if it cannot decide a case. This must always be respected
+    by falling back to _isinstance_deep_type, which is the reference behavior.
+    Returns None if no plan can be created for cls.
+    """
+    if cls is Any:
+        return _check_plan_Any
+    if is_Union(cls):
+        return _compile_Union_check(cls)
+    if is_Tuple(cls):
+        return _compile_Tuple_check(cls)
+    if _is_plain_type(cls):
+        return _compile_plain_check(cls)
+    if is_Generic(cls):
+        return _compile_container_check(cls)
+    return None
+
+
+def _check_plan_cache_put(cache, key, res):
+    """Stores res in one of the LRU check plan caches,
+    see pytypes.check_plan_cache_size.
+    """
+    if pytypes.check_plan_cache_size != 0:
+        cache[key] = res
+        try:
+            while len(cache) > pytypes.check_plan_cache_size > 0:
+                cache.popitem(False)
+        except KeyError:
+            # concurrently emptied
+            pass
+    return res
+
+
+def clear_check_plan_cache():
+    """Clears pytypes' caches of check plans, see pytypes.check_plan_cache_size.
+    """
+    _check_plan_cache.clear()
+    _type_check_cache.clear()
+    _plain_type_cache.clear()
+
+
+def _get_check_plan(cls):
+    """Retrieves the check plan for cls from cache or compiles it if needed.
+    Returns None if no plan is available for cls.
+    """
+    try:
+        plan = _check_plan_cache[cls]
+    except KeyError:
+        return _check_plan_cache_put(_check_plan_cache, cls, _compile_check_plan(cls))
+    except TypeError:
+        # unhashable
+        return None
+    _lru_touch(_check_plan_cache, cls)
+    return plan
+
+
+def _get_type_check(cls):
+    """Retrieves the result of _compile_type_check(cls) from cache or compiles it if needed.
+    Returns None if cls cannot be decided based on the type of a value alone.
+    """
+    try:
+        type_check = _type_check_cache[cls]
+    except KeyError:
+        return _check_plan_cache_put(_type_check_cache, cls, _compile_type_check(cls))
+    except TypeError:
+        # unhashable
+        return None
+    _lru_touch(_type_check_cache, cls)
+    return type_check
+
+
+def _homogeneous_item_type(values):
+    """Helper for _isinstance_many.
+    Returns the type shared by all items of an array.array, a one-dimensional
+    memoryview or a one-dimensional NumPy array without object dtype.
+    The type is obtained from the typecode or dtype resp. a single item, so the items
+    need not be visited. Returns None for other values and if the item type is unknown.
+    """
+    if type(values) is array.array or type(values) is memoryview:
+        if len(values) == 0 or getattr(values, 'ndim', 1) != 1:
+            return None
+        try:
+            return type(values[0])
+        except (NotImplementedError, TypeError):
+            # memoryview with unsupported format
+            return None
+    # We do not import NumPy; if it is not loaded, values cannot be an ndarray.
+    np = sys.modules.get('numpy')
+    if not np is None and isinstance(values, np.ndarray):
+        if values.ndim != 1 or values.dtype.hasobject:
+            return None
+        return values.dtype.type
+    return None
+
+
+def _isinstance_many(values, cls, bound_Generic=None, bound_typevars=None,
+            bound_typevars_readonly=False, follow_fwd_refs=True, _recursion_check=None):
+    """Access this via ``pytypes.is_of_type_many``.
+    Checks whether every item of ``values`` is an instance of ``cls``, i.e. works like
+    ``all(is_of_type(value, cls) for value in values)``.
+    If ``cls`` consists of ordinary classes (e.g. ``int``, ``Union[int, str]``), items of
+    lists and tuples are checked in bulk based on the set of their types.
+    For ``array.array``, one-dimensional ``memoryview`` and one-dimensional NumPy arrays
+    the item type is derived from the typecode resp. dtype, so the items are not visited.
+    Note that items of NumPy arrays are NumPy scalars, e.g. ``numpy.int64``, which are
+    not subclasses of ``int``, but are registered for ``numbers.Integral``.
+
+    values : Iterable
+    The items to check for being instances of ``cls``.
+
+    Other parameters work like in ``_isinstance``, ``bound_typevars`` is shared across
+    all items.
+    """
+    if bound_typevars is None:
+        bound_typevars = {}
+    type_check = _get_type_check(cls)
+    if not type_check is None:
+        tp = _homogeneous_item_type(values)
+        if not tp is None:
+            res = type_check(tp)
+            if not res is None:
+                return res
+        elif type(values) is list or type(values) is tuple:
+            res = _check_types(set(map(type, values)), type_check, None)
+            if not res is None:
+                return res
+    for value in values:
+        if not _isinstance(value, cls, bound_Generic, bound_typevars,
+                bound_typevars_readonly, follow_fwd_refs, _recursion_check):
+            return False
+    return True
+
+
 def _isinstance(obj, cls, bound_Generic=None, bound_typevars=None,
             bound_typevars_readonly=False, follow_fwd_refs=True, _recursion_check=None):
     """Access this via ``pytypes.is_of_type``.
@@ -2137,6 +3094,23 @@ def _isinstance(obj, cls, bound_Generic=None, bound_typevars=None,
     a ``ForwardRef`` is encountered, pytypes automatically creates this dictionary and
     continues in recursion-proof manner.
     """
+    if bound_typevars is None:
+        bound_typevars = {}
+    plan = _get_check_plan(cls)
+    if not plan is None:
+        res = plan(obj, pytypes.default_typecheck_depth, set())
+        if not res is None:
+            return res
+    return _isinstance_deep_type(obj, cls, bound_Generic, bound_typevars,
+            bound_typevars_readonly, follow_fwd_refs, _recursion_check)
+
+
+def _isinstance_deep_type(obj, cls, bound_Generic=None, bound_typevars=None,
+            bound_typevars_readonly=False, follow_fwd_refs=True, _recursion_check=None):
+    """Helper for _isinstance, a.k.a pytypes.is_of_type.
+    Performs the check by constructing deep_type(obj) and checking it via _issubclass.
+    Parameters work like in _isinstance.
+    """
     if bound_typevars is None:
         bound_typevars = {}
     # Special treatment if cls is Iterable[...]
@@ -2533,10 +3507,10 @@ def _raise_typecheck_error(msg, is_return=False, value=None, received_type=None,
             raise pytypes.InputTypeError(msg)
 
 
-def _get_current_call_info(clss=None, caller_level=0):
+def _get_current_call_info(clss=None, caller_level=0, frame=None):
     prop = None
     prop_getter = False
-    fq, code = util._get_current_function_fq(caller_level+1)
+    fq, code = util._get_current_function_fq(caller_level+1, frame)
     if isinstance(fq[0], property):
         prop = fq[0]
         if fq[0].fget.__code__ is code:
@@ -2555,11 +3529,13 @@ def _get_current_call_info(clss=None, caller_level=0):
     return cllable, clss, slf, clsm, prop, prop_getter
 
 
-def _check_caller_type(return_type, cllable=None, call_args=None, clss=None, caller_level=0):
+def _check_caller_type(return_type, cllable=None, call_args=None, clss=None, caller_level=0,
+            frame=None):
     prop = None
     prop_getter = False
     if cllable is None:
-        cllable, clss, slf, clsm, prop, prop_getter = _get_current_call_info(clss, caller_level+1)
+        cllable, clss, slf, clsm, prop, prop_getter = _get_current_call_info(clss,
+                caller_level+1, frame)
     else:
         clsm = pytypes.is_classmethod(cllable)
         slf = ismethod(cllable)
@@ -2576,7 +3552,8 @@ def _check_caller_type(return_type, cllable=None, call_args=None, clss=None, cal
             # If return_type is True we must assume that call_args being None is authoritative
             # i.e. None is the actual value to check rather than an indicator to
             # auto-retrieve the args. See https://github.com/Stewori/pytypes/issues/64
-            call_args = util.get_current_args(caller_level+1, cllable, util.getargnames(specs))
+            call_args = util.get_current_args(caller_level+1, cllable, util.getargnames(specs),
+                    frame)
         if slf:
             orig_clss = get_Generic_type(call_args[0])
             call_args = call_args[1:]
@@ -2655,10 +3632,36 @@ def restore_profiler():
         del _saved_profilers[idn]
 
 
+def _module_matches(module_name, prefixes):
+    """Helper for TypeAgent. Checks if module_name is one of the given
+    modules or packages or a submodule of these.
+    """
+    for prefix in prefixes:
+        if module_name == prefix or module_name.startswith(prefix+'.'):
+            return True
+    return False
+
+
+# Decisions of TypeAgent about how to treat calls of a certain code object:
+_agent_skip = 0
+_agent_check = 1
+_agent_log = 2
+
+# Max number of code objects TypeAgent caches decisions and log nodes for.
+# Code created at runtime (e.g. by exec) must not pile up in these caches.
+_agent_cache_size = 8192
+
+
 class TypeAgent(object):
 
-    def __init__(self, all_threads = True):
+    def __init__(self, all_threads = True, include_modules = None, exclude_modules = None):
+        """include_modules and exclude_modules are lists of module or package names
+        restricting the functions this agent considers. If None, the flags
+        pytypes.profiler_include_modules and pytypes.profiler_exclude_modules apply.
+        """
         self.all_threads = all_threads
+        self.include_modules = include_modules
+        self.exclude_modules = exclude_modules
         self._previous_profiler = None
         self._previous_thread_profiler = None
         self._active = False
@@ -2666,7 +3669,64 @@ class TypeAgent(object):
         self._cleared = False
         self._checking_enabled = False
         self._logging_enabled = False
-        self._caller_level_shift = 0
+        # LogSamplePolicy or None to apply pytypes.typelogging_sample
+        self._log_sample = None
+        # LRU, maps code objects to their typelogger nodes, see typelogger.LogSamplePolicy.
+        self._log_nodes = collections.OrderedDict()
+        # LRU, maps code objects to _agent_check and/or _agent_log or to _agent_skip.
+        self._code_decisions = collections.OrderedDict()
+        self._code_decisions_state = None
+
+    def _get_code_decision(self, frame):
+        """Tells whether calls of frame's code shall be checked and/or logged.
+        Decisions are cached per code object, so e.g. unannotated code from libraries
+        is dismissed with a single lookup.
+        """
+        if not self._code_decisions_state is None and \
+                self._code_decisions_state[0] is pytypes.profiler_include_modules and \
+                self._code_decisions_state[1] is pytypes.profiler_exclude_modules and \
+                self._code_decisions_state[2] == _funcsig_cache_generation:
+            try:
+                res = self._code_decisions[frame.f_code]
+                _lru_touch(self._code_decisions, frame.f_code)
+                return res
+            except KeyError:
+                pass
+        else:
+            self._code_decisions.clear()
+            self._code_decisions_state = (pytypes.profiler_include_modules,
+                    pytypes.profiler_exclude_modules, _funcsig_cache_generation)
+        code = frame.f_code
+        include = self.include_modules
+        if include is None:
+            include = pytypes.profiler_include_modules
+        exclude = self.exclude_modules
+        if exclude is None:
+            exclude = pytypes.profiler_exclude_modules
+        module_name = frame.f_globals.get('__name__', '')
+        if (not include is None and not _module_matches(module_name, include)) or \
+                (not exclude is None and _module_matches(module_name, exclude)):
+            res = _agent_skip
+        else:
+            try:
+                cllable, clss, slf, clsm, prop, prop_getter = \
+                        _get_current_call_info(frame=frame)
+            except RuntimeError:
+                # Caller could not be determined, e.g. for lambdas, comprehensions
+                # or module bodies. Code that only becomes reachable later on is
+                # reconsidered once the decisions are invalidated.
+                res = _agent_skip
+            except Exception:
+                # Let the actual check or logging deal with it
+                res = _agent_check | _agent_log
+            else:
+                res = _agent_log
+                if slf or has_type_hints(cllable if prop is None else prop):
+                    res |= _agent_check
+        self._code_decisions[code] = res
+        if len(self._code_decisions) > _agent_cache_size:
+            self._code_decisions.popitem(False)
+        return res
 
     def _is_checking(self):
         if not pytypes.checking_enabled:
@@ -2692,12 +3752,6 @@ class TypeAgent(object):
     def active(self):
         return self._active
 
-    def _set_caller_level_shift(self, shift):
-        self._caller_level_shift = shift
-        if not self._previous_profiler is None and \
-                isinstance(self._previous_profiler, TypeAgent):
-            self._previous_profiler._set_caller_level_shift(shift+1)
-
     def start(self):
         if self._active:
             raise RuntimeError('type checker already running')
@@ -2706,7 +3760,6 @@ class TypeAgent(object):
         self._pending = True
         # Install this instance as the current profiler
         self._previous_profiler = sys.getprofile()
-        self._set_caller_level_shift(0)
         sys.setprofile(self)
 
         # If requested, set this instance as the default profiler for all future threads
@@ -2721,9 +3774,6 @@ class TypeAgent(object):
             self._pending = True
             if sys.getprofile() is self:
                 sys.setprofile(self._previous_profiler)
-                if not self._previous_profiler is None and \
-                        isinstance(self._previous_profiler, TypeAgent):
-                    self._previous_profiler._set_caller_level_shift(0)
             else:
                 if sys.getprofile() is not None or not self._cleared:
                     warn('the system profiling hook has changed unexpectedly')
@@ -2741,6 +3791,61 @@ class TypeAgent(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop()
 
+    def _on_call(self, frame):
+        if self._is_checking() and self._get_code_decision(frame) & _agent_check:
+            try:
+                _check_caller_type(False, frame=frame)
+            except RuntimeError:
+                # Caller could not be determined.
+                pass
+
+    def _on_return(self, frame, arg):
+        checking = self._is_checking()
+        logging = self._is_logging()
+        if checking or logging:
+            decision = self._get_code_decision(frame)
+            checking = checking and decision & _agent_check
+            logging = logging and decision & _agent_log
+        if checking:
+            try:
+                _check_caller_type(True, None, arg, frame=frame)
+            except RuntimeError:
+                # Caller could not be determined.
+                pass
+            except pytypes.TypeCheckError:
+                raise
+            except TypeError:
+                # Caller could not be determined.
+                pass
+        if logging:
+            sample = self._log_sample
+            if sample is None:
+                sample = pytypes.typelogger._get_global_log_sample_policy()
+            node = self._log_nodes.get(frame.f_code)
+            if not node is None:
+                _lru_touch(self._log_nodes, frame.f_code)
+            if not node is None and not sample is None:
+                # Decide before the costly inspection of the call
+                if not sample._log_call(node):
+                    return
+                sample = False
+            try:
+                cllable, clss, slf, clsm, prop, prop_getter = \
+                        _get_current_call_info(frame=frame)
+                act_func = util._actualfunc(cllable)
+                specs = util.getargspecs(act_func)
+                call_args = util.get_current_args(0, cllable,
+                        util.getargnames(specs), frame)
+                if slf or clsm:
+                    call_args = call_args[1:]
+                node = pytypes.log_type(call_args, arg, cllable if prop is None else prop,
+                        slf, prop_getter, clss, specs, sample=sample)
+                self._log_nodes[frame.f_code] = node
+                if len(self._log_nodes) > _agent_cache_size:
+                    self._log_nodes.popitem(False)
+            except:
+                pass
+
     def __call__(self, frame, event, arg):
         if not self._active and not self._pending:
             # This happens if all_threads was enabled and a thread was created when the checker was
@@ -2754,49 +3859,23 @@ class TypeAgent(object):
         else:
             # If an actual profiler is running, don't include the type checking times in its results
             if event == 'call':
-                if self._is_checking():
-                    try:
-                        #check_argument_types(caller_level=self._caller_level_shift+1)
-                        _check_caller_type(False, caller_level=self._caller_level_shift+1)
-                    except RuntimeError:
-                        # Caller could not be determined.
-                        pass
-                    except pytypes.TypeCheckError:
-                        _saved_profilers[threading.current_thread().ident] = self
-                        self._cleared = True
-                        raise
+                try:
+                    self._on_call(frame)
+                except pytypes.TypeCheckError:
+                    _saved_profilers[threading.current_thread().ident] = self
+                    self._cleared = True
+                    raise
                 if self._previous_profiler is not None:
                     self._previous_profiler(frame, event, arg)
             elif event == 'return':
                 if self._previous_profiler is not None:
                     self._previous_profiler(frame, event, arg)
-                if self._is_checking():
-                    try:
-                        _check_caller_type(True, None, arg, caller_level=self._caller_level_shift+1)
-                    except RuntimeError:
-                        # Caller could not be determined.
-                        pass
-                    except pytypes.TypeCheckError:
-                        _saved_profilers[threading.current_thread().ident] = self
-                        self._cleared = True
-                        raise
-                    except TypeError:
-                        # Caller could not be determined.
-                        pass
-                if self._is_logging():
-                    try:
-                        cllable, clss, slf, clsm, prop, prop_getter = \
-                                _get_current_call_info(caller_level=self._caller_level_shift+1)
-                        act_func = util._actualfunc(cllable)
-                        specs = util.getargspecs(act_func)
-                        call_args = util.get_current_args(self._caller_level_shift+1, cllable,
-                                util.getargnames(specs))
-                        if slf or clsm:
-                            call_args = call_args[1:]
-                        pytypes.log_type(call_args, arg, cllable if prop is None else prop,
-                                slf, prop_getter, clss, specs)
-                    except:
-                        pass
+                try:
+                    self._on_return(frame, arg)
+                except pytypes.TypeCheckError:
+                    _saved_profilers[threading.current_thread().ident] = self
+                    self._cleared = True
+                    raise
             else:
                 if self._previous_profiler is not None:
                     self._previous_profiler(frame, event, arg)
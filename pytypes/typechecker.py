@@ -22,8 +22,10 @@ import atexit
 import inspect
 import re as _re
 import sys
+import threading
 import types
 import typing
+import weakref
 import collections
 from inspect import isclass, ismodule, isfunction, ismethod, ismethoddescriptor
 from warnings import warn
@@ -52,6 +54,42 @@ _delayed_checks = []
 
 _import_hook_installed = False
 
+class _WrapperGlobals(dict):
+    """Globals of the wrappers made by _with_wrapper_globals. Names not found
+    here are looked up in the wrapped function's globals, without copying them.
+    """
+    def __init__(self, func_globals):
+        dict.__init__(self)
+        self.func_globals = func_globals
+        self['__builtins__'] = globals()['__builtins__']
+
+    def __missing__(self, key):
+        return self.func_globals[key]
+
+
+def _make_forwarder(wrapper):
+    def forwarder(*args, **kw):
+        return wrapper(*args, **kw)
+    return forwarder
+
+
+def _with_wrapper_globals(wrapper, func):
+    """Before Python 3.7, typing.get_type_hints does not follow __wrapped__ and
+    evaluates forward refs in the wrapper's globals. Returns a function that
+    forwards calls to wrapper and has its own globals, backed by func's globals.
+    wrapper itself keeps the globals of this module, so calls do not pay for
+    looking up its names in a dict subclass.
+    """
+    fw = _make_forwarder(wrapper)
+    return types.FunctionType(fw.__code__, _WrapperGlobals(func.__globals__),
+            wrapper.__name__, None, fw.__closure__)
+
+
+# Max number of signatures a typechecked function caches, see checker_tp._sig_cache.
+# Keys contain the parent class, so e.g. a typechecked base method called on many
+# dynamically created subclasses must not keep all of them alive.
+_sig_cache_size = 64
+
 # Monkeypatch import to
 # process forward-declarations after module loading finished
 # and eventually apply global typechecking:
@@ -106,6 +144,78 @@ def _install_import_hook():
         builtins.__import__ = _pytypes___import__
         _import_hook_installed = True
 
+# Per thread: code objects of the class bodies currently executed via
+# _pytypes___build_class__, each with the list of pending override checks for
+# that class. See _get_class_body_stack.
+_class_body_local = threading.local()
+_typechecker_globals = globals()
+# The hook is only installed while classes are being built via it, see
+# _install_build_class_hook. _python___build_class__ is the value it replaced.
+_build_class_hook_installed = False
+_build_class_hook_lock = threading.Lock()
+_build_class_hook_depth = 0
+_python___build_class__ = None
+
+def _get_class_body_stack():
+    try:
+        return _class_body_local.stack
+    except AttributeError:
+        stack = []
+        _class_body_local.stack = stack
+        return stack
+
+def _pytypes___build_class__(func, name, *bases, **kw):
+    # Lets override check all decorated methods of a class once the class exists.
+    global _build_class_hook_depth
+    build_class = _python___build_class__
+    if not pytypes.check_override_at_class_definition_time:
+        with _build_class_hook_lock:
+            if _build_class_hook_depth == 0:
+                _uninstall_build_class_hook()
+        return build_class(func, name, *bases, **kw)
+    entry = (func.__code__, [])
+    class_body_stack = _get_class_body_stack()
+    class_body_stack.append(entry)
+    with _build_class_hook_lock:
+        _build_class_hook_depth += 1
+    try:
+        cls = build_class(func, name, *bases, **kw)
+    finally:
+        for i in range(len(class_body_stack)-1, -1, -1):
+            if class_body_stack[i] is entry:
+                del class_body_stack[i]
+                break
+        with _build_class_hook_lock:
+            _build_class_hook_depth -= 1
+            if _build_class_hook_depth == 0:
+                # No class is built via the hook in any thread any more.
+                _uninstall_build_class_hook()
+    if len(entry[1]) > 0 and isclass(cls):
+        _check_override_class(cls, entry[1])
+    return cls
+
+def _install_build_class_hook():
+    """Wraps the current builtins.__build_class__ until no class is built via
+    the hook any more, i.e. the class body stacks of all threads are empty.
+    """
+    global _build_class_hook_installed, _python___build_class__
+    with _build_class_hook_lock:
+        build_class = getattr(builtins, '__build_class__', None)
+        if not _build_class_hook_installed and not build_class is None:
+            _python___build_class__ = build_class
+            builtins.__build_class__ = _pytypes___build_class__
+            _build_class_hook_installed = True
+
+def _uninstall_build_class_hook():
+    # Caller must hold _build_class_hook_lock.
+    global _build_class_hook_installed
+    # If another hook was installed on top of ours, it still refers to ours,
+    # so we stay in place, forwarding to _python___build_class__.
+    if _build_class_hook_installed and \
+            builtins.__build_class__ is _pytypes___build_class__:
+        builtins.__build_class__ = _python___build_class__
+        _build_class_hook_installed = False
+
 class _DelayedCheck():
     """Delayed checks are needed for definition time typechecks that involve
     forward declarations.
@@ -367,6 +477,140 @@ def _function_instead_of_method_error(method):
             % (method.__module__, method.__name__))
 
 
+def _cache_override_check(checker_ov, clss, ov_state):
+    """Records that calls of checker_ov on instances of clss passed the runtime
+    override check, as long as ov_state is unchanged.
+    """
+    try:
+        checker_ov._ov_cache[clss] = ov_state
+    except TypeError:
+        # class not weakly referenceable
+        pass
+
+
+def _check_override_bases(func, auto, meth_cls_name, base_classes):
+    """Definition time check of override against the given (non-builtin) classes
+    of the would-be mro of the class named meth_cls_name.
+    """
+    if func.__name__ == '__init__':
+        raise OverrideError(
+                'Invalid use of @override in %s:\n  @override must not be applied to __init__.'
+                % util._fully_qualified_func_name(func, True, None, meth_cls_name))
+    base_method_exists = False
+    argSpecs = util.getargspecs(func)
+    for cls in base_classes:
+        if hasattr(cls, func.__name__):
+            base_method_exists = True
+            base_method = getattr(cls, func.__name__)
+            _check_override_argspecs(func, argSpecs, meth_cls_name, base_method, cls)
+            if has_type_hints(func):
+                try:
+                    _check_override_types(func, _funcsigtypes(func, True, cls), meth_cls_name,
+                            base_method, cls)
+                except NameError:
+                    _delayed_checks.append(_DelayedCheck(func, func, meth_cls_name, base_method,
+                            cls, sys.exc_info()))
+    if not base_method_exists:
+        if not auto:
+            raise _no_base_method_error(func)
+
+
+def _check_override_class(cls, pending):
+    """Performs the definition time checks of all override-decorated methods
+    of cls in one batch, based on its actual mro.
+    pending is a list of (func, auto) tuples.
+    """
+    base_classes = [base_cls for base_cls in util.mro(cls)[1:]
+            if not is_builtin_type(base_cls)]
+    for func, auto in pending:
+        _check_override_bases(func, auto, cls.__name__, base_classes)
+
+
+def _get_pending_override_checks():
+    """Returns the list of pending definition time override checks of the class
+    whose body calls override, if this class is built via _pytypes___build_class__.
+    Returns None otherwise.
+    """
+    class_body_stack = getattr(_class_body_local, 'stack', None)
+    if not class_body_stack:
+        return None
+    frame = sys._getframe(1)
+    # skip override, auto_override etc.
+    while not frame is None and frame.f_globals is _typechecker_globals:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    for body_code, pending in reversed(class_body_stack):
+        if body_code is frame.f_code:
+            return pending
+    return None
+
+
+def _check_override_from_stack(func, auto):
+    """Definition time check of override for the case that the class is not
+    built via _pytypes___build_class__, e.g. in Python 2.
+    """
+    # We need some trickery here, because details of the class are not yet available
+    # as it is just getting defined. Luckily we can get base-classes via inspect.stack():
+    stack = inspect.stack()[2:]
+    try:
+        base_classes = _re.search(r'class.+\((.+)\)\s*\:', stack[2][4][0]).group(1)
+    except IndexError:
+        raise _function_instead_of_method_error(func)
+    except AttributeError:
+        base_classes = 'object'
+    meth_cls_name = stack[1][3]
+    if func.__name__ == '__init__':
+        _check_override_bases(func, auto, meth_cls_name, ())
+    # handle multiple inheritance
+    base_classes = [s.strip() for s in base_classes.split(',')]
+    if not base_classes:
+        raise ValueError('@override: unable to determine base class') 
+
+    # stack[0]=overrides, stack[1]=inside class def'n, stack[2]=outside class def'n
+    derived_class_locals = stack[2][0].f_locals
+    derived_class_globals = stack[2][0].f_globals
+
+    # replace each class name in base_classes with the actual class type
+    for i, base_class in enumerate(base_classes):
+        if '.' not in base_class:
+            if base_class in derived_class_locals:
+                base_classes[i] = derived_class_locals[base_class]
+            elif base_class in derived_class_globals:
+                base_classes[i] = derived_class_globals[base_class]
+            elif base_class in types.__builtins__:
+                base_classes[i] = types.__builtins__[base_class]
+            else:
+                raise TypeError("Could not lookup type: "+base_class)
+        else:
+            components = base_class.split('.')
+            # obj is either a module or a class
+            if components[0] in derived_class_locals:
+                obj = derived_class_locals[components[0]]
+            elif components[0] in derived_class_globals:
+                obj = derived_class_globals[components[0]]
+            elif components[0] in types.__builtins__:
+                obj = types.__builtins__[components[0]]
+            elif components[0] in sys.modules:
+                obj = sys.modules[components[0]]
+            else:
+                raise TypeError("Could not lookup type or module: "+base_class)
+            for c in components[1:]:
+                assert(ismodule(obj) or isclass(obj))
+                obj = getattr(obj, c)
+            base_classes[i] = obj
+
+    mro_set = set() # contains everything in would-be-mro, however in unspecified order
+    mro_pool = [base_classes]
+    while len(mro_pool) > 0:
+        lst = mro_pool.pop()
+        for base_cls in lst:
+            if not is_builtin_type(base_cls):
+                mro_set.add(base_cls)
+                mro_pool.append(base_cls.__bases__)
+    _check_override_bases(func, auto, meth_cls_name, mro_set)
+
+
 def override(func, auto = False):
     """Decorator applicable to methods only.
     For a version applicable also to classes or modules use auto_override.
@@ -379,6 +623,13 @@ def override(func, auto = False):
     Use pytypes.check_override_at_runtime and pytypes.check_override_at_class_definition_time
     to control whether checks happen at class definition time or at "actual runtime".
     """
+    return _override(func, auto)
+
+
+def _override(func, auto, pending = None):
+    """Implements override. pending can be a list that collects (func, auto) for a
+    definition time check via _check_override_class, e.g. by auto_override_class.
+    """
     if not pytypes.checking_enabled:
         return func
     # notes:
@@ -395,95 +646,40 @@ def override(func, auto = False):
     func.override_checked = True
     _actualfunc(func).override_checked = True
     if pytypes.check_override_at_class_definition_time:
-        # We need some trickery here, because details of the class are not yet available
-        # as it is just getting defined. Luckily we can get base-classes via inspect.stack():
-        stack = inspect.stack()
-        try:
-            base_classes = _re.search(r'class.+\((.+)\)\s*\:', stack[2][4][0]).group(1)
-        except IndexError:
-            raise _function_instead_of_method_error(func)
-        except AttributeError:
-            base_classes = 'object'
-        meth_cls_name = stack[1][3]
-        if func.__name__ == '__init__':
-            raise OverrideError(
-                    'Invalid use of @override in %s:\n  @override must not be applied to __init__.'
-                    % util._fully_qualified_func_name(func, True, None, meth_cls_name))
-        # handle multiple inheritance
-        base_classes = [s.strip() for s in base_classes.split(',')]
-        if not base_classes:
-            raise ValueError('@override: unable to determine base class') 
-
-        # stack[0]=overrides, stack[1]=inside class def'n, stack[2]=outside class def'n
-        derived_class_locals = stack[2][0].f_locals
-        derived_class_globals = stack[2][0].f_globals
-
-        # replace each class name in base_classes with the actual class type
-        for i, base_class in enumerate(base_classes):
-            if '.' not in base_class:
-                if base_class in derived_class_locals:
-                    base_classes[i] = derived_class_locals[base_class]
-                elif base_class in derived_class_globals:
-                    base_classes[i] = derived_class_globals[base_class]
-                elif base_class in types.__builtins__:
-                    base_classes[i] = types.__builtins__[base_class]
-                else:
-                    raise TypeError("Could not lookup type: "+base_class)
-            else:
-                components = base_class.split('.')
-                # obj is either a module or a class
-                if components[0] in derived_class_locals:
-                    obj = derived_class_locals[components[0]]
-                elif components[0] in derived_class_globals:
-                    obj = derived_class_globals[components[0]]
-                elif components[0] in types.__builtins__:
-                    obj = types.__builtins__[components[0]]
-                elif components[0] in sys.modules:
-                    obj = sys.modules[components[0]]
-                else:
-                    raise TypeError("Could not lookup type or module: "+base_class)
-                for c in components[1:]:
-                    assert(ismodule(obj) or isclass(obj))
-                    obj = getattr(obj, c)
-                base_classes[i] = obj
-
-        mro_set = set() # contains everything in would-be-mro, however in unspecified order
-        mro_pool = [base_classes]
-        while len(mro_pool) > 0:
-            lst = mro_pool.pop()
-            for base_cls in lst:
-                if not is_builtin_type(base_cls):
-                    mro_set.add(base_cls)
-                    mro_pool.append(base_cls.__bases__)
-
-        base_method_exists = False
-        argSpecs = util.getargspecs(func)
-        for cls in mro_set:
-            if hasattr(cls, func.__name__):
-                base_method_exists = True
-                base_method = getattr(cls, func.__name__)
-                _check_override_argspecs(func, argSpecs, meth_cls_name, base_method, cls)
-                if has_type_hints(func):
-                    try:
-                        _check_override_types(func, _funcsigtypes(func, True, cls), meth_cls_name,
-                                base_method, cls)
-                    except NameError:
-                        _delayed_checks.append(_DelayedCheck(func, func, meth_cls_name, base_method,
-                                cls, sys.exc_info()))
-        if not base_method_exists:
-            if not auto:
-                raise _no_base_method_error(func)
+        if pytypes.import_hook_enabled:
+            _install_build_class_hook()
+        if pending is None:
+            pending = _get_pending_override_checks()
+        if pending is None:
+            _check_override_from_stack(func, auto)
+        else:
+            pending.append((func, auto))
 
     if pytypes.check_override_at_runtime:
         specs = util.getargspecs(func)
         argNames = util.getargnames(specs)
+        binder = util._ArgBinder(specs)
         def checker_ov(*args, **kw):
             if hasattr(checker_ov, '__annotations__') and len(checker_ov.__annotations__) > 0:
-                checker_ov.ov_func.__annotations__ = checker_ov.__annotations__
-            args_kw = util.getargskw(args, kw, specs)
+                if not checker_ov.ov_func.__annotations__ is checker_ov.__annotations__:
+                    checker_ov.ov_func.__annotations__ = checker_ov.__annotations__
+                    # annotations were replaced, so cached results are outdated
+                    checker_ov._ov_cache.clear()
+            args_kw = binder.getargskw(args, kw)[0]
             if len(argNames) > 0 and argNames[0] == 'self':
                 if hasattr(args_kw[0].__class__, func.__name__) and \
                         ismethod(getattr(args_kw[0], func.__name__)):
+                    # The result can only change if the class hierarchy changes
+                    # or signatures are invalidated. We omit the class itself from
+                    # its mro, because the weakly keyed cache must not refer to it.
+                    ov_state = (getattr(args_kw[0].__class__, '__mro__', (None,))[1:],
+                            type_util._funcsig_cache_generation)
+                    try:
+                        if checker_ov._ov_cache.get(args_kw[0].__class__) == ov_state:
+                            return func(*args, **kw)
+                    except TypeError:
+                        # class not weakly referenceable
+                        pass
                     actual_class = args_kw[0].__class__
                     if _actualfunc(getattr(args_kw[0], func.__name__)) != func:
                         for acls in util.mro(args_kw[0].__class__):
@@ -507,6 +703,7 @@ def override(func, auto = False):
                         if not auto:
                             raise _no_base_method_error(func)
                         else:
+                            _cache_override_check(checker_ov, args_kw[0].__class__, ov_state)
                             return func(*args, **kw)
                     # Not yet support overloading
                     # Check arg-count compatibility
@@ -519,6 +716,7 @@ def override(func, auto = False):
                         for ovcls in ovmro:
                             ovf = getattr(ovcls, func.__name__)
                             _check_override_types(func, meth_types, actual_class.__name__, ovf, ovcls)
+                    _cache_override_check(checker_ov, args_kw[0].__class__, ov_state)
                 else:
                     raise OverrideError('@override was applied to a non-method: %s.%s.\n'
                         % (func.__module__, func.__name__)
@@ -527,12 +725,18 @@ def override(func, auto = False):
                 raise _function_instead_of_method_error(func)
             return func(*args, **kw)
     
+        if sys.version_info < (3, 7):
+            # typing.get_type_hints only follows __wrapped__ from Python 3.7 on.
+            checker_ov = _with_wrapper_globals(checker_ov, func)
         checker_ov.ov_func = func
+        # Maps classes that passed the check to their state, see _cache_override_check.
+        checker_ov._ov_cache = weakref.WeakKeyDictionary()
         if hasattr(func, '__func__'):
             checker_ov.__func__ = func.__func__
         checker_ov.__name__ = func.__name__
         checker_ov.__module__ = func.__module__
-        checker_ov.__globals__.update(func.__globals__)
+        # Lets e.g. typing.get_type_hints resolve names in func's module
+        checker_ov.__wrapped__ = func
         if hasattr(func, '__annotations__'):
             checker_ov.__annotations__ = func.__annotations__
         if hasattr(func, '__qualname__'):
@@ -548,25 +752,96 @@ def override(func, auto = False):
 def _make_type_error_message(tp, func, slf, func_class, expected_tp, \
             incomp_text, prop_getter = False, bound_typevars=None):
     _cmp_msg_format = 'Expected: %s\nReceived: %s'
+    # Todo: Clarify if an @override-induced check caused this
+    # Todo: Python3 misconcepts method as classmethod here, because it doesn't
+    # detect it as bound method, because ov_checker or tp_checker obfuscate it
+    return '\n  '+_fq_checked_func_name(func, slf, func_class, prop_getter)+ \
+            '\n  '+incomp_text+':\n'+_cmp_msg_format % ( \
+            type_str(expected_tp, bound_Generic=func_class, bound_typevars=bound_typevars),
+            type_str(tp, bound_Generic=func_class, bound_typevars=bound_typevars))
+
+
+def _fq_checked_func_name(func, slf, func_class, prop_getter = False):
     if type(func) is property:
         assert slf is True
         if func.fset is None or prop_getter:
-            fq_func_name = util._fully_qualified_func_name(func.fget, True, func_class)+'/getter'
+            return util._fully_qualified_func_name(func.fget, True, func_class)+'/getter'
         else:
-            fq_func_name = util._fully_qualified_func_name(func.fset, True, func_class)+'/setter'
+            return util._fully_qualified_func_name(func.fset, True, func_class)+'/setter'
     else:
-        fq_func_name = util._fully_qualified_func_name(
+        return util._fully_qualified_func_name(
                 func, slf or util.is_classmethod(func), func_class)
-    # Todo: Clarify if an @override-induced check caused this
-    # Todo: Python3 misconcepts method as classmethod here, because it doesn't
-    # detect it as bound method, because ov_checker or tp_checker obfuscate it
-    return '\n  '+fq_func_name+'\n  '+incomp_text+':\n'+_cmp_msg_format % ( \
-            type_str(expected_tp, bound_Generic=func_class, bound_typevars=bound_typevars),
-            type_str(tp, bound_Generic=func_class, bound_typevars=bound_typevars))
+
+
+def _apply_budget(budget, check_val, func, slf, func_class, is_return, prop_getter,
+            force_exception, sample):
+    """Helper for _checkfunctype and _checkfuncresult.
+    Applies the outcome defined by budget if check_val exceeds it.
+    Returns the sample policy to check check_val with.
+    """
+    if budget is None or not budget.exceeded_by(check_val):
+        return sample
+    if budget.exceeded != 'pass':
+        msg = '\n  '+_fq_checked_func_name(func, slf, func_class, prop_getter)+'\n  '+ \
+                ('returned' if is_return else 'called with')+ \
+                ' value exceeding check budget: '+repr(budget)
+        if budget.exceeded == 'warn':
+            warn(msg, pytypes.TypeWarning)
+        else:
+            _raise_typecheck_error(msg, is_return, check_val, None, None, func)
+            if force_exception:
+                raise ReturnTypeError(msg) if is_return else InputTypeError(msg)
+    return type_util._BudgetSample(budget, sample)
+
+
+class _RecordedSample(object):
+    """Wraps a sample policy for one check via _checkinstance and remembers the
+    samples it drew, so an error message can show the values actually checked.
+    """
+    def __init__(self, sample):
+        self._sample = sample
+        self._samples = {}
+
+    def sample(self, obj, depth=None):
+        res = self._sample.sample(obj, depth)
+        # obj stays alive as part of the checked value, so its id is unambiguous
+        self._samples[id(obj)] = res
+        return res
+
+    def checked_value(self, obj):
+        try:
+            return self._samples[id(obj)]
+        except KeyError:
+            pass
+        if isinstance(obj, tuple):
+            # _checkinstance samples the elements of tuples separately
+            return tuple([self.checked_value(elem) for elem in obj])
+        return obj
+
+
+def _needs_checked_val(cls):
+    """Tells whether _checkinstance might turn a value of type cls into a checked
+    version, e.g. a checked callable, iterable or generator.
+    If not, values can be checked via _isinstance and passed on unchanged.
+    """
+    if is_Tuple(cls):
+        prms = pytypes.get_Tuple_params(cls)
+        if prms is None:
+            return False
+        for prm in prms:
+            if _needs_checked_val(prm):
+                return True
+        return False
+    if type_util.is_Callable(cls):
+        return True
+    if type_util.is_Generic(cls):
+        return cls.__origin__ in (type_util._orig_Iterable, type_util._orig_Iterator) \
+                or type_util.is_Generator(cls)
+    return False
 
 
 def _checkinstance(obj, cls, bound_Generic, bound_typevars, bound_typevars_readonly,
-            follow_fwd_refs, _recursion_check, is_args, func, force = False):
+            follow_fwd_refs, _recursion_check, is_args, func, force = False, sample = None):
     if is_Tuple(cls):
         prms = pytypes.get_Tuple_params(cls)
         elps = pytypes.is_Tuple_ellipsis(cls)
@@ -580,7 +855,7 @@ def _checkinstance(obj, cls, bound_Generic, bound_typevars, bound_typevars_reado
             for i in range(len(obj)):
                 res, obj2 = _checkinstance(obj[i], prms[0 if elps else i], bound_Generic, bound_typevars,
                         bound_typevars_readonly, follow_fwd_refs, _recursion_check,
-                        is_args, func)
+                        is_args, func, force, sample)
                 if not res:
                     return False, obj
                 else:
@@ -605,7 +880,7 @@ def _checkinstance(obj, cls, bound_Generic, bound_typevars, bound_typevars_reado
         if cls.__origin__ in (type_util._orig_Iterable, type_util._orig_Iterator):
             if not type_util.is_iterable(obj):
                 return False, obj
-            itp = type_util.get_iterable_itemtype(obj)
+            itp = type_util.get_iterable_itemtype(obj if sample is None else sample.sample(obj))
             if itp is None:
                 if pytypes.check_iterables:
                     if cls.__origin__ is type_util._orig_Iterator:
@@ -618,7 +893,8 @@ def _checkinstance(obj, cls, bound_Generic, bound_typevars, bound_typevars_reado
                                 bound_typevars, bound_typevars_readonly, follow_fwd_refs,
                                 _recursion_check, force)
                 else:
-                    return _isinstance(obj, cls, bound_Generic, bound_typevars,
+                    return _isinstance(obj if sample is None else sample.sample(obj),
+                            cls, bound_Generic, bound_typevars,
                             bound_typevars_readonly, follow_fwd_refs, _recursion_check), obj
 # 	There was this idea of monkeypatching, but it doesn't work in Python 3 and is anyway too invasive.
 # 					if not hasattr(obj, '__iter__'):
@@ -672,28 +948,35 @@ def _checkinstance(obj, cls, bound_Generic, bound_typevars, bound_typevars_reado
                     return True, obj
             else:
                 return False, obj
-    return _isinstance(obj, cls, bound_Generic, bound_typevars,
-            bound_typevars_readonly, follow_fwd_refs, _recursion_check), obj
+    return _isinstance(obj if sample is None else sample.sample(obj), cls, bound_Generic,
+            bound_typevars, bound_typevars_readonly, follow_fwd_refs, _recursion_check), obj
 
 
 def _checkfunctype(argSig, check_val, func, slf, func_class, make_checked_val=False,
             prop_getter=False, argspecs=None, var_type=None, force_exception=False,
             bound_typevars={}, bound_typevars_readonly=False, follow_fwd_refs=True,
-            _recursion_check=None):
+            _recursion_check=None, sample=None, budget=None):
     if argspecs is None:
         argspecs = getargspecs(_actualfunc(func, prop_getter))
     argSig = _preprocess_typecheck(argSig, argspecs, slf) \
             if var_type is None else var_type
+    sample = _apply_budget(budget, check_val, func, slf, func_class, False, prop_getter,
+            force_exception, sample)
     if make_checked_val:
+        if not sample is None:
+            sample = _RecordedSample(sample)
         result, checked_val = _checkinstance(check_val, argSig,
                 func_class, bound_typevars, bound_typevars_readonly, follow_fwd_refs,
-                _recursion_check, True, func)
+                _recursion_check, True, func, sample=sample)
+        sampled_val = check_val if sample is None else sample.checked_value(check_val)
     else:
-        result = _isinstance(check_val, argSig, func_class, bound_typevars,
+        sampled_val = check_val if sample is None else sample.sample(check_val)
+        result = _isinstance(sampled_val, argSig, func_class, bound_typevars,
                 bound_typevars_readonly, follow_fwd_refs, _recursion_check)
         checked_val = None
     if not result:
-        tpch = deep_type(check_val)
+        # Describe the sample that was checked, so the offending element is included
+        tpch = deep_type(sampled_val)
         msg = _make_type_error_message(tpch, func, slf, func_class, argSig,
                 'called with incompatible types', prop_getter, bound_typevars)
         _raise_typecheck_error(msg, False, check_val, tpch, argSig, func)
@@ -705,19 +988,25 @@ def _checkfunctype(argSig, check_val, func, slf, func_class, make_checked_val=Fa
 def _checkfuncresult(resSig, check_val, func, slf, func_class, \
             make_checked_val=False, prop_getter=False, force_exception=False, \
             bound_typevars={}, bound_typevars_readonly=False, follow_fwd_refs=True,
-            _recursion_check=None):
+            _recursion_check=None, sample=None, budget=None):
+    sample = _apply_budget(budget, check_val, func, slf, func_class, True, prop_getter,
+            force_exception, sample)
     if make_checked_val:
+        if not sample is None:
+            sample = _RecordedSample(sample)
         result, checked_val = _checkinstance(check_val, _match_stub_type(resSig),
                 func_class, bound_typevars, bound_typevars_readonly, follow_fwd_refs,
-                _recursion_check, False, func)
+                _recursion_check, False, func, sample=sample)
+        sampled_val = check_val if sample is None else sample.checked_value(check_val)
     else:
-        result = _isinstance(check_val, _match_stub_type(resSig),
-                func_class, bound_typevars, bound_typevars_readonly, follow_fwd_refs,
-                _recursion_check)
+        sampled_val = check_val if sample is None else sample.sample(check_val)
+        result = _isinstance(sampled_val, _match_stub_type(resSig), func_class,
+                bound_typevars, bound_typevars_readonly, follow_fwd_refs, _recursion_check)
         checked_val = None
     if not result:
         # todo: constrain deep_type-depth
-        tpch = deep_type(check_val)
+        # Describe the sample that was checked, so the offending element is included
+        tpch = deep_type(sampled_val)
         msg = _make_type_error_message(tpch, func, slf, func_class, resSig,
                 'returned incompatible type', prop_getter, bound_typevars)
         _raise_typecheck_error(msg, True, check_val, tpch, resSig, func)
@@ -728,7 +1017,8 @@ def _checkfuncresult(resSig, check_val, func, slf, func_class, \
 
 # Todo: Rename to something that better indicates this is also applicable to some descriptors,
 #       e.g. to typechecked_member
-def typechecked_func(func, force = False, argType = None, resType = None, prop_getter = False):
+def typechecked_func(func, force = False, argType = None, resType = None, prop_getter = False,
+            sample = None, budget = None):
     """Works like typechecked, but is only applicable to functions, methods and properties.
     """
     if not pytypes.checking_enabled and not pytypes.do_logging_in_typechecked:
@@ -738,15 +1028,22 @@ def typechecked_func(func, force = False, argType = None, resType = None, prop_g
         return func
     if hasattr(func, 'do_typecheck'):
         func.do_typecheck = True
+        if not sample is None:
+            func._check_sample = type_util._get_sample_policy(sample)
+        if not budget is None:
+            func._check_budget = budget
         return func
     elif hasattr(func, 'do_logging'):
         # actually shouldn't happen
-        return _typeinspect_func(func, True, func.do_logging, argType, resType, prop_getter)
+        return _typeinspect_func(func, True, func.do_logging, argType, resType, prop_getter,
+                sample, budget=budget)
     else:
-        return _typeinspect_func(func, True, False, argType, resType, prop_getter)
+        return _typeinspect_func(func, True, False, argType, resType, prop_getter, sample,
+                budget=budget)
 
 def _typeinspect_func(func, do_typecheck, do_logging, \
-            argType = None, resType = None, prop_getter = False):
+            argType = None, resType = None, prop_getter = False, sample = None,
+            log_sample = None, budget = None):
     clsm = isinstance(func, classmethod)
     stat = isinstance(func, staticmethod)
     prop = isinstance(func, property)
@@ -754,6 +1051,10 @@ def _typeinspect_func(func, do_typecheck, do_logging, \
     func0 = _actualfunc(func, prop_getter)
     specs = getargspecs(func0)
     argNames = util.getargnames(specs)
+    binder = util._ArgBinder(specs)
+    if not argType is None and not resType is None:
+        fixed_sig_checked = (_needs_checked_val(argType),
+                _needs_checked_val(_match_stub_type(resType)))
     if do_logging and pytypes.typelogger_include_typehint and _has_type_hints(func):
         try:
             clss = util.get_class_that_defined_method(func)
@@ -762,12 +1063,16 @@ def _typeinspect_func(func, do_typecheck, do_logging, \
             pytypes._register_logged_func(func, False, prop_getter, None, specs)
     def checker_tp(*args, **kw):
         if hasattr(checker_tp, '__annotations__') and len(checker_tp.__annotations__) > 0:
-            checker_tp.ch_func.__annotations__ = checker_tp.__annotations__
+            if not getattr(checker_tp.ch_func, '__annotations__', None) is \
+                    checker_tp.__annotations__:
+                checker_tp.ch_func.__annotations__ = checker_tp.__annotations__
+                # annotations were replaced, so cached signatures are outdated
+                checker_tp._sig_cache.clear()
         # check consistency regarding special case with 'self'-keyword
         slf = False
-        args_kw = util.getargskw(args, kw, specs)
+        args_kw = binder.getargskw(args, kw)[0]
         # Todo: Use argskw_err for better error msg or to fail early
-        # args_kw, argskw_err = util._getargskw(args, kw, specs)
+        # args_kw, argskw_err = binder.getargskw(args, kw)
 
         if len(argNames) > 0:
             if clsm:
@@ -816,7 +1121,8 @@ def _typeinspect_func(func, do_typecheck, do_logging, \
                         res = func.fset(*args, **kw)
                 else:
                     res = func(*args, **kw)
-                pytypes.log_type(check_args, res, func, slf, prop_getter, parent_class, specs)
+                pytypes.log_type(check_args, res, func, slf, prop_getter, parent_class, specs,
+                        sample=checker_tp._log_sample)
                 return res
             else:
                 return func(*args, **kw)
@@ -840,61 +1146,109 @@ def _typeinspect_func(func, do_typecheck, do_logging, \
             else:
                 toCheck = func
             if argType is None or resType is None:
-                argSig, resSig = _funcsigtypes(toCheck, slf or clsm,
-                        parent_class, None, prop_getter or auto_prop_getter)
-                if argType is None:
-                    argSig = _match_stub_type(argSig)
-                else:
-                    argSig = argType
-                if resType is None:
-                    resSig = _match_stub_type(resSig)
-                else:
-                    resSig = resType
+                if checker_tp._sig_cache_generation != type_util._funcsig_cache_generation:
+                    checker_tp._sig_cache.clear()
+                    checker_tp._sig_cache_generation = type_util._funcsig_cache_generation
+                sig_key = (toCheck, parent_class, slf or clsm,
+                        pytypes.infer_default_value_types,
+                        pytypes.annotations_override_typestring,
+                        pytypes.strict_annotation_collision_check)
+                try:
+                    # LRU: move the entry to the end
+                    sig_entry = checker_tp._sig_cache.pop(sig_key)
+                    checker_tp._sig_cache[sig_key] = sig_entry
+                    argSig, resSig, args_checked, res_checked = sig_entry
+                except (KeyError, TypeError):
+                    argSig, resSig = _funcsigtypes(toCheck, slf or clsm,
+                            parent_class, None, prop_getter or auto_prop_getter)
+                    if argType is None:
+                        argSig = _match_stub_type(argSig)
+                    else:
+                        argSig = argType
+                    if resType is None:
+                        resSig = _match_stub_type(resSig)
+                    else:
+                        resSig = resType
+                    args_checked = _needs_checked_val(argSig)
+                    res_checked = _needs_checked_val(_match_stub_type(resSig))
+                    try:
+                        checker_tp._sig_cache[sig_key] = (argSig, resSig,
+                                args_checked, res_checked)
+                        if len(checker_tp._sig_cache) > _sig_cache_size:
+                            checker_tp._sig_cache.popitem(False)
+                    except TypeError:
+                        # unhashable parent_class, e.g. due to exotic Generic args
+                        pass
             else:
                 argSig, resSig = argType, resType
-            make_checked = pytypes.check_callables or \
-                    pytypes.check_iterables or pytypes.check_generators
+                args_checked, res_checked = fixed_sig_checked
+            # Only create checked versions of args if the signature contains e.g. a
+            # Callable. Otherwise args and kw are passed through unchanged.
+            make_checked = args_checked and (pytypes.check_callables or \
+                    pytypes.check_iterables or pytypes.check_generators)
+            smpl = checker_tp._check_sample
+            if smpl is None:
+                smpl = type_util._get_global_sample_policy()
+            bdgt = checker_tp._check_budget
+            if bdgt is None:
+                bdgt = pytypes.check_budget
             bound_typevars = {}
             checked_val = _checkfunctype(argSig, check_args,
                     toCheck, slf or clsm, parent_class, make_checked,
-                    prop_getter or auto_prop_getter, specs, bound_typevars=bound_typevars)
+                    prop_getter or auto_prop_getter, specs, bound_typevars=bound_typevars,
+                    sample=smpl, budget=bdgt)
             if make_checked:
-                checked_args, checked_kw = util.fromargskw(checked_val, specs, slf or clsm)
+                checked_args, checked_kw = binder.fromargskw(checked_val, slf or clsm)
+                if len(args_kw) != len(checked_val):
+                    # self or cls was not part of the check
+                    checked_args = (args[0],)+tuple(checked_args)
             else:
                 checked_args = args
                 checked_kw = kw
-    
+
             # perform backend-call:
             if clsm or stat:
-                if len(args_kw) != len(checked_val):
-                    res = func.__func__(args[0], *checked_args, **checked_kw)
-                else:
-                    res = func.__func__(*checked_args, **checked_kw)
+                res = func.__func__(*checked_args, **checked_kw)
             elif prop:
                 if prop_getter or func.fset is None:
-                    res = func.fget(args[0], *checked_args, **checked_kw)
+                    res = func.fget(*checked_args, **checked_kw)
                 else:
-                    res = func.fset(args[0], *checked_args, **checked_kw)
+                    res = func.fset(*checked_args, **checked_kw)
             else:
-                if len(args_kw) != len(checked_val):
-                    res = func(args[0], *checked_args, **checked_kw)
-                else:
-                    res = func(*checked_args, **checked_kw)
+                res = func(*checked_args, **checked_kw)
 
-            checked_res = _checkfuncresult(resSig, res, toCheck, \
-                    slf or clsm, parent_class, True, prop_getter, bound_typevars=bound_typevars)
+            if res_checked:
+                checked_res = _checkfuncresult(resSig, res, toCheck, \
+                        slf or clsm, parent_class, True, prop_getter,
+                        bound_typevars=bound_typevars, sample=smpl, budget=bdgt)
+            else:
+                _checkfuncresult(resSig, res, toCheck, slf or clsm, parent_class, False,
+                        prop_getter, bound_typevars=bound_typevars, sample=smpl, budget=bdgt)
+                checked_res = res
             if pytypes.do_logging_in_typechecked:
-                pytypes.log_type(check_args, res, func, slf, prop_getter, parent_class, specs)
+                pytypes.log_type(check_args, res, func, slf, prop_getter, parent_class, specs,
+                        sample=checker_tp._log_sample)
             return checked_res
 
+    if sys.version_info < (3, 7):
+        # typing.get_type_hints only follows __wrapped__ from Python 3.7 on.
+        checker_tp = _with_wrapper_globals(checker_tp, func0)
     checker_tp.ch_func = func
+    # Signatures resolved by checker_tp, see type_util.invalidate_signature_cache.
+    # LRU cache of at most _sig_cache_size entries.
+    checker_tp._sig_cache = collections.OrderedDict()
+    checker_tp._sig_cache_generation = type_util._funcsig_cache_generation
+    checker_tp._check_sample = type_util._get_sample_policy(sample)
+    checker_tp._check_budget = budget
+    checker_tp._log_sample = log_sample
     checker_tp.do_typecheck = do_typecheck
     checker_tp.do_logging = do_logging
     if hasattr(func, '__func__'):
         checker_tp.__func__ = func.__func__
     checker_tp.__name__ = func0.__name__
     checker_tp.__module__ = func0.__module__
-    checker_tp.__globals__.update(func0.__globals__)
+    # Lets e.g. typing.get_type_hints resolve names in func's module
+    checker_tp.__wrapped__ = func0
     if hasattr(func, '__annotations__'):
         checker_tp.__annotations__ = func.__annotations__
     if hasattr(func, '__qualname__'):
@@ -912,20 +1266,23 @@ def _typeinspect_func(func, do_typecheck, do_logging, \
             if not hasattr(func.fget, 'ch_func'):
                 #todo: What about @no_type_check applied to getter/setter?
                 checker_tp_get = _typeinspect_func(func, do_typecheck, do_logging, \
-                        argType, resType, True)
+                        argType, resType, True, sample, log_sample, budget)
                 return property(checker_tp_get, checker_tp, func.fdel, func.__doc__)
             return property(func.fget, checker_tp, func.fdel, func.__doc__)
     else:
         return checker_tp
 
 
-def typechecked_class(cls, force = False, force_recursive = False):
+def typechecked_class(cls, force = False, force_recursive = False, sample = None,
+            budget = None):
     """Works like typechecked, but is only applicable to classes.
     """
-    return _typechecked_class(cls, set(), force, force_recursive)
+    return _typechecked_class(cls, set(), force, force_recursive, sample=sample,
+            budget=budget)
 
 
-def _typechecked_class(cls, cache, force = False, force_recursive = False, nesting = None):
+def _typechecked_class(cls, cache, force = False, force_recursive = False, nesting = None,
+            sample = None, budget = None):
     if not pytypes.checking_enabled:
         return cls
     assert(isclass(cls))
@@ -944,7 +1301,8 @@ def _typechecked_class(cls, cache, force = False, force_recursive = False, nesti
             if type_util._check_as_func(memb):
                 if _has_type_hints(getattr(cls, key), cls, nst) or \
                         hasattr(_actualfunc(memb), 'override_checked'):
-                    setattr(cls, key, typechecked_func(memb, force_recursive))
+                    setattr(cls, key, typechecked_func(memb, force_recursive, sample=sample,
+                            budget=budget))
 # 				else:
 # 					print ("wouldn't check", key, cls, memb, getattr(cls, key))
             elif isclass(memb) and not memb in cache:
@@ -954,11 +1312,12 @@ def _typechecked_class(cls, cache, force = False, force_recursive = False, nesti
                 else:
                     nst2 = [cls]
                 nst2.append(memb)
-                _typechecked_class(memb, cache, force_recursive, force_recursive, nst2)
+                _typechecked_class(memb, cache, force_recursive, force_recursive, nst2, sample,
+                        budget)
     return cls
 
 # Todo: Extend tests for this
-def typechecked_module(md, force_recursive = False):
+def typechecked_module(md, force_recursive = False, sample = None, budget = None):
     """Works like typechecked, but is only applicable to modules (by explicit call).
     md must be a module or a module name contained in sys.modules.
     """
@@ -973,14 +1332,14 @@ def typechecked_module(md, force_recursive = False):
                 return md_arg
         elif md in _pending_modules:
             # if import is pending, we just store this call for later
-            _pending_modules[md].append(lambda t: typechecked_module(t, True))
+            _pending_modules[md].append(lambda t: typechecked_module(t, True, sample, budget))
             return md_arg
         else:
             raise KeyError('Found no module {!r} to typecheck'.format(md))
     assert(ismodule(md))
     if md.__name__ in _pending_modules:
             # if import is pending, we just store this call for later
-            _pending_modules[md.__name__].append(lambda t: typechecked_module(t, True))
+            _pending_modules[md.__name__].append(lambda t: typechecked_module(t, True, sample, budget))
             # we already process the module now as far as possible for its internal use
             # todo: Issue warning here that not the whole module might be covered yet
     if md.__name__ in _fully_typechecked_modules and \
@@ -996,34 +1355,45 @@ def typechecked_module(md, force_recursive = False):
         if force_recursive or not is_no_type_check(memb) and hasattr(memb, '__module__'):
             if _check_as_func(memb) and memb.__module__ == md.__name__ and \
                     has_type_hints(memb):
-                setattr(md, key, typechecked_func(memb, force_recursive))
+                setattr(md, key, typechecked_func(memb, force_recursive, sample=sample,
+                        budget=budget))
             elif isclass(memb) and memb.__module__ == md.__name__:
-                typechecked_class(memb, force_recursive, force_recursive)
+                typechecked_class(memb, force_recursive, force_recursive, sample, budget)
     if not md.__name__ in _pending_modules:
         _fully_typechecked_modules[md.__name__] = len(md.__dict__)
     return md_arg
 
 
-def typechecked(memb):
+def typechecked(memb = None, sample = None, budget = None):
     """Decorator applicable to functions, methods, properties,
     classes or modules (by explicit call).
     If applied on a module, memb must be a module or a module name contained in sys.modules.
     See pytypes.set_global_typechecked_decorator to apply this on all modules.
     Asserts compatibility of runtime argument and return values of all targeted functions
     and methods w.r.t. PEP 484-style type annotations of these functions and methods.
+    sample lets the typechecker only check a sample of the elements of large lists,
+    dicts and sets. It can be a type_util.SamplePolicy or an int as shorthand for
+    SamplePolicy(sample). Use it as @typechecked(sample=...).
+    See pytypes.check_sample to configure this globally.
+    budget lets the typechecker explore only limited depth and number of elements of
+    nested containers and defines what happens to values beyond this limit.
+    It must be a type_util.Budget. Use it as @typechecked(budget=Budget(...)).
+    See pytypes.check_budget to configure this globally.
     """
+    if memb is None:
+        return lambda memb2: typechecked(memb2, sample, budget)
     if not pytypes.checking_enabled:
         return memb
     if is_no_type_check(memb):
         return memb
     if type_util._check_as_func(memb):
-        return typechecked_func(memb)
+        return typechecked_func(memb, sample=sample, budget=budget)
     if isclass(memb):
-        return typechecked_class(memb)
+        return typechecked_class(memb, sample=sample, budget=budget)
     if ismodule(memb):
-        return typechecked_module(memb, True)
+        return typechecked_module(memb, True, sample, budget)
     if memb in sys.modules or memb in _pending_modules:
-        return typechecked_module(memb, True)
+        return typechecked_module(memb, True, sample, budget)
     return memb
 
 
@@ -1040,14 +1410,17 @@ def auto_override_class(cls, force = False, force_recursive = False):
     # For this we don't use keys() because of Python 3.
     # Todo: Better use inspect.getmembers here
     keys = [key for key in cls.__dict__]
+    pending = []
     for key in keys:
         memb = cls.__dict__[key]
         if force_recursive or not is_no_type_check(memb):
             if isfunction(memb) or ismethod(memb) or ismethoddescriptor(memb):
                 if util._has_base_method(memb, cls):
-                    setattr(cls, key, override(memb))
+                    setattr(cls, key, _override(memb, False, pending))
             elif isclass(memb):
                 auto_override_class(memb, force_recursive, force_recursive)
+    if len(pending) > 0:
+        _check_override_class(cls, pending)
     return cls
 
 
@@ -1187,6 +1560,6 @@ def check_return_type(value, cllable = None, clss = None, caller_level = 0):
 
 class TypeChecker(TypeAgent):
 
-    def __init__(self, all_threads = True):
-        TypeAgent.__init__(self, all_threads)
+    def __init__(self, all_threads = True, include_modules = None, exclude_modules = None):
+        TypeAgent.__init__(self, all_threads, include_modules, exclude_modules)
         self._checking_enabled = True
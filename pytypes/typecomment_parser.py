@@ -15,11 +15,22 @@
 # Created on 13.12.2016
 
 import inspect, typing
+import ast
+import sys
+import linecache
+import os
+import tokenize
 from typing import Any, Tuple
 
 import pytypes
 from .exceptions import TypeSyntaxError
 
+try:
+    import builtins as _builtins
+except ImportError:
+    # Python 2
+    import __builtin__ as _builtins
+
 
 def _striptrailingcomment(s):
     pos = s.find('#')
@@ -43,7 +54,134 @@ def _parse_typecomment_oneline(line):
     return None
 
 
+# Maps filenames to (mtime, size, index), see _get_typecomment_index
+_typecomment_indices = {}
+
+_header_openers = ('(', '[', '{')
+_header_closers = (')', ']', '}')
+
+
+def _build_typecomment_index(lines):
+    """Scans the source lines of a module in one tokenize pass.
+    Returns a dict that maps the line of each def (and of the first decorator of it,
+    which is what co_firstlineno points to) to (typestring, arg_typestrings), i.e. to
+    what _get_typestrings_from_source would yield for the function with slf=False.
+    """
+    comments = {}
+    last_tokens = {}
+    headers = []
+    decorator_line = None
+    header = None
+    depth = 0
+    at_line_start = True
+    itr = iter(lines)
+    try:
+        readline = itr.__next__
+    except AttributeError:
+        # Python 2
+        readline = itr.next
+    for tok in tokenize.generate_tokens(readline):
+        tp, string, start, end = tok[:4]
+        if tp == tokenize.COMMENT:
+            comments[start[0]] = string
+            continue
+        if tp == tokenize.NEWLINE:
+            at_line_start = True
+            continue
+        if tp in (tokenize.NL, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER):
+            continue
+        last_tokens[end[0]] = string
+        if at_line_start:
+            at_line_start = False
+            if string == '@':
+                if decorator_line is None:
+                    decorator_line = start[0]
+            elif string == 'def' or string == 'async':
+                header = [start[0], decorator_line]
+                depth = 0
+                decorator_line = None
+            else:
+                decorator_line = None
+        elif not header is None:
+            if string in _header_openers:
+                depth += 1
+            elif string in _header_closers:
+                depth -= 1
+            elif string == ':' and depth == 0:
+                header.append(start[0])
+                headers.append(header)
+                header = None
+    index = {}
+    for def_line, decorator_line, end_line in headers:
+        args = []
+        for line in range(def_line, end_line):
+            # like _get_typestrings_from_source we skip lines ending with '('
+            if line in last_tokens and last_tokens[line] != '(':
+                args.append(_parse_typecomment_oneline(comments.get(line, '')))
+        res = _parse_typecomment_oneline(comments.get(end_line, ''))
+        if res is None and not end_line+1 in last_tokens and end_line+1 in comments:
+            res = _parse_typecomment_oneline(comments[end_line+1])
+        index[def_line] = (res, args)
+        if not decorator_line is None:
+            index[decorator_line] = (res, args)
+    return index
+
+
+def _get_typecomment_index(filename):
+    """Retrieves the type comment index of a source file from cache or builds it.
+    The index is rebuilt if mtime or size of the file changed.
+    Returns None if the file cannot be read or tokenized.
+    """
+    try:
+        stat = os.stat(filename)
+    except (OSError, TypeError):
+        return None
+    try:
+        mtime, size, index = _typecomment_indices[filename]
+        if mtime == stat.st_mtime and size == stat.st_size:
+            return index
+        linecache.checkcache(filename)
+    except KeyError:
+        pass
+    lines = linecache.getlines(filename)
+    if not lines:
+        index = None
+    else:
+        try:
+            index = _build_typecomment_index(lines)
+        except (tokenize.TokenError, SyntaxError):
+            index = None
+    _typecomment_indices[filename] = (stat.st_mtime, stat.st_size, index)
+    return index
+
+
 def _get_typestrings(obj, slf):
+    """Returns the type comment of the function obj and the per-argument type
+    comments as (typestring, arg_typestrings). Missing comments are None.
+    If slf is true, the comment of the first argument is omitted.
+    Looks the function up in the type comment index of its source file, so usually
+    no source needs to be read.
+    """
+    try:
+        func = inspect.unwrap(obj)
+    except AttributeError:
+        # Python 2
+        func = obj
+    except ValueError:
+        func = obj
+    code = getattr(getattr(func, '__func__', func), '__code__', None)
+    if not code is None:
+        index = _get_typecomment_index(code.co_filename)
+        if not index is None:
+            try:
+                res, args = index[code.co_firstlineno]
+                return res, args[1:] if slf else list(args)
+            except KeyError:
+                pass
+    return _get_typestrings_from_source(obj, slf)
+
+
+def _get_typestrings_from_source(obj, slf):
     try:
         srclines = inspect.getsourcelines(obj)[0]
     except TypeError:
@@ -208,6 +346,122 @@ def _check_vararg_typestring(typestring, argString, argspec, func, slf, func_cla
     return argString
 
 
+# Maps type expression strings to compiled type expressions, see _get_typeexpr
+_typeexpr_cache = {}
+_typing_names = frozenset(typing.__all__)
+# Before Python 3.8 ast represents literals by Str, Num, etc rather than Constant
+_legacy_ast_literals = sys.version_info < (3, 8)
+_NoneType = type(None)
+
+
+def _typeexpr_constant(node):
+    """Helper for _compile_typeexpr. Returns (True, value) if node is a literal,
+    otherwise (False, None).
+    """
+    if not _legacy_ast_literals:
+        if isinstance(node, ast.Constant):
+            return True, node.value
+        return False, None
+    if isinstance(node, ast.Str):
+        return True, node.s
+    if isinstance(node, ast.Num):
+        return True, node.n
+    if sys.version_info.major >= 3 and isinstance(node, ast.NameConstant):
+        return True, node.value
+    if isinstance(node, ast.Ellipsis):
+        return True, Ellipsis
+    return False, None
+
+
+def _compile_typeexpr(node, typestring):
+    """Turns the AST of a type expression into a function that takes a name lookup
+    function and evaluates the type expression like eval would.
+    Supports names, attributes, subscripts, tuples, lists (e.g. for Callable) and
+    literals. None, also spelled type(None), evaluates to NoneType.
+    Raises TypeSyntaxError for all other expressions.
+    """
+    if isinstance(node, ast.Expression):
+        return _compile_typeexpr(node.body, typestring)
+    is_const, value = _typeexpr_constant(node)
+    if is_const:
+        if value is None:
+            value = _NoneType
+        return lambda lookup: value
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name == 'None':
+            # Python 2
+            return lambda lookup: _NoneType
+        return lambda lookup: lookup(name)
+    if isinstance(node, ast.Attribute):
+        value_expr = _compile_typeexpr(node.value, typestring)
+        attr = node.attr
+        return lambda lookup: getattr(value_expr(lookup), attr)
+    if isinstance(node, ast.Subscript):
+        value_expr = _compile_typeexpr(node.value, typestring)
+        index_expr = _compile_typeexpr_slice(node.slice, typestring)
+        return lambda lookup: value_expr(lookup)[index_expr(lookup)]
+    if isinstance(node, (ast.Tuple, ast.List)):
+        ctor = tuple if isinstance(node, ast.Tuple) else list
+        elts = [_compile_typeexpr(elt, typestring) for elt in node.elts]
+        return lambda lookup: ctor([elt(lookup) for elt in elts])
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+            node.func.id == 'type' and len(node.args) == 1 and not node.keywords:
+        arg = node.args[0]
+        if _typeexpr_constant(arg) == (True, None) or \
+                isinstance(arg, ast.Name) and arg.id == 'None':
+            return lambda lookup: _NoneType
+    raise TypeSyntaxError('Unsupported expression in type comment: '+typestring)
+
+
+def _compile_typeexpr_slice(slc, typestring):
+    """Helper for _compile_typeexpr. Compiles the slice of a subscript.
+    Before Python 3.9 it is wrapped in Index or, e.g. for Tuple[int, ...] on
+    Python 2, given as ExtSlice with one dimension per subscript element.
+    On Python 2 a plain ... is an Ellipsis slice.
+    """
+    if isinstance(slc, ast.Index):
+        return _compile_typeexpr(slc.value, typestring)
+    if sys.version_info < (3, 9) and isinstance(slc, ast.ExtSlice):
+        dims = [_compile_typeexpr_slice(dim, typestring) for dim in slc.dims]
+        return lambda lookup: tuple([dim(lookup) for dim in dims])
+    return _compile_typeexpr(slc, typestring)
+
+
+def _get_typeexpr(typestring):
+    """Retrieves the compiled type expression for typestring from cache or parses
+    and compiles it. See _compile_typeexpr.
+    """
+    try:
+        return _typeexpr_cache[typestring]
+    except KeyError:
+        pass
+    expr = _compile_typeexpr(ast.parse(typestring.strip(), mode='eval'), typestring)
+    _typeexpr_cache[typestring] = expr
+    return expr
+
+
+def _eval_typeexpr(typestring, glbls):
+    """Evaluates a type expression from a type comment.
+    Names are looked up in glbls, then in typing if
+    pytypes.tp_comment_parser_import_typing is set, then in builtins.
+    In contrast to eval, only type expressions are supported, see _compile_typeexpr.
+    """
+    import_typing = pytypes.tp_comment_parser_import_typing
+    def lookup(name):
+        try:
+            return glbls[name]
+        except KeyError:
+            pass
+        if import_typing and name in _typing_names:
+            return getattr(typing, name)
+        try:
+            return getattr(_builtins, name)
+        except AttributeError:
+            raise NameError("name '%s' is not defined" % name)
+    return _get_typeexpr(typestring)(lookup)
+
+
 def _funcsigtypesfromstring(typestring, argTypes=None, argspec=None, glbls=globals(),
         selfType=None, argCount=None, unspecified_type=Any, defaults=None, func=None,
         slf=False, func_class=None):
@@ -225,11 +479,7 @@ def _funcsigtypesfromstring(typestring, argTypes=None, argspec=None, glbls=globa
 # 		useEllipsis = False
     argTypes0 = argTypes
     resString = typestring[splt+2:].strip()
-    if pytypes.tp_comment_parser_import_typing:
-        for tpname in typing.__all__:
-            if not tpname in glbls:
-                glbls[tpname] = getattr(typing, tpname)
-    argTp = eval(argString, glbls)
+    argTp = _eval_typeexpr(argString, glbls)
     if selfType is None:
         argTypes = []
     else:
@@ -261,12 +511,6 @@ def _funcsigtypesfromstring(typestring, argTypes=None, argspec=None, glbls=globa
 # 	if useEllipsis:
 # 		tpl.__tuple_use_ellipsis__ = True
 
-    # Normalize occurrence of None to type(None).
-    # (Doing this in pre-eval manner/text-mode is easier than going
-    #  through maybe nested type-vars, etc)
-    # To avoid that this creates type(type(None)) if type(None) is already in place:
-    resString = resString.replace('type(None)', 'None')
-    resString = resString.replace('None', 'type(None)')	
-
-    resType = eval(resString, glbls)
+    # _eval_typeexpr normalizes occurrences of None to type(None)
+    resType = _eval_typeexpr(resString, glbls)
     return tpl, resType
@@ -24,8 +24,10 @@ Also allows creation of Python 2.7 compatible stubfiles.
 import sys
 import os
 import abc
+import random
 import datetime
 import atexit
+from collections import OrderedDict
 from typing import Union, Any, Tuple
 from inspect import getmembers, isclass, ismodule, getsourcelines, \
         findsource, isfunction, ismethod, ismethoddescriptor
@@ -52,6 +54,7 @@ use_NoneType = False
 simplify = True
 _module_file_map = {} # cache module filenames for use atexit
 _member_line_map = {} # cache line numbers for use atexit
+_global_log_sample_policy = (None, None) # pytypes.typelogging_sample and its LogSamplePolicy
 # (for some reason, module.__file__ does not exist any more when atexit performs)
 
 
@@ -60,18 +63,106 @@ def _print(line):
         print(line)
 
 
+class LogSamplePolicy(object):
+    """Lets the typelogger only log a fraction of the calls per function.
+    Apply it via typelogged(sample=...), TypeLogger(sample=...) or globally
+    via pytypes.typelogging_sample.
+    The first call of each function is always logged, so every called function
+    appears in the stubfile.
+
+    mode : str
+    'probability' logs each call with probability value.
+    'every' logs every value-th call.
+    'adaptive' logs every call until value subsequent calls did not yield a new
+    combination of argument and return types. Afterwards the function is not
+    logged any more.
+
+    value : Union[float, int]
+    The probability or the number of calls, depending on mode.
+
+    seed : Optional[int]
+    Seed for the random number generator used by mode 'probability'.
+    Default: None
+
+    Unlogged calls skip the expensive deep_type inference of arguments and
+    return value.
+    """
+
+    modes = ('probability', 'every', 'adaptive')
+
+    def __init__(self, mode, value, seed = None):
+        if not mode in LogSamplePolicy.modes:
+            raise ValueError('Unknown log sample mode: %s. Use one of %s'
+                    % (mode, str(LogSamplePolicy.modes)))
+        if mode == 'probability':
+            if not 0.0 <= value <= 1.0:
+                raise ValueError('Log sample probability must be in [0, 1], not %s'
+                        % str(value))
+        elif value < 1:
+            raise ValueError('Log sample value must be positive, not %s' % str(value))
+        self.mode = mode
+        self.value = value
+        self._random = random.Random(seed)
+
+    def __repr__(self):
+        return 'LogSamplePolicy(%r, %r)' % (self.mode, self.value)
+
+    def _log_call(self, node):
+        """Counts a call of the function represented by node and tells
+        whether to log it.
+        """
+        node.calls += 1
+        if node.calls == 1:
+            return True
+        if self.mode == 'probability':
+            return self._random.random() < self.value
+        if self.mode == 'every':
+            return (node.calls-1) % self.value == 0
+        return node.stable_observations < self.value
+
+
+def _get_log_sample_policy(sample):
+    """Helper for typelogged. Turns the sample argument into a LogSamplePolicy.
+    A float is shorthand for LogSamplePolicy('probability', sample), an int for
+    LogSamplePolicy('every', sample). None means no sampling.
+    """
+    if sample is None or isinstance(sample, LogSamplePolicy):
+        return sample
+    if isinstance(sample, float):
+        return LogSamplePolicy('probability', sample)
+    return LogSamplePolicy('every', sample)
+
+
+def _get_global_log_sample_policy():
+    """Returns pytypes.typelogging_sample as a LogSamplePolicy.
+    """
+    global _global_log_sample_policy
+    if not _global_log_sample_policy[0] is pytypes.typelogging_sample:
+        _global_log_sample_policy = (pytypes.typelogging_sample,
+                _get_log_sample_policy(pytypes.typelogging_sample))
+    return _global_log_sample_policy[1]
+
+
 def log_type(args_kw, ret, func, slf=False, prop_getter=False, clss=None, argspecs=None,
-            args_kw_type=None, ret_type = None):
+            args_kw_type=None, ret_type = None, sample = None):
     """Stores information of a function or method call into a cache, so pytypes can
     create a PEP 484 stubfile from this information later on (see dump_cache).
+    sample can be a LogSamplePolicy that decides whether this call is actually
+    logged. If None, pytypes.typelogging_sample applies. False logs the call in any case.
+    Returns the node representing func in the cache.
     """
+    if argspecs is None:
+        argspecs = getargspecs(func)
+    node = _register_logged_func(func, slf, prop_getter, clss, argspecs)
+    if not sample is False:
+        sample = _get_global_log_sample_policy() if sample is None else \
+                _get_log_sample_policy(sample)
+        if not sample is None and not sample._log_call(node):
+            return node
     if args_kw_type is None:
         args_kw_type = deep_type(args_kw)
     if ret_type is None:
         ret_type = deep_type(ret)
-    if argspecs is None:
-        argspecs = getargspecs(func)
-    node = _register_logged_func(func, slf, prop_getter, clss, argspecs)
     node.add_observation(args_kw_type, ret_type)
     
     md = util.getmodule_for_member(func, prop_getter)
@@ -85,6 +176,7 @@ def log_type(args_kw, ret, func, slf=False, prop_getter=False, clss=None, argspe
             pass
     if not clss is None and not clss in _member_line_map:
         _member_line_map[clss] = findsource(clss)[1]
+    return node
 
 
 def _register_logged_func(func, slf, prop_getter, clss, argspecs):
@@ -548,8 +640,18 @@ class _typed_member(_base_node):
             self.name = self.member.__func__.__name__ if clsm or stat else self.member.__name__
         self.argspecs = argspecs
         self.clss = clss
-        self.arg_type_observations = []
-        self.ret_type_observations = []
+        # Maps each distinct (args_kw_type, ret_type) observation to its number
+        # of occurrences, in order of first occurrence.
+        self.observations = OrderedDict()
+        # Same as list of [(args_kw_type, ret_type), count] for unhashable types
+        self._unhashable_observations = []
+        # (args_kw_type, ret_type) from the member's type hints, if included in the
+        # stub; not an observed call, so it is neither counted nor sampled
+        self._type_hint_observation = None
+        # Number of calls seen by a LogSamplePolicy, including unlogged ones
+        self.calls = 0
+        # Number of subsequent observations that did not add a new type combination
+        self.stable_observations = 0
         self._idn = None
         self.slf = slf
         self.clsm = clsm
@@ -559,8 +661,53 @@ class _typed_member(_base_node):
         self._added_type_hints = False
 
     def add_observation(self, args_kw_type, ret_type):
-        self.arg_type_observations.append(args_kw_type)
-        self.ret_type_observations.append(ret_type)
+        key = (args_kw_type, ret_type)
+        try:
+            if key in self.observations:
+                self.observations[key] += 1
+                self.stable_observations += 1
+                return
+            self.observations[key] = 1
+        except TypeError:
+            for obs in self._unhashable_observations:
+                if obs[0] == key:
+                    obs[1] += 1
+                    self.stable_observations += 1
+                    return
+            self._unhashable_observations.append([key, 1])
+        self.stable_observations = 0
+
+    def observation_counts(self):
+        """Returns a list of all distinct observations as
+        ((args_kw_type, ret_type), count) pairs in order of first occurrence.
+        """
+        res = list(self.observations.items())
+        res.extend(tuple(obs) for obs in self._unhashable_observations)
+        return res
+
+    def _signature_observations(self):
+        """Returns all distinct (args_kw_type, ret_type) pairs in order of first
+        occurrence, followed by the type hint observation if present.
+        """
+        res = [obs[0] for obs in self.observation_counts()]
+        if not self._type_hint_observation is None and \
+                not self._type_hint_observation in res:
+            res.append(self._type_hint_observation)
+        return res
+
+    @property
+    def arg_type_observations(self):
+        """The argument types of all distinct observations as a list of Tuple types.
+        Index-aligned with ret_type_observations.
+        """
+        return [obs[0] for obs in self._signature_observations()]
+
+    @property
+    def ret_type_observations(self):
+        """The return types of all distinct observations as a list.
+        Index-aligned with arg_type_observations.
+        """
+        return [obs[1] for obs in self._signature_observations()]
 
     def _add_observation_from_type_info(self):
         if pytypes.typelogger_include_typehint and \
@@ -569,7 +716,7 @@ class _typed_member(_base_node):
             args, ret = _get_types(self.member, self.clsm, self.slf, self.clss,
                     self.prop_getter)
             args = _preprocess_typecheck(args, self.argspecs, self.slf or self.clsm)
-            self.add_observation(args, ret)
+            self._type_hint_observation = (args, ret)
 
     def _type_str(self, assumed_globals=None, implicit_globals=None):
         arg_str =  _prepare_arg_types_str(combine_argtype(self.arg_type_observations),
@@ -830,7 +977,7 @@ class _class_node(_base_node):
             return findsource(self.clss)[1]
 
 
-def typelogged_func(func):
+def typelogged_func(func, sample = None):
     """Works like typelogged, but is only applicable to functions,
     methods and properties.
     """
@@ -838,15 +985,19 @@ def typelogged_func(func):
         return func
     if hasattr(func, 'do_logging'):
         func.do_logging = True
+        if not sample is None:
+            func._log_sample = _get_log_sample_policy(sample)
         return func
     elif hasattr(func, 'do_typecheck'):
         # actually shouldn't happen
-        return _typeinspect_func(func, func.do_typecheck, True)
+        return _typeinspect_func(func, func.do_typecheck, True,
+                log_sample = _get_log_sample_policy(sample))
     else:
-        return _typeinspect_func(func, False, True)
+        return _typeinspect_func(func, False, True,
+                log_sample = _get_log_sample_policy(sample))
 
 
-def typelogged_class(cls):
+def typelogged_class(cls, sample = None):
     """Works like typelogged, but is only applicable to classes.
     """
     if not pytypes.typelogging_enabled:
@@ -860,13 +1011,13 @@ def typelogged_class(cls):
     for key in keys:
         memb = cls.__dict__[key]
         if _check_as_func(memb):
-            setattr(cls, key, typelogged_func(memb))
+            setattr(cls, key, typelogged_func(memb, sample))
         elif isclass(memb):
-            typelogged_class(memb)
+            typelogged_class(memb, sample)
     return cls
 
 
-def typelogged_module(md):
+def typelogged_module(md, sample = None):
     """Works like typelogged, but is only applicable to modules by explicit call).
     md must be a module or a module name contained in sys.modules.
     """
@@ -879,12 +1030,14 @@ def typelogged_module(md):
                 return md
         elif md in pytypes.typechecker._pending_modules:
             # if import is pending, we just store this call for later
-            pytypes.typechecker._pending_modules[md].append(typelogged_module)
+            pytypes.typechecker._pending_modules[md].append(
+                    lambda t: typelogged_module(t, sample))
             return md
     assert(ismodule(md))
     if md.__name__ in pytypes.typechecker._pending_modules:
             # if import is pending, we just store this call for later
-            pytypes.typechecker._pending_modules[md.__name__].append(typelogged_module)
+            pytypes.typechecker._pending_modules[md.__name__].append(
+                    lambda t: typelogged_module(t, sample))
             # we already process the module now as far as possible for its internal use
             # todo: Issue warning here that not the whole module might be covered yet
     assert(ismodule(md))
@@ -899,15 +1052,15 @@ def typelogged_module(md):
     for key in keys:
         memb = md.__dict__[key]
         if _check_as_func(memb) and memb.__module__ == md.__name__:
-            setattr(md, key, typelogged_func(memb))
+            setattr(md, key, typelogged_func(memb, sample))
         elif isclass(memb) and memb.__module__ == md.__name__:
-            typelogged_class(memb)
+            typelogged_class(memb, sample)
     if not md.__name__ in pytypes.typechecker._pending_modules:
         _fully_typelogged_modules[md.__name__] = len(md.__dict__)
     return md
 
 
-def typelogged(memb):
+def typelogged(memb = None, sample = None):
     """Decorator applicable to functions, methods, properties,
     classes or modules (by explicit call).
     If applied on a module, memb must be a module or a module name contained in sys.modules.
@@ -915,17 +1068,23 @@ def typelogged(memb):
     Observes function and method calls at runtime and allows pytypes to generate stubfiles
     from the acquired type information.
     Use dump_cache to write a stubfile in this manner.
+    sample lets the typelogger only log a fraction of the calls per function.
+    It can be a LogSamplePolicy, a float as shorthand for a probability or an int
+    to log every sample-th call. Use it as @typelogged(sample=...).
+    See pytypes.typelogging_sample to configure this globally.
     """
+    if memb is None:
+        return lambda memb2: typelogged(memb2, sample)
     if not pytypes.typelogging_enabled:
         return memb
     if _check_as_func(memb):
-        return typelogged_func(memb)
+        return typelogged_func(memb, sample)
     if isclass(memb):
-        return typelogged_class(memb)
+        return typelogged_class(memb, sample)
     if ismodule(memb):
-        return typelogged_module(memb)
+        return typelogged_module(memb, sample)
     if memb in sys.modules or memb in pytypes.typechecker._pending_modules:
-        return typelogged_module(memb)
+        return typelogged_module(memb, sample)
     return memb
 
 
@@ -942,6 +1101,11 @@ def _catch_up_global_typelogged_decorator():
 
 class TypeLogger(TypeAgent):
 
-    def __init__(self, all_threads = True):
-        TypeAgent.__init__(self, all_threads)
+    def __init__(self, all_threads = True, include_modules = None, exclude_modules = None,
+                sample = None):
+        """sample lets this logger only log a fraction of the calls per function,
+        see typelogged. If None, pytypes.typelogging_sample applies.
+        """
+        TypeAgent.__init__(self, all_threads, include_modules, exclude_modules)
         self._logging_enabled = True
+        self._log_sample = _get_log_sample_policy(sample)
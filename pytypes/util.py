@@ -29,20 +29,36 @@ import sys
 import os
 import inspect
 import traceback
+import collections
 from warnings import warn_explicit
 
 
 _code_callable_dict = {}
+# LRU of code objects not found in their module, mapped to the module's size,
+# the object bound to the code's name in the module and the signature cache
+# generation at that time, see pytypes.invalidate_signature_cache.
+_code_callable_misses = collections.OrderedDict()
+_code_callable_misses_size = 256
+_code_callable_misses_unbound = object()
 _sys_excepthook = sys.__excepthook__
+# results of _check_python3_5_version per pytypes.python3_5_executable
+_python3_5_version_checks = {}
 
 
 def _check_python3_5_version():
+    executable = pytypes.python3_5_executable
     try:
-        ver = subprocess.check_output([pytypes.python3_5_executable, '--version'])
+        return _python3_5_version_checks[executable]
+    except KeyError:
+        pass
+    try:
+        ver = subprocess.check_output([executable, '--version'])
         ver = ver[:-1].split(' ')[-1].split('.')
-        return (int(ver[0]) >= 3 and int(ver[1]) >= 5)
+        res = (int(ver[0]) >= 3 and int(ver[1]) >= 5)
     except Exception:
-        return False
+        res = False
+    _python3_5_version_checks[executable] = res
+    return res
 
 
 def _md5(fname):
@@ -158,120 +174,131 @@ def getargskw(args, kw, argspecs):
     Arg values are taken from args, kw and - if needed - from argspecs defaults.
     These values are then ordered according to argspecs and returned as a list.
     """
-    return _getargskw(args, kw, argspecs)[0]
+    return _ArgBinder(argspecs).getargskw(args, kw)[0]
 
 
 def _getargskw(args, kw, argspecs):
-    res = []
-    err = False
-    try:
-        kwds = argspecs.keywords
-    except AttributeError:
-        kwds = argspecs.varkw
-    if not kwds is None:
-        used = set()
-    if len(args) > len(argspecs.args):
-        if not argspecs.varargs is None:
-            # include the remaining args as varargs
-            res.extend(args[:len(argspecs.args)])
-            res.append(args[len(argspecs.args):])
+    return _ArgBinder(argspecs).getargskw(args, kw)
+
+
+def fromargskw(argskw, argspecs, slf_or_clsm = False):
+    """Turns a linearized list of args into (args, keywords) form
+    according to given argspecs (like inspect module provides).
+    """
+    return _ArgBinder(argspecs).fromargskw(argskw, slf_or_clsm)
+
+
+class _ArgBinder(object):
+    """Performs getargskw and fromargskw for a fixed argspecs.
+    Derives positions of defaults, var-args, keyword-only args and var-keywords
+    once, so checkers can create it per function rather than per call.
+    """
+
+    def __init__(self, argspecs):
+        self.args = argspecs.args
+        self.nargs = len(argspecs.args)
+        self.defaults = argspecs.defaults
+        # position of the first arg with default value
+        self.ndefault = self.nargs if argspecs.defaults is None else \
+                self.nargs-len(argspecs.defaults)
+        self.varargs = not argspecs.varargs is None
+        try:
+            self.varkw = not argspecs.keywords is None
+        except AttributeError:
+            self.varkw = not argspecs.varkw is None
+        try:
+            self.kwonlyargs = argspecs.kwonlyargs
+            self.kwonlydefaults = argspecs.kwonlydefaults
+        except AttributeError:
+            self.kwonlyargs = []
+            self.kwonlydefaults = None
+        if self.kwonlydefaults is None:
+            self.kwonlydefaults = {}
+        # True if argskw is just the positional args for each valid call
+        self.plain = not (self.varargs or self.varkw or self.kwonlyargs)
+
+    def getargskw(self, args, kw):
+        """Works like util._getargskw, i.e. returns the tuple of args according to
+        argspecs and whether an error was noticed.
+        """
+        nargs = self.nargs
+        if self.plain and len(args) == nargs and not kw:
+            return tuple(args), False
+        err = False
+        if not self.varkw:
+            used = None
         else:
-            # note an err, but still add all args for tracking
-            err = True
-            res.extend(args)
-    elif len(args) < len(argspecs.args):
-        res.extend(args)
-        # we'll try to get the remaining args from kw or defaults
-        ipos = -len(argspecs.args)+len(res)
-        for name in argspecs.args[len(args):]:
-            if name in kw:
-                res.append(kw[name])
-                if not kwds is None:
-                    used.add(name)
-            elif not argspecs.defaults is None:
-                # Todo: Guard failure here and set err accordingly
-                res.append(argspecs.defaults[ipos])
+            used = set()
+        if len(args) > nargs:
+            if self.varargs:
+                # include the remaining args as varargs
+                res = list(args[:nargs])
+                res.append(tuple(args[nargs:]))
             else:
+                # note an err, but still add all args for tracking
                 err = True
-            ipos += 1
-        if not argspecs.varargs is None:
-            res.append(tuple())
-    else:
-        res.extend(args)
-        if not argspecs.varargs is None:
-            res.append(tuple())
-    try:
+                res = list(args)
+        else:
+            res = list(args)
+            if len(args) < nargs:
+                # we'll try to get the remaining args from kw or defaults
+                for i in range(len(args), nargs):
+                    name = self.args[i]
+                    if name in kw:
+                        res.append(kw[name])
+                        if not used is None:
+                            used.add(name)
+                    elif i >= self.ndefault:
+                        res.append(self.defaults[i-nargs])
+                    else:
+                        err = True
+            if self.varargs:
+                res.append(())
         # eventually process kw-only args
-        ipos = -len(argspecs.kwonlyargs)
-        for name in argspecs.kwonlyargs:
+        for name in self.kwonlyargs:
             if name in kw:
                 res.append(kw[name])
-                if not kwds is None:
+                if not used is None:
                     used.add(name)
+            elif name in self.kwonlydefaults:
+                res.append(self.kwonlydefaults[name])
             else:
-                # Todo: Guard failure here and set err accordingly
-#				This assumed kwonlydefaults to be a list:
-#				if not argspecs.kwonlydefaults is None and \
-#						len(argspecs.kwonlydefaults) > ipos:
-#					res.append(argspecs.kwonlydefaults[ipos])
-                if not argspecs.kwonlydefaults is None and \
-                        name in argspecs.kwonlydefaults:
-                    res.append(argspecs.kwonlydefaults[name])
-                else:
-                    err = True
-            ipos += 1
-    except AttributeError:
-        pass
-    except TypeError:
-        err = True
-    if not kwds is None:
-        if len(used) > 0:
-            kw2 = {}
-            if len(used) < len(kw):
-                for name in kw:
-                    if not name in used:
-                        kw2[name] = kw[name]
-            res.append(kw2)
+                err = True
+        if not used is None:
+            if len(used) > 0:
+                res.append({name: kw[name] for name in kw if not name in used})
+            else:
+                res.append(kw)
+        return tuple(res), err
+
+    def fromargskw(self, argskw, slf_or_clsm = False):
+        """Works like util.fromargskw, i.e. turns a linearized list of args
+        into (args, keywords) form.
+        """
+        if self.plain:
+            return argskw, {}
+        end = len(argskw)
+        if self.varkw:
+            end -= 1
+            res_kw = argskw[end]
         else:
-            res.append(kw)
-    return tuple(res), err
-
-
-def fromargskw(argskw, argspecs, slf_or_clsm = False):
-    """Turns a linearized list of args into (args, keywords) form
-    according to given argspecs (like inspect module provides).
-    """
-    res_args = argskw
-    try:
-        kwds = argspecs.keywords
-    except AttributeError:
-        kwds = argspecs.varkw
-    if not kwds is None:
-        res_kw = argskw[-1]
-        res_args = argskw[:-1]
-    else:
-        res_kw = None
-    if not argspecs.varargs is None:
-        vargs_pos = (len(argspecs.args)-1) \
-                if slf_or_clsm else len(argspecs.args)
-        if vargs_pos > 0:
-            res_lst = list(argskw[:vargs_pos])
-            res_lst.extend(argskw[vargs_pos])
-            res_args = tuple(res_lst)
+            res_kw = {}
+        if len(self.kwonlyargs) > 0:
+            res_kw = dict(res_kw)
+            end -= len(self.kwonlyargs)
+            for i in range(len(self.kwonlyargs)):
+                res_kw[self.kwonlyargs[i]] = argskw[end+i]
+        if self.varargs:
+            vargs_pos = (self.nargs-1) if slf_or_clsm else self.nargs
+            if vargs_pos > 0:
+                res_lst = list(argskw[:vargs_pos])
+                res_lst.extend(argskw[vargs_pos])
+                res_args = tuple(res_lst)
+            else:
+                res_args = argskw[0]
         else:
-            res_args = argskw[0]
-    try:
-        if len(argspecs.kwonlyargs) > 0:
-            res_kw = {} if res_kw is None else dict(res_kw)
-            ipos = -len(argspecs.kwonlyargs) - (0 if kwds is None else 1)
-            for name in argspecs.kwonlyargs:
-                res_kw[name] = argskw[ipos]
-                ipos += 1
-    except AttributeError:
-        pass
-    if res_kw is None:
-        res_kw = {}
-    return res_args, res_kw
+            res_args = argskw[:end]
+        return res_args, res_kw
 
 
 def _unchecked_backend(func):
@@ -520,18 +547,22 @@ def get_current_function(caller_level = 0):
     return _get_current_function_fq(1+caller_level)[0][0]
 
 
-def _get_current_function_fq(caller_level = 0):
-    stck = inspect.stack()
-    code = stck[1+caller_level][0].f_code
+def _get_current_function_fq(caller_level = 0, frame = None):
+    """If frame is given, it is used instead of the frame selected by caller_level.
+    """
+    if frame is None:
+        frame = sys._getframe(1+caller_level)
+    code = frame.f_code
     res = get_callable_fq_for_code(code)
-    if res[0] is None and len(stck) > 2+caller_level:
-        res = get_callable_fq_for_code(code, stck[2+caller_level][0].f_locals)
+    if res[0] is None and not frame.f_back is None:
+        res = get_callable_fq_for_code(code, frame.f_back.f_locals)
     return res, code
 
 
-def get_current_args(caller_level = 0, func = None, argNames = None):
+def get_current_args(caller_level = 0, func = None, argNames = None, frame = None):
     """Determines the args of current function call.
     Use caller_level > 0 to get args of even earlier function calls in current stack.
+    Alternatively, the frame of the function call can be given explicitly.
     """
     if argNames is None:
         argNames = getargnames(getargspecs(func))
@@ -539,14 +570,14 @@ def get_current_args(caller_level = 0, func = None, argNames = None):
         func = get_current_function(caller_level+1)
     if isinstance(func, property):
         func = func.fget if func.fset is None else func.fset
-    stck = inspect.stack()
-    lcs = stck[1+caller_level][0].f_locals
+    if frame is None:
+        frame = sys._getframe(1+caller_level)
+    lcs = frame.f_locals
     return tuple([lcs[t] for t in argNames])
 
 
 def get_current_module(caller_level = 0):
-    stck = inspect.stack()
-    return getmodule(stck[1+caller_level][0].f_code)
+    return getmodule(sys._getframe(1+caller_level).f_code)
 
 
 def getmodule(code):
@@ -594,10 +625,36 @@ def get_callable_fq_for_code(code, locals_dict = None):
     md = getmodule(code)
     if not md is None:
         nesting = []
-        res, slf = _get_callable_fq_for_code(code, md, md, False, nesting, set())
+        # A rebinding leaves the module's size unchanged, so we also compare
+        # what is bound to the code's name, i.e. the most likely candidate.
+        # Other changes, e.g. setattr of a method on an existing class, are only
+        # noticed after invalidate_signature_cache.
+        miss_key = (len(md.__dict__),
+                md.__dict__.get(code.co_name, _code_callable_misses_unbound),
+                pytypes.type_util._funcsig_cache_generation)
+        try:
+            # LRU: move the entry to the end
+            miss = _code_callable_misses.pop(code)
+            _code_callable_misses[code] = miss
+        except KeyError:
+            miss = None
+        if not miss is None and miss[0] == miss_key[0] and miss[1] is miss_key[1] \
+                and miss[2] == miss_key[2]:
+            # Module was already searched in vain and did not change since.
+            res = None
+        else:
+            res, slf = _get_callable_fq_for_code(code, md, md, False, nesting, set())
+            if res is None:
+                _code_callable_misses[code] = miss_key
+                if len(_code_callable_misses) > _code_callable_misses_size:
+                    _code_callable_misses.popitem(False)
+            else:
+                _code_callable_misses.pop(code, None)
         if res is None and not locals_dict is None:
             nesting = []
             res, slf = _get_callable_from_locals(code, locals_dict, md, False, nesting)
+        elif res is None:
+            return None, nesting, False
         else:
             _code_callable_dict[code] = (res, nesting, slf)
         return res, nesting, slf
@@ -706,12 +763,121 @@ def get_function_perspective_globals(module_name, level=0, max_level=None):
         else:
             globs.update(sys.modules[module_name].__dict__)
     if level != max_level:
-        stck = inspect.stack()
-        for ln in stck[level:max_level]:
-            globs.update(ln[0].f_locals)
+        # Like iterating over inspect.stack()[level:max_level], which is much slower
+        frames = []
+        frame = sys._getframe()
+        while not frame is None:
+            frames.append(frame)
+            frame = frame.f_back
+        for frame in frames[level:max_level]:
+            globs.update(frame.f_locals)
     return globs
 
 
+class _ScopeView(object):
+    """Read-only mapping over the namespaces visible from a function's perspective,
+    see get_function_perspective_view. Nothing is copied; the calling frames are
+    only walked if a name is found neither in the closure nor in the module.
+    used_frame_locals tells whether a name was resolved via a frame's locals,
+    i.e. whether the results depend on the calling context.
+    """
+    def __init__(self, maps, glbls, frame=None, frame_count=None):
+        self.maps = maps
+        self.globals = glbls
+        self.used_frame_locals = False
+        self._frame_maps = []
+        self._frame = frame
+        self._frame_count = frame_count
+
+    def _next_frame_locals(self):
+        if self._frame is None or self._frame_count == 0:
+            return None
+        lcs = self._frame.f_locals
+        self._frame = self._frame.f_back
+        if not self._frame_count is None:
+            self._frame_count -= 1
+        self._frame_maps.append(lcs)
+        return lcs
+
+    def __getitem__(self, key):
+        for mp in self.maps:
+            if key in mp:
+                return mp[key]
+        for lcs in self._frame_maps:
+            if key in lcs:
+                self.used_frame_locals = True
+                return lcs[key]
+        lcs = self._next_frame_locals()
+        while not lcs is None:
+            if key in lcs:
+                self.used_frame_locals = True
+                return lcs[key]
+            lcs = self._next_frame_locals()
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def get_function_perspective_view(module_name, func=None, level=0, max_level=None):
+    """Like get_function_perspective_globals, but returns a lazy mapping instead
+    of a merged dict. Names are looked up in the closure of func, then in the
+    module named module_name, then in the locals of the stack frames
+    level to max_level (innermost first), counted like in
+    get_function_perspective_globals.
+    For a stub module (.pyi, .pyi2) the original module is searched before the
+    stub, like in get_function_perspective_globals.
+    Note that the order differs from get_function_perspective_globals otherwise:
+    There, frame locals take precedence over module globals and outer frames
+    over inner ones. Here the module wins and the innermost frame that defines
+    a name wins, so that frames need only be walked if the module misses a name.
+    Use view.globals and the view itself as globals and locals for eval.
+    """
+    maps = []
+    closure = getattr(func, '__closure__', None)
+    if closure:
+        cells = {}
+        for name, cell in zip(func.__code__.co_freevars, closure):
+            try:
+                cells[name] = cell.cell_contents
+            except ValueError:
+                # empty cell, i.e. name not yet bound in enclosing scope
+                pass
+        maps.append(cells)
+    glbls = None
+    if not module_name is None:
+        glbls = sys.modules[module_name].__dict__
+        if module_name.endswith('.pyi') or module_name.endswith('.pyi2'):
+            try:
+                # See get_function_perspective_globals
+                maps.append(sys.modules[module_name.rsplit('.', 1)[0]].__dict__)
+            except KeyError:
+                pass
+        maps.append(glbls)
+    if glbls is None:
+        glbls = {}
+    frame = None
+    frame_count = None
+    if level != max_level:
+        try:
+            frame = sys._getframe(level)
+        except ValueError:
+            pass
+        if not max_level is None:
+            frame_count = max_level - level
+    return _ScopeView(maps, glbls, frame, frame_count)
+
+
 def _mro(clss, dest = []):
     if not clss in dest:
         dest.append(clss)
@@ -15,13 +15,19 @@
 # Created on 25.08.2016
 
 import abc
+import ast
+import array
+import gc
+import os
 import sys
+import tempfile
 import unittest
 import warnings
 import collections
 from abc import abstractmethod
 from numbers import Real
 import pytypes
+from pytypes import typecomment_parser
 from pytypes import typechecked, override, auto_override, no_type_check, get_types, \
     get_type_hints, TypeCheckError, InputTypeError, ReturnTypeError, OverrideError, \
     TypeSyntaxError, check_argument_types, annotations, get_member_types, resolve_fw_decl, \
@@ -547,6 +553,11 @@ def testfunc_Callable_arg(a, b):
     # type: (Callable[[str, int], str], str) -> str
     return a(b, len(b))
 
+@typechecked
+def testfunc_pass_through(x, y):
+    # type: (Tuple[int, str], List[int]) -> Tuple[int, str]
+    return x
+
 @typechecked
 def testfunc_Callable_call_err(a, b):
     # type: (Callable[[str, int], str], str) -> str
@@ -628,6 +639,82 @@ def testfunc_numeric_tower_complex(x):
     # type: (complex) -> str
     return str(x)
 
+@typechecked(sample=pytypes.SamplePolicy(3, 'first'))
+def testfunc_sample_first(x, idx):
+    # type: (List[int], int) -> List[int]
+    return x[idx:]
+
+@typechecked(sample=4)
+def testfunc_sample_random(x):
+    # type: (Dict[str, Set[int]]) -> int
+    return len(x)
+
+# seeded, so that test_sample_error_message is deterministic
+@typechecked(sample=pytypes.SamplePolicy(3, seed=5))
+def testfunc_sample_msg(x, clb):
+    # type: (List[int], Callable[[int], int]) -> int
+    return clb(len(x))
+
+@typechecked(sample=pytypes.SamplePolicy(3, seed=5))
+def testfunc_sample_msg_plain(x):
+    # type: (List[int]) -> int
+    return len(x)
+
+@typechecked
+def testfunc_check_sample(x):
+    # type: (Sequence[List[float]]) -> int
+    return len(x)
+
+@typechecked(budget=pytypes.Budget(max_depth=2))
+def testfunc_budget_depth(x):
+    # type: (List[Dict[str, List[int]]]) -> Dict[str, List[int]]
+    return x[0]
+
+@typechecked(budget=pytypes.Budget(max_elements=10, exceeded='warn'))
+def testfunc_budget_warn(x, y):
+    # type: (List[int], Tuple[str, float]) -> int
+    return len(x)
+
+@typechecked(budget=pytypes.Budget(max_elements=10, exceeded='fail'))
+def testfunc_budget_fail(x):
+    # type: (List[int]) -> List[int]
+    return x+x
+
+@typechecked(budget=pytypes.Budget(max_elements=5))
+def testfunc_budget_shared(x, y, clb):
+    # type: (List[int], List[int], Callable[[int], int]) -> int
+    return clb(len(x)+len(y))
+
+@typechecked(budget=pytypes.Budget(max_depth=1, max_elements=5))
+def testfunc_budget_reduce(x):
+    # type: (Sequence[Union[int, List[int], Tuple[int, List[int]]]]) -> int
+    return len(x)
+
+@typechecked(budget=pytypes.Budget(max_depth=1, max_elements=5))
+def testfunc_budget_reduce_dict(x):
+    # type: (Dict[str, Union[int, Dict[str, int]]]) -> int
+    return len(x)
+
+@typechecked(budget=pytypes.Budget(max_elements=100))
+def testfunc_budget_reduce_cyclic(x):
+    # type: (Sequence[Any]) -> int
+    return len(x)
+
+@pytypes.typelogged(sample=3)
+def testfunc_log_sample_every(x):
+    return str(x)
+
+@pytypes.typelogged(sample=pytypes.LogSamplePolicy('adaptive', 2))
+def testfunc_log_sample_adaptive(x):
+    return x
+
+@pytypes.typelogged
+def testfunc_log_sample_global(x):
+    return x
+
+def testfunc_log_sample_agent(x):
+    return x
+
 @typechecked
 def testfunc_numeric_tower_tuple(x):
     # type: (Tuple[float, str]) -> str
@@ -2596,6 +2683,196 @@ class TestTypecheck(unittest.TestCase):
 
         pytypes.always_check_parent_types = always_check_parent_types_tmp
 
+    def test_signature_cache(self):
+        self.assertEqual(testfunc(3, 2.5, 'abcd'), (9, 7.5))
+        self.assertEqual(len(testfunc._sig_cache), 1)
+        sig = list(testfunc._sig_cache.values())[0]
+        # No Callable, Iterable or Generator, so args and result are passed unchanged
+        self.assertEqual(sig, (Tuple[int, Real, str], Tuple[int, Real], False, False))
+        self.assertEqual(testfunc(7, b=12.5, c='cdef'), (49, 87.5))
+        self.assertEqual(len(testfunc._sig_cache), 1)
+        self.assertRaises(InputTypeError, lambda: testfunc('string', 2.5, 'abcd'))
+
+        pytypes.invalidate_signature_cache()
+        self.assertEqual(testfunc(3, 2.5, 'abcd'), (9, 7.5))
+        self.assertEqual(len(testfunc._sig_cache), 1)
+        self.assertIsNot(list(testfunc._sig_cache.values())[0], sig)
+
+    def test_signature_cache_size(self):
+        class sig_cache_base(object):
+            @typechecked
+            def meth(self, a):
+                # type: (int) -> int
+                return a*2
+        size = pytypes.typechecker._sig_cache_size
+        subclasses = [type('sig_cache_sub%d' % i, (sig_cache_base,), {})
+                for i in range(size+10)]
+        for cls in subclasses:
+            self.assertEqual(cls().meth(3), 6)
+        sig_cache = sig_cache_base.__dict__['meth']._sig_cache
+        self.assertEqual(len(sig_cache), size)
+        # the least recently used entries were dropped
+        self.assertFalse(any(key[1] is subclasses[0] for key in sig_cache))
+        self.assertTrue(any(key[1] is subclasses[-1] for key in sig_cache))
+        self.assertRaises(InputTypeError, lambda: subclasses[0]().meth('a'))
+
+    def test_pass_through(self):
+        x = (3, 'abc')
+        self.assertIs(testfunc_pass_through(x, [1, 2]), x)
+        self.assertRaises(InputTypeError, lambda: testfunc_pass_through((3, 4), [1, 2]))
+        clb = lambda s, i: s+str(i)
+        self.assertEqual(testfunc_Callable_arg(clb, 'pqrs'), 'pqrs4')
+        sig = list(testfunc_Callable_arg._sig_cache.values())[0]
+        self.assertEqual(sig[2:], (True, False))
+        self.assertEqual(list(testfunc_Callable_ret._sig_cache.values())[0][2:],
+                (False, True))
+
+    def test_sample(self):
+        lst = list(range(100))
+        self.assertEqual(testfunc_sample_first(lst, 99), [99])
+        lst[50] = 'a'
+        # only the first 3 elements are checked
+        self.assertEqual(testfunc_sample_first(lst, 99), [99])
+        self.assertRaises(ReturnTypeError, lambda: testfunc_sample_first(lst, 50))
+        lst[1] = 'a'
+        self.assertRaises(InputTypeError, lambda: testfunc_sample_first(lst, 99))
+        self.assertRaises(InputTypeError, lambda: testfunc_sample_first(lst[:3], 99))
+
+        dct = {str(i): {i, i+1, i+2} for i in range(100)}
+        self.assertEqual(testfunc_sample_random(dct), 100)
+        dct['x'] = {0, 1, 'a', 3}
+        self.assertRaises(InputTypeError, lambda: testfunc_sample_random({'x': dct['x']}))
+
+    def test_sample_error_message(self):
+        # every other element in the middle is invalid
+        lst = [i if i % 2 == 0 else 'a' for i in range(100)]
+        lst[-1] = 99
+        for func in (lambda: testfunc_sample_msg(lst, lambda n: n),
+                lambda: testfunc_sample_msg_plain(lst)):
+            failures = 0
+            for i in range(20):
+                try:
+                    func()
+                except InputTypeError as e:
+                    failures += 1
+                    # The message describes the sample that failed the check
+                    self.assertIn('List[Union[int, str]]', str(e))
+            # Both outcomes occur with the seeded samples
+            self.assertGreater(failures, 0)
+            self.assertLess(failures, 20)
+
+    def test_sample_global(self):
+        sample_tmp = pytypes.check_sample
+        data = [[1.5, 2.5, 3.5, 'a'] for i in range(10)]
+        self.assertRaises(InputTypeError, lambda: testfunc_check_sample(data))
+        pytypes.check_sample = pytypes.SamplePolicy(3, 'first')
+        try:
+            self.assertEqual(testfunc_check_sample(data), 10)
+            data.append(['a'])
+            self.assertEqual(testfunc_check_sample(data), 11)
+            data.insert(0, ['a'])
+            self.assertRaises(InputTypeError, lambda: testfunc_check_sample(data))
+        finally:
+            pytypes.check_sample = sample_tmp
+
+    def test_sample_policy(self):
+        for mode in pytypes.SamplePolicy.modes:
+            smpl = pytypes.SamplePolicy(5, mode, 42)
+            self.assertIsNone(smpl.indices(5))
+            for length in (6, 7, 100, 10000):
+                indices = list(smpl.indices(length))
+                self.assertEqual(len(indices), 5)
+                self.assertEqual(indices, sorted(set(indices)))
+                self.assertEqual(indices[0], 0)
+                if mode == 'first':
+                    self.assertEqual(indices[-1], 4)
+                else:
+                    self.assertEqual(indices[-1], length-1)
+        self.assertRaises(ValueError, lambda: pytypes.SamplePolicy(5, 'last'))
+        self.assertRaises(ValueError, lambda: pytypes.SamplePolicy(0))
+
+        smpl = pytypes.SamplePolicy(3, 'strided')
+        val = [1, 2, (3, 4)]
+        self.assertIs(smpl.sample(val), val)
+        val = {'a': list(range(10)), 'b': [1, 2]}
+        val2 = smpl.sample(val)
+        self.assertEqual(val2, {'a': [0, 4, 9], 'b': [1, 2]})
+        self.assertIs(val2['b'], val['b'])
+        self.assertEqual(smpl.sample(val, 1), val)
+        self.assertEqual(len(smpl.sample(set(range(1000)))), 3)
+        self.assertEqual(len(smpl.sample({i: i for i in range(1000)})), 3)
+        self.assertEqual(smpl.sample((list(range(5)), 'a')), ([0, 2, 4], 'a'))
+
+    def test_budget(self):
+        data = [{'a': [1, 2], 'b': [3]}, {'c': ['x']}]
+        self.assertEqual(testfunc_budget_depth(data), data[0])
+        data.append({1: []})
+        self.assertRaises(InputTypeError, lambda: testfunc_budget_depth(data))
+        self.assertRaises(InputTypeError, lambda: testfunc_budget_depth([['a']]))
+        # The budget applies to the result separately, which is checked down to list elements
+        self.assertRaises(ReturnTypeError, lambda: testfunc_budget_depth([{'c': ['x']}]))
+
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            self.assertEqual(testfunc_budget_warn(list(range(8)), ('a', 1.5)), 8)
+            self.assertEqual(len(w), 0)
+            lst = list(range(20))
+            lst[15] = 'a'
+            self.assertEqual(testfunc_budget_warn(lst, ('a', 1.5)), 20)
+            self.assertEqual(len(w), 1)
+            self.assertTrue(issubclass(w[0].category, pytypes.TypeWarning))
+            self.assertTrue('exceeding check budget' in str(w[0].message))
+            lst[5] = 'a'
+            self.assertRaises(InputTypeError, lambda: testfunc_budget_warn(lst, ('a', 1.5)))
+            self.assertRaises(InputTypeError, lambda: testfunc_budget_warn(lst[:5], ('a', 'b')))
+
+        self.assertEqual(testfunc_budget_fail([1, 2, 3]), [1, 2, 3, 1, 2, 3])
+        self.assertRaises(InputTypeError, lambda: testfunc_budget_fail(list(range(11))))
+        self.assertRaises(ReturnTypeError, lambda: testfunc_budget_fail(list(range(6))))
+
+        # All arguments share max_elements, also if checked one by one
+        # because of the Callable
+        self.assertEqual(testfunc_budget_shared([1, 2, 3], [4, 5, 'x'], lambda n: n), 6)
+        self.assertRaises(InputTypeError,
+                lambda: testfunc_budget_shared([1, 2, 3], [4, 'x', 6], lambda n: n))
+
+    def test_budget_global(self):
+        budget_tmp = pytypes.check_budget
+        data = [[1.5, 2.5], [3.5, ['a']]]
+        self.assertRaises(InputTypeError, lambda: testfunc_check_sample(data))
+        pytypes.check_budget = pytypes.Budget(max_depth=1)
+        try:
+            self.assertEqual(testfunc_check_sample(data), 2)
+            self.assertRaises(InputTypeError, lambda: testfunc_check_sample([1.5]))
+        finally:
+            pytypes.check_budget = budget_tmp
+
+    def test_budget_reduce(self):
+        bdgt = pytypes.Budget(max_depth=1, max_elements=5)
+        self.assertFalse(bdgt.exceeded_by([1, 2, (3, 4)]))
+        self.assertEqual(testfunc_budget_reduce([1, 2, (3, [4])]), 3)
+        self.assertRaises(InputTypeError, lambda: testfunc_budget_reduce([1, 'a']))
+        # Containers beyond max_depth are checked as if they were empty
+        val = [1, ['a'], (3, ['b'])]
+        self.assertTrue(bdgt.exceeded_by(val))
+        self.assertEqual(testfunc_budget_reduce(val), 3)
+        self.assertEqual(testfunc_budget_reduce_dict({'a': 1, 'c': {'d': 'x'}}), 2)
+        self.assertRaises(InputTypeError, lambda: testfunc_budget_reduce_dict({'a': 'x'}))
+        # Elements beyond max_elements are not checked
+        self.assertTrue(bdgt.exceeded_by(list(range(6))))
+        self.assertEqual(testfunc_budget_reduce(list(range(5))+['a']), 6)
+        self.assertRaises(InputTypeError,
+                lambda: testfunc_budget_reduce(list(range(4))+['a']))
+        # Tuples are always checked completely
+        self.assertRaises(InputTypeError, lambda: testfunc_budget_reduce([(3, 'x')]))
+        cyclic = [1]
+        cyclic.append(cyclic)
+        self.assertTrue(pytypes.Budget(max_elements=100).exceeded_by(cyclic))
+        self.assertEqual(testfunc_budget_reduce_cyclic(cyclic), 2)
+        self.assertFalse(pytypes.Budget().exceeded_by(cyclic))
+        self.assertRaises(ValueError, lambda: pytypes.Budget(exceeded='raise'))
+        self.assertRaises(ValueError, lambda: pytypes.Budget(max_depth=-1))
+
 
 class TestTypecheck_class(unittest.TestCase):
     def test_classmethod(self):
@@ -2787,6 +3064,40 @@ class TestOverride(unittest.TestCase):
         self.assertRaises(OverrideError, lambda:
                 D_diamond_override_err3().meth1((12, 17)))
 
+    def test_override_runtime_cache(self):
+        class ov_cache_base(object):
+            def meth(self, a):
+                # type: (int) -> int
+                return a
+        class ov_cache_base_err(object):
+            def meth(self, a, b):
+                # type: (int, int) -> int
+                return a
+        class ov_cache_sub(ov_cache_base):
+            @override
+            def meth(self, a):
+                # type: (int) -> int
+                return a+1
+        ov_cache = ov_cache_sub.__dict__['meth']._ov_cache
+        self.assertEqual(ov_cache_sub().meth(1), 2)
+        self.assertTrue(ov_cache_sub in ov_cache)
+        self.assertEqual(ov_cache_sub().meth(2), 3)
+        # Changing the class hierarchy invalidates the cached result
+        ov_cache_sub.__bases__ = (ov_cache_base_err,)
+        self.assertRaises(OverrideError, lambda: ov_cache_sub().meth(3))
+        ov_cache_sub.__bases__ = (ov_cache_base,)
+        self.assertEqual(ov_cache_sub().meth(4), 5)
+        # Classes are only referenced weakly
+        def call_temporary_class():
+            class ov_cache_sub2(ov_cache_sub):
+                pass
+            res = ov_cache_sub2().meth(5)
+            self.assertEqual(len(ov_cache), 2)
+            return res
+        self.assertEqual(call_temporary_class(), 6)
+        gc.collect()
+        self.assertEqual(len(ov_cache), 1)
+
     def test_auto_override(self):
         self.assertEqual(B_auto_override().meth_1('abc', (4, 2)), 1)
         obj = B_auto_override_err()
@@ -2805,6 +3116,117 @@ class TestOverride(unittest.TestCase):
         self.assertRaises(OverrideError, lambda: testClass2_defTimeCheck_init_ov())
         pytypes.check_override_at_class_definition_time = tmp
     
+    def test_override_at_definition_time_mro(self):
+        # Base classes are taken from the actual mro, not from the source line.
+        # This requires the class to be built via pytypes' __build_class__ hook.
+        tmp = pytypes.check_override_at_class_definition_time
+        pytypes.check_override_at_class_definition_time = True
+        install_hook = pytypes.typechecker._install_build_class_hook
+        try:
+            bases = [testClass2Base]
+            install_hook()
+            class testClass2_defTime_mro(bases[0]):
+                @override
+                def testmeth(self, a, b):
+                    # type: (int, Real) -> str
+                    return '-'.join((str(a), str(b), self))
+
+                @override
+                def testmeth4(self, a, b):
+                    return '-'.join((str(a), str(b), self))
+            self.assertEqual(testClass2_defTime_mro('uvwx').testmeth4(1, 2.5), '1-2.5-uvwx')
+            def _test_err():
+                install_hook()
+                class testClass2_defTime_mro_err(bases[0]):
+                    @override
+                    def testmeth2(self, a, b):
+                        # type: (str, Real) -> Union[str, int]
+                        return '-'.join((str(a), str(b), self))
+            self.assertRaises(OverrideError, _test_err)
+            def _test_err2():
+                install_hook()
+                class testClass2_defTime_mro_err2(bases[0]):
+                    @override
+                    def testmeth_nonexistent(self, a, b):
+                        pass
+            self.assertRaises(OverrideError, _test_err2)
+        finally:
+            pytypes.check_override_at_class_definition_time = tmp
+
+    @unittest.skipUnless(sys.version_info.major >= 3,
+            'Only applicable if classes are built via __build_class__.')
+    def test_override_at_definition_time_threads(self):
+        import threading
+        tmp = pytypes.check_override_at_class_definition_time
+        pytypes.check_override_at_class_definition_time = True
+        pytypes.typechecker._install_build_class_hook()
+        barrier = threading.Barrier(2, timeout=10)
+        results = {}
+        pending = {}
+        def define_class(base):
+            try:
+                class testClass_defTime_thread(base):
+                    # Both class bodies are on their threads' stacks now.
+                    barrier.wait()
+                    pending[base] = pytypes.typechecker._get_pending_override_checks()
+                    barrier.wait()
+                    @override
+                    def testmeth(self, a, b):
+                        # type: (int, Real) -> str
+                        return '-'.join((str(a), str(b), self))
+                results[base] = 'ok'
+            except OverrideError:
+                results[base] = 'error'
+        try:
+            threads = [threading.Thread(target=define_class, args=(base,))
+                    for base in (testClass2Base, object)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            pytypes.check_override_at_class_definition_time = tmp
+        self.assertIsNot(pending[testClass2Base], pending[object])
+        # object has no testmeth to override
+        self.assertEqual(results, {testClass2Base: 'ok', object: 'error'})
+
+    @unittest.skipUnless(sys.version_info.major >= 3,
+            'Only applicable if classes are built via __build_class__.')
+    def test_override_at_definition_time_build_class_hook(self):
+        import builtins
+        tmp = pytypes.check_override_at_class_definition_time
+        pytypes.check_override_at_class_definition_time = True
+        # Lets a hook installed by earlier tests remove itself.
+        class testClass_hook_flush(object):
+            pass
+        python_build_class = builtins.__build_class__
+        self.assertIsNot(python_build_class, pytypes.typechecker._pytypes___build_class__)
+        built = []
+        def custom_build_class(func, name, *bases, **kw):
+            built.append(name)
+            return python_build_class(func, name, *bases, **kw)
+        builtins.__build_class__ = custom_build_class
+        try:
+            # override installs the hook like this, i.e. on top of custom_build_class
+            pytypes.typechecker._install_build_class_hook()
+            self.assertIs(builtins.__build_class__,
+                    pytypes.typechecker._pytypes___build_class__)
+            def _test_err():
+                class testClass_hook_err(testClass2Base):
+                    self.assertEqual(len(pytypes.typechecker._get_class_body_stack()), 1)
+                    @override
+                    def testmeth(self, a, b):
+                        # type: (str, Real) -> str
+                        return '-'.join((str(a), str(b), self))
+            self.assertRaises(OverrideError, _test_err)
+            # Restored to the value current at install time once the stack is empty
+            self.assertIs(builtins.__build_class__, custom_build_class)
+            self.assertEqual(built, ['testClass_hook_err'])
+            self.assertEqual(len(pytypes.typechecker._get_class_body_stack()), 0)
+        finally:
+            builtins.__build_class__ = python_build_class
+            pytypes.check_override_at_class_definition_time = tmp
+
     def test_override_at_definition_time_with_forward_decl(self):
         # This can only be sufficiently tested at import-time, so
         # we import helper-modules during this test.
@@ -3921,6 +4343,134 @@ class TestStubfile(unittest.TestCase):
         self.assertRaises(OverrideError, lambda:
                 stub_py3.D_diamond_override_err3().meth1((12, 17)))
 
+    def test_stub_resolution_cache(self):
+        from testhelpers import stub_testhelper_py2 as stub_py2
+        from testhelpers import override_testhelper as no_stub
+        sfm = pytypes.stubfile_manager
+        stub_path_tmp = pytypes.stub_path
+        stub_gen_dir_tmp = pytypes.stub_gen_dir
+        stub_resolution_cache_tmp = pytypes.stub_resolution_cache
+        find_stub_files_tmp = sfm._find_stub_files
+        cache_tmp = sfm._stub_resolution_cache
+        pytypes.stub_gen_dir = tempfile.mkdtemp()
+        pytypes.stub_resolution_cache = True
+        def find_stubs(module):
+            mdfile = module.__file__
+            return sfm._find_stub_files_cached(module.__name__, mdfile,
+                    mdfile.rpartition('.')[0]+'.pyi', sfm._plain_stub2_filename(mdfile))
+        try:
+            sfm._stub_resolution_cache = (None, None)
+            stub_files = find_stubs(stub_py2)
+            self.assertEqual(len(stub_files[0]), 1)
+            self.assertTrue(stub_files[0][0].endswith('stub_testhelper_py2.pyi'))
+            self.assertEqual(find_stubs(no_stub), ([], []))
+            cache_file = sfm._stub_resolution_cache[0]
+            self.assertFalse(os.path.isfile(cache_file))
+            sfm._save_stub_resolution_cache(cache_file, sfm._stub_resolution_cache[1])
+            self.assertTrue(os.path.isfile(cache_file))
+
+            # Simulate a new process; the file system must not be probed again.
+            sfm._stub_resolution_cache = (None, None)
+            def fail(module_name):
+                raise AssertionError(module_name)
+            sfm._find_stub_files = fail
+            self.assertEqual(find_stubs(stub_py2), stub_files)
+            self.assertEqual(find_stubs(no_stub), ([], []))
+            # Changing stub_path invalidates entries.
+            pytypes.stub_path = [pytypes.stub_gen_dir]
+            self.assertRaises(AssertionError, lambda: find_stubs(no_stub))
+        finally:
+            pytypes.stub_path = stub_path_tmp
+            sfm._find_stub_files = find_stub_files_tmp
+            sfm._stub_resolution_cache = cache_tmp
+            pytypes.stub_resolution_cache = stub_resolution_cache_tmp
+            pytypes.stub_gen_dir = stub_gen_dir_tmp
+
+
+    @unittest.skipUnless(sys.version_info.major >= 3 and sys.version_info.minor >= 5,
+            'Only applicable in Python >= 3.5.')
+    def test_stub_relative_import_3_5(self):
+        # pytypes' own typechecker.pyi imports from .type_util
+        stub_module = pytypes.stubfile_manager.get_stub_module(
+                pytypes.typechecker.TypeChecker.__init__)
+        self.assertIsNotNone(stub_module)
+        self.assertEqual(stub_module.__package__, 'pytypes')
+        self.assertIs(stub_module.TypeAgent, pytypes.TypeAgent)
+
+    @unittest.skipUnless(sys.version_info.major >= 3 and sys.version_info.minor >= 5,
+            'Only applicable in Python >= 3.5.')
+    def test_compiled_3_5_stub(self):
+        sfm = pytypes.stubfile_manager
+        tmp_dir = tempfile.mkdtemp()
+        module_name = 'pytypes_compiled_stub_testhelper'
+        module_file = os.path.join(tmp_dir, module_name+'.py')
+        stub_file = os.path.join(tmp_dir, module_name+'.pyi')
+        with open(module_file, 'w') as f:
+            f.write('def add(a, b):\n    return a+b\n')
+            f.write('class Box(object):\n    class Inner(object):\n        pass\n')
+            f.write('def unbox(b):\n    return Box()\n')
+        with open(stub_file, 'w') as f:
+            f.write('def add(a: int, b: float) -> float: ...\n')
+            f.write('class Box:\n    class Inner: ...\n')
+            f.write('def unbox(b: Box.Inner) -> Box: ...\n')
+        self.assertIsNone(sfm._load_compiled_stub(stub_file))
+        self.assertEqual(sfm.compile_stub(stub_file), stub_file+'.pytypesc')
+        self.assertIsNotNone(sfm._load_compiled_stub(stub_file))
+        sys.path.insert(0, tmp_dir)
+        try:
+            import pytypes_compiled_stub_testhelper as stub_helper
+            stub_module = sfm.get_stub_module(stub_helper.add)
+            # loaded from bytecode, but set up like a module loaded from source
+            self.assertEqual(stub_module.__cached__, stub_file+'.pytypesc')
+            self.assertEqual(stub_module.__spec__.origin, stub_file)
+            self.assertIs(stub_module.__loader__, stub_module.__spec__.loader)
+            self.assertEqual(stub_module.__package__, '')
+            self.assertEqual(stub_module.__file__, stub_file)
+            self.assertEqual(get_types(stub_helper.add), (Tuple[int, float], float))
+
+            # Class matches are stored in the compiled stub at exit ...
+            self.assertIsNone(sfm._load_compiled_stub(stub_file)[3])
+            sfm._save_compiled_stub_matches()
+            matches = sfm._load_compiled_stub(stub_file)[3]
+            self.assertEqual(matches[3], ((('Box',), ('Box',)),
+                    (('Box', 'Inner'), ('Box', 'Inner'))))
+            # ... and used by the next load instead of walking the modules.
+            match_classes = sfm._match_classes
+            sfm._match_classes = None
+            try:
+                stub_module = sfm._get_stub_module(stub_file, stub_helper)
+            finally:
+                sfm._match_classes = match_classes
+            self.assertIs(stub_module.Box.Inner._match_type, stub_helper.Box.Inner)
+            self.assertEqual(sfm._match_stub_type(Tuple[stub_module.Box.Inner]),
+                    Tuple[stub_helper.Box.Inner])
+            self.assertEqual(len(sfm._compiled_stub_matches_pending), 0)
+        finally:
+            sys.path.remove(tmp_dir)
+            sys.modules.pop(module_name, None)
+        # A changed stubfile invalidates the compiled one.
+        with open(stub_file, 'a') as f:
+            f.write('def sub(a: int, b: int) -> int: ...\n')
+        self.assertIsNone(sfm._load_compiled_stub(stub_file))
+
+        # The stub's coding declaration applies, not the locale's encoding.
+        with open(stub_file, 'wb') as f:
+            f.write(b'# -*- coding: latin-1 -*-\nname = "\xe9"\n')
+        sfm.compile_stub(stub_file)
+        code = sfm._load_compiled_stub(stub_file)[2]
+        stub_module = sfm._exec_stub(module_name+'.pyi', stub_file, code, stub_helper)
+        self.assertEqual(stub_module.name, u'\xe9')
+
+        # A failing stub does not remove a module that was present before.
+        code = compile('raise ImportError()', stub_file, 'exec')
+        self.assertRaises(ImportError, lambda: sfm._exec_stub(module_name+'.pyi',
+                stub_file, code, stub_helper))
+        self.assertIs(sys.modules[module_name+'.pyi'], stub_module)
+        del sys.modules[module_name+'.pyi']
+        self.assertRaises(ImportError, lambda: sfm._exec_stub(module_name+'.pyi',
+                stub_file, code, stub_helper))
+        self.assertNotIn(module_name+'.pyi', sys.modules)
+
 
 @unittest.skipUnless(sys.version_info.major >= 3 and sys.version_info.minor >= 5,
         'Only applicable in Python >= 3.5.')
@@ -3943,6 +4493,14 @@ class TestTypecheck_Python3_5(unittest.TestCase):
         self.assertRaises(InputTypeError, lambda: py3.testfunc_None_arg(4, 'vvv'))
         self.assertRaises(ReturnTypeError, lambda: py3.testfunc_None_ret_err(2, 3.0))
 
+    def test_function_kwonly_py3(self):
+        self.assertEqual(py3.testfunc_kwonly(3, b=2.5), '3-2.5-x')
+        self.assertEqual(py3.testfunc_kwonly(3, c='y', b=1.5), '3-1.5-y')
+        self.assertRaises(InputTypeError, lambda: py3.testfunc_kwonly(3, b='2.5'))
+        self.assertRaises(InputTypeError, lambda: py3.testfunc_kwonly(3, b=2.5, c=4))
+        self.assertEqual(py3.testfunc_kwonly_varkw(3, b=2.5, x=1, y=2), 5)
+        self.assertRaises(InputTypeError, lambda: py3.testfunc_kwonly_varkw(3, b=2.5, x='1'))
+
     def test_classmethod_py3(self):
         tc = py3.testClass('efgh')
         self.assertEqual(tc.testmeth_class(23, 1.1),
@@ -4800,10 +5358,274 @@ class Test_utils(unittest.TestCase):
         # No exception.
         resolve_fw_decl(Foo)
 
+    def test_callable_fq_for_code_rebinding(self):
+        def pytypes_rebind_helper():
+            pass
+        code = pytypes_rebind_helper.__code__
+        glbls = globals()
+        glbls['pytypes_rebind_helper'] = None
+        try:
+            self.assertIsNone(pytypes.util.get_callable_fq_for_code(code)[0])
+            # Same module size, but the name is bound to the function now.
+            glbls['pytypes_rebind_helper'] = pytypes_rebind_helper
+            self.assertIs(pytypes.util.get_callable_fq_for_code(code)[0],
+                    pytypes_rebind_helper)
+        finally:
+            del glbls['pytypes_rebind_helper']
+            pytypes.util._code_callable_dict.pop(code, None)
+
+        codes = []
+        for i in range(pytypes.util._code_callable_misses_size+10):
+            # distinct names, as code objects of equal content compare equal
+            name = 'pytypes_miss_helper%d' % i
+            exec(compile('def %s():\n    pass' % name,
+                    code.co_filename, 'exec'), glbls)
+            codes.append(glbls.pop(name).__code__)
+            pytypes.util.get_callable_fq_for_code(codes[-1])
+        self.assertEqual(len(pytypes.util._code_callable_misses),
+                pytypes.util._code_callable_misses_size)
+        self.assertNotIn(codes[0], pytypes.util._code_callable_misses)
+        self.assertIn(codes[-1], pytypes.util._code_callable_misses)
+
+    def test_callable_fq_for_code_setattr(self):
+        class pytypes_setattr_cls(object):
+            pass
+        def pytypes_setattr_meth(self):
+            pass
+        code = pytypes_setattr_meth.__code__
+        glbls = globals()
+        glbls['pytypes_setattr_cls'] = pytypes_setattr_cls
+        try:
+            self.assertIsNone(pytypes.util.get_callable_fq_for_code(code)[0])
+            # Leaves the module unchanged, so the miss stays cached ...
+            setattr(pytypes_setattr_cls, 'pytypes_setattr_meth', pytypes_setattr_meth)
+            self.assertIsNone(pytypes.util.get_callable_fq_for_code(code)[0])
+            # ... until signatures are invalidated.
+            pytypes.invalidate_signature_cache()
+            res = pytypes.util.get_callable_fq_for_code(code)
+            self.assertIs(res[0], pytypes_setattr_meth)
+            self.assertEqual(res[1], [pytypes_setattr_cls])
+        finally:
+            del glbls['pytypes_setattr_cls']
+            pytypes.util._code_callable_dict.pop(code, None)
+
+    def test_resolve_fw_decl_scope(self):
+        mod_a = type(sys)('pytypes_test_fw_a')
+        mod_b = type(sys)('pytypes_test_fw_b')
+        mod_a.Node = int
+        mod_b.Node = str
+        sys.modules[mod_a.__name__] = mod_a
+        sys.modules[mod_b.__name__] = mod_b
+        try:
+            self.assertIs(resolve_fw_decl('Node', mod_a.__name__,
+                    search_stack_depth=0)[0], int)
+            self.assertIs(resolve_fw_decl('Node', mod_b.__name__,
+                    search_stack_depth=0)[0], str)
+        finally:
+            del sys.modules[mod_a.__name__]
+            del sys.modules[mod_b.__name__]
+
+        def make_func():
+            class Local(object):
+                pass
+            def func(x):
+                return Local
+            return func
+        func1 = make_func()
+        func2 = make_func()
+        res1 = resolve_fw_decl('Local', __name__, search_stack_depth=0, func=func1)[0]
+        res2 = resolve_fw_decl('Local', __name__, search_stack_depth=0, func=func2)[0]
+        self.assertIs(res1, func1(None))
+        self.assertIs(res2, func2(None))
+        self.assertIsNot(res1, res2)
+
+        view = pytypes.util.get_function_perspective_view(__name__)
+        self.assertIs(view['testClass'], testClass)
+        self.assertEqual(len(view.maps), 1)
+        self.assertIs(view['mod_a'], mod_a)
+        self.assertEqual(view.get('pytypes_undefined_name', 1), 1)
+
+        # Unlike get_function_perspective_globals, the module beats frame locals.
+        def frame_with_local():
+            testClass = int
+            return (pytypes.util.get_function_perspective_globals(__name__, 0, 2),
+                    pytypes.util.get_function_perspective_view(__name__, None, 0, 2),
+                    pytypes.util.get_function_perspective_view(None, None, 0, 2))
+        globs, view, frames_view = frame_with_local()
+        self.assertIs(globs['testClass'], int)
+        self.assertIs(view['testClass'], testClass)
+        self.assertIs(frames_view['testClass'], int)
+        self.assertFalse(view.used_frame_locals)
+        self.assertTrue(frames_view.used_frame_locals)
+
+        # Results from frame locals are not cached per module.
+        def resolve_in_frame(tp):
+            pytypes_fw_local = tp
+            return resolve_fw_decl('pytypes_fw_local', __name__, level=1)[0]
+        self.assertIs(resolve_in_frame(int), int)
+        self.assertIs(resolve_in_frame(str), str)
+        self.assertNotIn(('pytypes_fw_local', __name__), pytypes.type_util._fw_resolve_cache)
+
+        # For stubs, the original module beats the stub.
+        mod_stub = type(sys)(mod_a.__name__+'.pyi')
+        mod_stub.Node = float
+        mod_stub.Stub_only = bytes
+        sys.modules[mod_a.__name__] = mod_a
+        sys.modules[mod_stub.__name__] = mod_stub
+        try:
+            view = pytypes.util.get_function_perspective_view(mod_stub.__name__)
+            globs = pytypes.util.get_function_perspective_globals(mod_stub.__name__)
+            self.assertIs(view['Node'], int)
+            self.assertIs(globs['Node'], int)
+            self.assertIs(view['Stub_only'], bytes)
+        finally:
+            del sys.modules[mod_a.__name__]
+            del sys.modules[mod_stub.__name__]
+
     # See: https://github.com/Stewori/pytypes/issues/35
     def test_frozenset(self):
         self.assertTrue(is_of_type(frozenset({1, 2, 'a', None, 'b'}), typing.AbstractSet[typing.Union[str, int, None]]))
 
+    def test_deep_type_recursion(self):
+        a = [1]
+        rec = [1]
+        rec.append(rec)
+        dct = {'x': 1}
+        dct['y'] = dct
+        self.assertEqual(pytypes.deep_type(rec), List[Union[int, list]])
+        self.assertEqual(pytypes.deep_type(dct), Dict[str, Union[dict, int]])
+        self.assertEqual(pytypes.deep_type([rec, rec]), List[List[Union[int, list]]])
+        # Containers already visited when a level starts count as recursion
+        self.assertEqual(pytypes.deep_type([a, [a]]), List[Union[List[int], List[list]]])
+        self.assertEqual(pytypes.deep_type((a, a)), Tuple[List[int], List[int]])
+        wide = [[i, str(i), (i, 1.5)] for i in range(5000)]
+        self.assertEqual(pytypes.deep_type(wide),
+                List[List[Union[int, str, Tuple[int, float]]]])
+
+    def test_deep_type_interned(self):
+        tp = pytypes.deep_type({'a': [(1, 'x')], 'b': [(2, 'y'), (3, 'z')]})
+        self.assertEqual(tp, Dict[str, List[Tuple[int, str]]])
+        self.assertIs(pytypes.deep_type({'c': [(4, 'w')]}), tp)
+        self.assertIs(pytypes.deep_type([1, 'a', 2]), pytypes.deep_type([3, 'b']))
+        self.assertEqual(pytypes.deep_type([1, 'a', 2]), List[Union[int, str]])
+        self.assertEqual(pytypes.deep_type([True, 1]), List[Union[bool, int]])
+        self.assertEqual(pytypes.deep_type(frozenset([1.5])), typing.FrozenSet[float])
+
+    def test_deep_type_sample(self):
+        tmp = (pytypes.deep_type_samplesize, pytypes.deep_type_sample_seed)
+        dct = {i: i if i % 10 else str(i) for i in range(1000)}
+        st = set(float(i) if i % 10 else i for i in range(1000))
+        try:
+            pytypes.deep_type_samplesize = 5
+            pytypes.deep_type_sample_seed = 42
+            res = [pytypes.deep_type(val) for val in (dct, st) for i in range(20)]
+            # like in a new run
+            pytypes.type_util._deep_type_random = (None, None)
+            self.assertEqual([pytypes.deep_type(val) for val in (dct, st) for i in range(20)],
+                    res)
+            self.assertTrue(Dict[int, Union[int, str]] in res)
+            self.assertTrue(Set[Union[float, int]] in res)
+            self.assertTrue(all(tp in (Dict[int, int], Dict[int, Union[int, str]],
+                    Dict[int, str], Set[float], Set[Union[float, int]], Set[int])
+                    for tp in res))
+        finally:
+            pytypes.deep_type_samplesize, pytypes.deep_type_sample_seed = tmp
+        # Elements of sets respect depth
+        self.assertEqual(pytypes.deep_type({(1, (2, 3))}, 2), Set[Tuple[int, tuple]])
+
+    def test_typecomment_index(self):
+        src = '''
+@decorator
+@decorator(x=1)
+def func1(a, # type: int
+        b = 'x#y', # type: str
+        c = ('#', # ignore
+            2)
+        ):
+    # type: (...) -> float
+    pass
+
+def func2(a, b): # type: (int, str) -> None
+    async def func3(c):
+        # not a type comment
+        pass
+'''
+        index = typecomment_parser._build_typecomment_index(src.splitlines(True))
+        func1 = ('(...) -> float', ['int', 'str', None, None])
+        self.assertEqual(index[2], func1)
+        self.assertEqual(index[4], func1)
+        self.assertEqual(index[12], ('(int, str) -> None', []))
+        self.assertEqual(index[13], (None, []))
+        self.assertEqual(len(index), 4)
+
+        fd, filename = tempfile.mkstemp(suffix='.py')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(src)
+            index = typecomment_parser._get_typecomment_index(filename)
+            self.assertEqual(index[12], ('(int, str) -> None', []))
+            self.assertIs(typecomment_parser._get_typecomment_index(filename), index)
+            with open(filename, 'w') as f:
+                f.write(src.replace('None', 'int'))
+            index = typecomment_parser._get_typecomment_index(filename)
+            self.assertEqual(index[12], ('(int, str) -> int', []))
+        finally:
+            os.remove(filename)
+        self.assertIsNone(typecomment_parser._get_typecomment_index(filename))
+        self.assertEqual(typecomment_parser._get_typestrings(testfunc_sample_first, False),
+                ('(List[int], int) -> List[int]', []))
+
+    def test_typecomment_expressions(self):
+        glbls = {'typing': typing, 'testClass': testClass}
+        parse = lambda typestring: typecomment_parser._funcsigtypesfromstring(
+                typestring, glbls=glbls)
+        self.assertEqual(parse('(int, typing.List[str]) -> None'),
+                (Tuple[int, List[str]], type(None)))
+        self.assertEqual(parse('(Callable[[int], str], Tuple[int, ...]) -> type(None)'),
+                (Tuple[Callable[[int], str], Tuple[int, ...]], type(None)))
+        self.assertEqual(parse("(Optional[testClass]) -> Dict[str, 'testClass']"),
+                (Tuple[Optional[testClass]], Dict[str, 'testClass']))
+        self.assertEqual(parse('(int) -> Union[None, int]'),
+                (Tuple[int], Optional[int]))
+        self.assertEqual(parse('() -> int'), (Tuple[()], int))
+        self.assertEqual(len(glbls), 2)
+        self.assertRaises(NameError, lambda: parse('(Unknown) -> int'))
+        self.assertRaises(TypeSyntaxError, lambda: parse('(int) -> __import__("os")'))
+        self.assertRaises(TypeSyntaxError, lambda: parse('(len([1])) -> int'))
+        self.assertRaises(TypeSyntaxError, lambda: parse('(int) -> int if True else str'))
+
+    def test_typecomment_ellipsis(self):
+        def typecomment_ellipsis_func(a, b):
+            # type: (Tuple[int, ...], Callable[[int], int]) -> Tuple[str, ...]
+            return tuple(str(b(x)) for x in a)
+        self.assertEqual(get_types(typecomment_ellipsis_func),
+                (Tuple[Tuple[int, ...], Callable[[int], int]], Tuple[str, ...]))
+        checked = typechecked(typecomment_ellipsis_func)
+        self.assertEqual(checked((1, 2), lambda x: x+1), ('2', '3'))
+        self.assertRaises(InputTypeError, lambda: checked((1, 'a'), lambda x: x))
+        self.assertEqual(typecomment_parser._funcsigtypesfromstring(
+                '(Callable[..., int]) -> Tuple[int, ...]', glbls={}),
+                (Tuple[Callable[..., int]], Tuple[int, ...]))
+
+        if sys.version_info < (3, 9):
+            # Python 2 parses Tuple[int, ...] and Callable[..., int] into
+            # ExtSlice nodes, with a bare Ellipsis among the dims.
+            load = ast.Load()
+            def py2_subscript(name, dims):
+                return ast.Subscript(value=ast.Name(id=name, ctx=load),
+                        slice=ast.ExtSlice(dims=dims), ctx=load)
+            tpl = py2_subscript('Tuple', [ast.Index(value=ast.Name(id='int', ctx=load)),
+                    ast.Ellipsis()])
+            clb = py2_subscript('Callable', [ast.Ellipsis(),
+                    ast.Index(value=ast.Name(id='int', ctx=load))])
+            lookup = lambda name: getattr(typing, name, None) or \
+                    getattr(typecomment_parser._builtins, name)
+            self.assertEqual(typecomment_parser._compile_typeexpr(
+                    ast.Expression(body=tpl), 'Tuple[int, ...]')(lookup), Tuple[int, ...])
+            self.assertEqual(typecomment_parser._compile_typeexpr(
+                    ast.Expression(body=clb), 'Callable[..., int]')(lookup),
+                    Callable[..., int])
+
     # See: https://github.com/Stewori/pytypes/issues/32
     # See: https://github.com/Stewori/pytypes/issues/33
     def test_empty_values(self):
@@ -4947,6 +5769,145 @@ class Test_utils(unittest.TestCase):
         self.assertTrue(is_subtype(List[Dict[str, str]], Sequence[dict]))
         self.assertTrue(is_subtype(type(None), Optional[Dict[str, Any]]))
 
+    def test_subtype_cache(self):
+        pytypes.clear_subtype_cache()
+        self.assertTrue(is_subtype(List[int], Sequence[float]))
+        info = pytypes.subtype_cache_info()
+        self.assertEqual(info.hits, 0)
+        self.assertGreater(info.misses, 0)
+        self.assertEqual(info.maxsize, pytypes.subtype_cache_size)
+        self.assertTrue(is_subtype(List[int], Sequence[float]))
+        self.assertEqual(pytypes.subtype_cache_info().hits, 1)
+        self.assertEqual(pytypes.subtype_cache_info().misses, info.misses)
+
+        # flags are part of the cache key
+        num_tow_tmp = pytypes.apply_numeric_tower
+        pytypes.apply_numeric_tower = False
+        try:
+            self.assertFalse(is_subtype(List[int], Sequence[float]))
+        finally:
+            pytypes.apply_numeric_tower = num_tow_tmp
+        self.assertTrue(is_subtype(List[int], Sequence[float]))
+
+        # results that bind TypeVars are not cached
+        pytypes.clear_subtype_cache()
+        bt = {}
+        self.assertTrue(is_subtype(List[int], List[T], bound_typevars=bt))
+        self.assertEqual(bt[T], int)
+        self.assertFalse(any(key[1] == List[T] for key in pytypes.type_util._subtype_cache))
+        bt = {}
+        self.assertTrue(is_subtype(List[int], List[T], bound_typevars=bt))
+        self.assertEqual(bt[T], int)
+
+        # registering virtual subclasses must take effect
+        cache_abc = abc.ABCMeta('cache_abc', (object,), {})
+        class cache_cls(object):
+            pass
+        self.assertFalse(is_subtype(cache_cls, cache_abc))
+        cache_abc.register(cache_cls)
+        self.assertTrue(is_subtype(cache_cls, cache_abc))
+
+    def test_arg_binder(self):
+        def binder_plain(a, b):
+            return (a, b)
+        def binder_defaults(a, b=2, c=3):
+            return (a, b, c)
+        def binder_varargs(a, b=2, *vargs):
+            return (a, b, vargs)
+        def binder_varkw(a, b=2, **kw):
+            return (a, b, sorted(kw.items()))
+        def binder_all(a, b=2, *vargs, **kw):
+            return (a, b, vargs, sorted(kw.items()))
+        calls = [
+                (binder_plain, (1, 2), {}, (1, 2)),
+                (binder_plain, (1,), {'b': 5}, (1, 5)),
+                (binder_plain, (), {'b': 5, 'a': 4}, (4, 5)),
+                (binder_defaults, (1,), {}, (1, 2, 3)),
+                (binder_defaults, (1,), {'c': 7}, (1, 2, 7)),
+                (binder_defaults, (1, 8, 9), {}, (1, 8, 9)),
+                (binder_varargs, (1,), {}, (1, 2, ())),
+                (binder_varargs, (1, 5, 6, 7), {}, (1, 5, (6, 7))),
+                (binder_varkw, (1,), {'x': 5}, (1, 2, {'x': 5})),
+                (binder_varkw, (1,), {'b': 4, 'x': 5}, (1, 4, {'x': 5})),
+                (binder_all, (1, 3, 5), {'x': 6}, (1, 3, (5,), {'x': 6})),
+                (binder_all, (1,), {'b': 3, 'y': 7}, (1, 3, (), {'y': 7}))]
+        for func, args, kw, argskw in calls:
+            binder = pytypes.util._ArgBinder(pytypes.getargspecs(func))
+            self.assertEqual(binder.getargskw(args, kw), (argskw, False))
+            self.assertEqual(pytypes.util.getargskw(args, kw, pytypes.getargspecs(func)),
+                    argskw)
+            args2, kw2 = binder.fromargskw(argskw)
+            self.assertEqual(func(*args2, **kw2), func(*args, **kw))
+        binder = pytypes.util._ArgBinder(pytypes.getargspecs(binder_defaults))
+        self.assertTrue(binder.getargskw((), {})[1])
+        self.assertTrue(binder.getargskw((1, 2, 3, 4), {})[1])
+        # with self omitted
+        binder = pytypes.util._ArgBinder(pytypes.getargspecs(binder_all))
+        self.assertEqual(binder.fromargskw((3, (5, 6), {'x': 1}), True),
+                ((3, 5, 6), {'x': 1}))
+
+    def test_wrapper_globals(self):
+        tc_globals = dict(pytypes.typechecker.__dict__)
+        def wrapper_globals_func(a):
+            # type: (int) -> str
+            return str(a)
+        checked = typechecked(wrapper_globals_func)
+        ov = override(wrapper_globals_func, True)
+        # Decorating must not copy the module namespace into pytypes.typechecker
+        self.assertEqual(pytypes.typechecker.__dict__, tc_globals)
+        self.assertNotIn('testClass', checked.__globals__.keys())
+        self.assertIs(checked.__wrapped__, wrapper_globals_func)
+        self.assertIs(ov.__wrapped__, wrapper_globals_func)
+        self.assertEqual(checked(3), '3')
+        self.assertRaises(InputTypeError, lambda: checked('3'))
+
+    def test_subtype_cache_size(self):
+        size_tmp = pytypes.subtype_cache_size
+        pytypes.clear_subtype_cache()
+        try:
+            pytypes.subtype_cache_size = 2
+            self.assertTrue(is_subtype(int, float))
+            self.assertTrue(is_subtype(bool, int))
+            self.assertFalse(is_subtype(str, int))
+            self.assertEqual(pytypes.subtype_cache_info().currsize, 2)
+            # int, float was least recently used
+            self.assertTrue(is_subtype(int, float))
+            self.assertEqual(pytypes.subtype_cache_info().hits, 0)
+            self.assertFalse(is_subtype(str, int))
+            self.assertEqual(pytypes.subtype_cache_info().hits, 1)
+            pytypes.subtype_cache_size = 0
+            pytypes.clear_subtype_cache()
+            self.assertTrue(is_subtype(int, float))
+            self.assertEqual(pytypes.subtype_cache_info().currsize, 0)
+        finally:
+            pytypes.subtype_cache_size = size_tmp
+
+    def test_check_plan_cache_size(self):
+        size_tmp = pytypes.check_plan_cache_size
+        plan_cache = pytypes.type_util._check_plan_cache
+        pytypes.clear_check_plan_cache()
+        self.assertEqual(len(plan_cache), 0)
+        try:
+            pytypes.check_plan_cache_size = 2
+            self.assertTrue(is_of_type([1], List[int]))
+            self.assertTrue(is_of_type({'a': 1}, Dict[str, int]))
+            self.assertTrue(is_of_type((1, 'a'), Tuple[int, str]))
+            self.assertTrue(is_of_type({1.5}, Set[float]))
+            self.assertFalse(is_of_type([1], List[str]))
+            self.assertLessEqual(len(plan_cache), 2)
+            self.assertLessEqual(len(pytypes.type_util._type_check_cache), 2)
+            self.assertLessEqual(len(pytypes.type_util._plain_type_cache), 2)
+            self.assertIn(List[str], plan_cache)
+            pytypes.clear_check_plan_cache()
+            self.assertEqual(len(plan_cache), 0)
+            self.assertEqual(len(pytypes.type_util._type_check_cache), 0)
+            self.assertEqual(len(pytypes.type_util._plain_type_cache), 0)
+            pytypes.check_plan_cache_size = 0
+            self.assertTrue(is_of_type([1], List[int]))
+            self.assertEqual(len(plan_cache), 0)
+        finally:
+            pytypes.check_plan_cache_size = size_tmp
+
 
 class Test_combine_argtype(unittest.TestCase):
     def test_exceptions(self):
@@ -4981,6 +5942,289 @@ class Test_combine_argtype(unittest.TestCase):
         )
 
 
+class Test_typed_member(unittest.TestCase):
+    def test_observations(self):
+        node = pytypes.typelogger._typed_member(testfunc_log_sample_agent)
+        for i in range(1000):
+            node.add_observation(Tuple[int], int)
+        node.add_observation(Tuple[str], str)
+        node.add_observation(Tuple[int], str)
+        self.assertEqual(node.observation_counts(), [((Tuple[int], int), 1000),
+                ((Tuple[str], str), 1), ((Tuple[int], str), 1)])
+        # Argument and return types stay paired by index
+        self.assertEqual(node.arg_type_observations, [Tuple[int], Tuple[str], Tuple[int]])
+        self.assertEqual(node.ret_type_observations, [int, str, str])
+        self.assertEqual(node.stable_observations, 0)
+        self.assertEqual(str(node).split(': ', 1)[1],
+                'Tuple[Union[int, str]] -> Union[int, str]')
+        # Combining must not alter the observations
+        self.assertEqual(node.ret_type_observations, [int, str, str])
+
+    def test_observations_unhashable(self):
+        class unhashable_type(object):
+            __hash__ = None
+        tp = unhashable_type()
+        node = pytypes.typelogger._typed_member(testfunc_log_sample_agent)
+        node.add_observation(Tuple[int], tp)
+        node.add_observation(Tuple[int], tp)
+        node.add_observation(Tuple[int], int)
+        self.assertEqual(node.observation_counts(), [((Tuple[int], int), 1),
+                ((Tuple[int], tp), 2)])
+        self.assertEqual(node.arg_type_observations, [Tuple[int], Tuple[int]])
+        self.assertEqual(node.ret_type_observations, [int, tp])
+        self.assertEqual(node.stable_observations, 0)
+
+    def test_observations_type_hints(self):
+        def hinted(a):
+            # type: (int) -> str
+            return str(a)
+        node = pytypes.typelogger._typed_member(hinted,
+                argspecs=pytypes.util.getargspecs(hinted))
+        node.add_observation(Tuple[int], str)
+        node.add_observation(Tuple[int], str)
+        node.add_observation(Tuple[float], float)
+        node.add_observation(Tuple[float], float)
+        include_tmp = pytypes.typelogger_include_typehint
+        pytypes.typelogger_include_typehint = True
+        try:
+            node._add_observation_from_type_info()
+        finally:
+            pytypes.typelogger_include_typehint = include_tmp
+        # Type hints are not counted as calls and do not reset sampling stability
+        self.assertEqual(node.observation_counts(), [((Tuple[int], str), 2),
+                ((Tuple[float], float), 2)])
+        self.assertEqual(node.stable_observations, 1)
+        # ... and are not duplicated if already observed
+        self.assertEqual(node.arg_type_observations, [Tuple[int], Tuple[float]])
+        self.assertEqual(node.ret_type_observations, [str, float])
+        node = pytypes.typelogger._typed_member(hinted,
+                argspecs=pytypes.util.getargspecs(hinted))
+        node.add_observation(Tuple[float], float)
+        pytypes.typelogger_include_typehint = True
+        try:
+            node._add_observation_from_type_info()
+        finally:
+            pytypes.typelogger_include_typehint = include_tmp
+        self.assertEqual(node.observation_counts(), [((Tuple[float], float), 1)])
+        self.assertEqual(node.arg_type_observations, [Tuple[float], Tuple[int]])
+        self.assertEqual(node.ret_type_observations, [float, str])
+
+
+class Test_typelogger_sample(unittest.TestCase):
+    def _node(self, func):
+        # Removes the node from the cache, so it is not dumped at exit.
+        return pytypes.typelogger._member_cache.pop(func)
+
+    def _logged(self, node):
+        return sum(count for _, count in node.observation_counts())
+
+    def test_sample_every(self):
+        for i in range(7):
+            self.assertEqual(testfunc_log_sample_every(i), str(i))
+        node = self._node(testfunc_log_sample_every.ch_func)
+        self.assertEqual(node.calls, 7)
+        # calls 1, 4 and 7
+        self.assertEqual(self._logged(node), 3)
+
+    def test_sample_adaptive(self):
+        for i in range(6):
+            testfunc_log_sample_adaptive(i)
+        # Stable after two more int-calls, so later types are not observed any more
+        testfunc_log_sample_adaptive('abc')
+        node = self._node(testfunc_log_sample_adaptive.ch_func)
+        self.assertEqual(node.calls, 7)
+        self.assertEqual(self._logged(node), 3)
+        self.assertEqual(node.stable_observations, 2)
+        self.assertEqual(pytypes.typelogger.combine_argtype(node.arg_type_observations),
+                Tuple[int])
+
+    def test_sample_global(self):
+        tmp = pytypes.typelogging_sample
+        pytypes.typelogging_sample = 0.0
+        try:
+            for i in range(5):
+                testfunc_log_sample_global(i)
+        finally:
+            pytypes.typelogging_sample = tmp
+        node = self._node(testfunc_log_sample_global.ch_func)
+        # The first call is always logged
+        self.assertEqual(node.calls, 5)
+        self.assertEqual(self._logged(node), 1)
+
+        pytypes.typelogging_sample = 1.0
+        try:
+            for i in range(5):
+                testfunc_log_sample_global(i)
+        finally:
+            pytypes.typelogging_sample = tmp
+        node = self._node(testfunc_log_sample_global.ch_func)
+        self.assertEqual(self._logged(node), 5)
+
+    def test_sample_agent(self):
+        with pytypes.TypeLogger(include_modules=[__name__], sample=2):
+            for i in range(5):
+                testfunc_log_sample_agent(i)
+        node = self._node(testfunc_log_sample_agent)
+        self.assertEqual(node.calls, 5)
+        self.assertEqual(self._logged(node), 3)
+
+    def test_sample_policy(self):
+        self.assertRaises(ValueError, lambda: pytypes.LogSamplePolicy('often', 2))
+        self.assertRaises(ValueError, lambda: pytypes.LogSamplePolicy('probability', 1.5))
+        self.assertRaises(ValueError, lambda: pytypes.LogSamplePolicy('every', 0))
+        policy = pytypes.typelogger._get_log_sample_policy(0.25)
+        self.assertEqual((policy.mode, policy.value), ('probability', 0.25))
+        policy = pytypes.typelogger._get_log_sample_policy(10)
+        self.assertEqual((policy.mode, policy.value), ('every', 10))
+
+
+class Test_check_plan(unittest.TestCase):
+    # Check plans must behave exactly like the reference implementation,
+    # i.e. like checking via deep_type.
+    class plan_base(object):
+        pass
+
+    class plan_sub(plan_base):
+        pass
+
+    class plan_Generic(Generic[T]):
+        pass
+
+    def _plan_values(self):
+        return [1, 0, True, 2.5, 3j, 'abc', u'uvw', b'xyz', None, object(),
+                Test_check_plan.plan_base(), Test_check_plan.plan_sub(),
+                Test_check_plan.plan_Generic[int](), testClass('efgh'), [], [1, 2],
+                [1, 2.5], (), (1, 'a'), {}, {'a': 1}, set(), {1, 2}, frozenset([2.5]),
+                int, str, len, lambda x: x, (i for i in range(3))]
+
+    def _plan_container_values(self):
+        shared = [1, 2]
+        return [[1, 2, 3], [True, 1, 2.5], [1, 'a'], [None], [[1], [2, 3]], [[1], []],
+                [[], {}], [shared, shared], [[1, 2.5], ['a']], [(1, 'a'), (2, 'b')],
+                [Test_check_plan.plan_sub(), Test_check_plan.plan_base()],
+                [object(), [1]], (shared, shared), (1, 2, 3), ('a', 1, 2), (1, 'a', 2),
+                (1, [1, 2]), (1.5, [], 'a'), {'a': 1, 'b': 2.5}, {1: 'a'},
+                {'a': [1, 2], 'b': []}, {'a': (1, 'a')}, {1, 2.5}, {True, 2},
+                frozenset([(1, 'a')]), list(range(10)), [[i] for i in range(6)],
+                [(i for i in range(3))], (1, 2, True, 2.5), ('a', None, 2, 'b'),
+                (1, [1], [1]), (shared, 1, shared)]
+
+    def _plan_container_types(self):
+        return [List[int], List[float], List[Any], List[Optional[int]],
+                List[Union[int, str]], List[List[int]], List[Sequence[int]],
+                List[Tuple[int, str]], Sequence[int], Sequence[float], Sequence[Any],
+                Sequence[Union[int, str]], Sequence[List[int]], Sequence[List[float]],
+                Sequence[Test_check_plan.plan_base], Sequence[Sequence[float]],
+                Sequence[Optional[List[int]]], Sequence[Dict[str, int]],
+                Sequence[Tuple[int, str]], Tuple[int, ...], Tuple[float, ...],
+                Tuple[List[int], List[int]], Tuple[int, List[float]],
+                Tuple[float, List[int], str], Tuple[Any, ...], Tuple[Optional[int], ...],
+                Tuple[Union[float, str], ...], Tuple[List[int], ...], Dict[str, int],
+                Dict[str, float], Dict[str, List[int]], Dict[str, Sequence[float]],
+                Dict[str, Tuple[int, str]], Dict[Any, Any], Mapping[int, str], Set[int],
+                Set[float], Set[Union[int, float]], typing.AbstractSet[float],
+                typing.FrozenSet[Tuple[int, str]], Optional[List[int]],
+                Union[List[int], Dict[str, int]], Union[List[float], Tuple[int, str]]]
+
+    def _plan_types(self):
+        return [int, float, complex, bool, str, bytes, object, type(None), Any, Real,
+                Test_check_plan.plan_base, Test_check_plan.plan_sub,
+                Test_check_plan.plan_Generic[int], testClass,
+                Optional[int], Optional[float], Union[int, str], Union[float, str],
+                Union[str, Test_check_plan.plan_base], Union[int, List[int]],
+                Union[float, Dict[str, int]], Optional[Tuple[int, str]],
+                Union[Iterable[int], str], List[int], Dict[str, int], Tuple[int, str],
+                Sequence[float], Set[int], Callable[[Any], Any], type, list, tuple, dict]
+
+    def _check_outcome(self, check, val, tp):
+        try:
+            return check(val, tp)
+        except Exception as e:
+            return type(e)
+
+    def _assert_equivalent(self, values, types):
+        for val in values:
+            for tp in types:
+                self.assertEqual(self._check_outcome(is_of_type, val, tp),
+                        self._check_outcome(pytypes.type_util._isinstance_deep_type, val, tp),
+                        'is_of_type(%r, %s)' % (val, pytypes.type_str(tp)))
+
+    def test_equivalence(self):
+        self._assert_equivalent(self._plan_values(), self._plan_types())
+
+    def test_equivalence_no_numeric_tower(self):
+        tmp = pytypes.apply_numeric_tower
+        pytypes.apply_numeric_tower = False
+        try:
+            self._assert_equivalent(self._plan_values(), self._plan_types())
+        finally:
+            pytypes.apply_numeric_tower = tmp
+
+    def test_equivalence_containers(self):
+        self._assert_equivalent(self._plan_values()+self._plan_container_values(),
+                self._plan_container_types())
+
+    def test_equivalence_containers_settings(self):
+        tmp = (pytypes.covariant_Mapping, pytypes.deep_type_samplesize,
+                pytypes.default_typecheck_depth)
+        pytypes.covariant_Mapping = False
+        pytypes.deep_type_samplesize = 3
+        pytypes.default_typecheck_depth = 2
+        try:
+            self._assert_equivalent(self._plan_container_values(),
+                    self._plan_container_types())
+        finally:
+            (pytypes.covariant_Mapping, pytypes.deep_type_samplesize,
+                    pytypes.default_typecheck_depth) = tmp
+
+    def test_container_mismatch(self):
+        lst = list(range(100000))
+        self.assertTrue(is_of_type(lst, List[int]))
+        self.assertTrue(is_of_type(lst, Sequence[float]))
+        lst.append('a')
+        self.assertFalse(is_of_type(lst, List[int]))
+
+    def test_plan_cache(self):
+        plan = pytypes.type_util._get_check_plan(Optional[int])
+        self.assertIsNotNone(plan)
+        self.assertIs(pytypes.type_util._get_check_plan(Optional[int]), plan)
+        self.assertIsNotNone(pytypes.type_util._get_check_plan(Test_check_plan.plan_sub))
+        self.assertIsNone(pytypes.type_util._get_check_plan(T))
+        self.assertIsNone(pytypes.type_util._get_check_plan(
+                Test_check_plan.plan_Generic[int]))
+        self.assertIsNotNone(pytypes.type_util._get_check_plan(Sequence[Tuple[int, str]]))
+        self.assertIsNone(pytypes.type_util._get_check_plan(List[List[int]]))
+        self.assertIsNone(pytypes.type_util._get_check_plan(Sequence[Iterable[int]]))
+
+    def test_is_of_type_many(self):
+        all_of_type = lambda vals, tp: all(is_of_type(val, tp) for val in vals)
+        vals = self._plan_values()
+        for tp in self._plan_types():
+            self.assertEqual(self._check_outcome(pytypes.is_of_type_many, vals, tp),
+                    self._check_outcome(all_of_type, vals, tp), pytypes.type_str(tp))
+            for val in vals:
+                self.assertEqual(self._check_outcome(pytypes.is_of_type_many, (val, val), tp),
+                        self._check_outcome(is_of_type, val, tp))
+        self.assertTrue(pytypes.is_of_type_many([], int))
+        self.assertTrue(pytypes.is_of_type_many(iter([1, 2]), int))
+        self.assertTrue(pytypes.is_of_type_many([[1], [2, 3]], List[int]))
+        self.assertFalse(pytypes.is_of_type_many([[1], [2.5]], List[int]))
+        self.assertTrue(pytypes.is_of_type_many(list(range(100000)), Real))
+        self.assertFalse(pytypes.is_of_type_many(list(range(100000))+[None], int))
+
+    def test_is_of_type_many_array(self):
+        arr = array.array('l', range(100))
+        self.assertTrue(pytypes.is_of_type_many(arr, int))
+        self.assertTrue(pytypes.is_of_type_many(arr, float))
+        self.assertFalse(pytypes.is_of_type_many(arr, str))
+        self.assertTrue(pytypes.is_of_type_many(array.array('d'), str))
+        self.assertFalse(pytypes.is_of_type_many(array.array('d', [1.5]), int))
+        self.assertTrue(pytypes.is_of_type_many(array.array('d', [1.5]), Optional[float]))
+        mv = memoryview(array.array('d', [1.5, 2.5]))
+        self.assertEqual(pytypes.is_of_type_many(mv, float), all(is_of_type(x, float) for x in mv))
+        self.assertEqual(pytypes.is_of_type_many(mv, int), all(is_of_type(x, int) for x in mv))
+
+
 def testfunc_agent(v):
     # type: (str) -> int
     return 67
@@ -5028,6 +6272,76 @@ class Test_agent(unittest.TestCase):
         with TypeChecker():
             Test_agent_err_class()
 
+    def test_nested_agent(self):
+        with TypeChecker():
+            with TypeChecker():
+                self.assertEqual(testfunc_agent('abc'), 67)
+                self.assertRaises(InputTypeError, lambda: testfunc_agent(12))
+                restore_profiler()
+                self.assertRaises(ReturnTypeError, lambda: testfunc_agent_err('abc'))
+                restore_profiler()
+
+    def test_agent_code_decisions(self):
+        def testfunc_agent_untyped(v):
+            return v
+        agent = TypeChecker()
+        with agent:
+            self.assertEqual(testfunc_agent_untyped(12), 12)
+            self.assertEqual(testfunc_agent('abc'), 67)
+            self.assertRaises(InputTypeError, lambda: testfunc_agent(12))
+            restore_profiler()
+        self.assertEqual(agent._code_decisions[testfunc_agent_untyped.__code__],
+                pytypes.type_util._agent_log)
+        self.assertEqual(agent._code_decisions[testfunc_agent.__code__],
+                pytypes.type_util._agent_log | pytypes.type_util._agent_check)
+
+        # Code the agent cannot resolve is dismissed once, not on every call.
+        agent = TypeChecker()
+        with agent:
+            self.assertEqual(sum([i for i in range(3)]), 3)
+        decisions = [agent._code_decisions[code] for code in agent._code_decisions
+                if code.co_name == '<listcomp>']
+        if sys.version_info < (3, 12):
+            # Comprehensions are inlined from Python 3.12 on.
+            self.assertEqual(decisions, [pytypes.type_util._agent_skip])
+
+        size_tmp = pytypes.type_util._agent_cache_size
+        pytypes.type_util._agent_cache_size = 2
+        try:
+            agent = TypeChecker()
+            with agent:
+                self.assertEqual(testfunc_agent_untyped(12), 12)
+                self.assertEqual(testfunc_agent('abc'), 67)
+            self.assertEqual(len(agent._code_decisions), 2)
+        finally:
+            pytypes.type_util._agent_cache_size = size_tmp
+
+    def test_agent_modules(self):
+        with TypeChecker(exclude_modules=[testfunc_agent.__module__]):
+            self.assertEqual(testfunc_agent(12), 67)
+        with TypeChecker(include_modules=['pytypes']):
+            self.assertEqual(testfunc_agent(12), 67)
+        with TypeChecker(include_modules=[testfunc_agent.__module__]):
+            self.assertRaises(InputTypeError, lambda: testfunc_agent(12))
+            restore_profiler()
+        tmp = pytypes.profiler_exclude_modules
+        pytypes.profiler_exclude_modules = [testfunc_agent.__module__]
+        try:
+            with TypeChecker():
+                self.assertEqual(testfunc_agent(12), 67)
+        finally:
+            pytypes.profiler_exclude_modules = tmp
+
+    def test_local_function_agent(self):
+        def testfunc_agent_local(v):
+            # type: (str) -> int
+            return 68
+        with TypeChecker():
+            self.assertEqual(testfunc_agent_local('abc'), 68)
+            self.assertRaises(InputTypeError, lambda: testfunc_agent_local(12))
+            restore_profiler()
+            self.assertRaises(InputTypeError, lambda: testfunc_agent_local(13))
+
 
 @unittest.skipUnless(sys.version_info.major >= 3 and sys.version_info.minor >= 5,
         'Only applicable in Python >= 3.5.')
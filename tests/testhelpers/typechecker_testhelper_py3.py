@@ -272,6 +272,14 @@ def testfunc_None_ret_err(a: int, b: Real) -> None:
 def testfunc_None_arg(a: int, b: None) -> int:
     return a*a
 
+@typechecked
+def testfunc_kwonly(a: int, *, b: float, c: str = 'x') -> str:
+    return '-'.join((str(a), str(b), c))
+
+@typechecked
+def testfunc_kwonly_varkw(a: int, *, b: float, **kw: int) -> int:
+    return a+len(kw)
+
 @typechecked
 def testfunc_Dict_arg(a: int, b: Dict[str, Union[int, str]]) -> None:
     assert isinstance(b[str(a)], str) or isinstance(b[str(a)], int)